@@ -1,28 +1,57 @@
+import bz2
+import difflib
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import random
+import re
+import sys
+import threading
+import time
 import xml.etree.ElementTree as ET
 import mwparserfromhell
 import textwrap
 
 from tqdm import tqdm
 
-from data_loader import load_documents
-offset = 0
+from data_loader import load_relevant_entities
+from instrumentation import tracer
+from multistream import MultistreamStats, iter_pages_multistream
+from wikitext import strip_code_fast
 
-def save_pages_to_file(pages, fn):
-    with open(fn, 'w', encoding='utf-8') as file:
+FILE_SECTION_BRACKETS = re.compile(r'\[\[|\]\]')
+
+CHECKPOINT_EVERY = 10000
+
+def write_page(file, page_num, title, contents):
+    file.write(f'.I {page_num}\n')
+    file.write('.T\n')
+    file.write(f'{title}\n')
+    file.write('.W\n')
+    file.write(f'{contents}\n')
+
+def save_pages_to_file(pages, fn, offset=0):
+    with tracer.stage('write', items=len(pages)), open(fn, 'w', encoding='utf-8') as file:
         for page_num, (title, contents) in enumerate(pages.items(), start=1):
-            file.write(f'.I {page_num+offset}\n')
-            file.write('.T\n')
-            file.write(f'{title}\n')
-            file.write('.W\n')
-            file.write(f'{contents}\n')
+            write_page(file, page_num + offset, title, contents)
+
+# Titles of the pages already in an articles file, in file order
+def read_saved_titles(fn) -> list[str]:
+    titles = []
+    with open(fn, encoding='utf-8') as file:
+        previous = None
+        for line in file:
+            if previous == '.T\n':
+                titles.append(line.rstrip('\n'))
+            previous = line
+    return titles
 
 def load_dataset_article_titles():
     titles = set()
-    docs = load_documents()
-    for doc in docs:
-        entities = doc['relevantEntities']
-        for entity in entities:
-            label = entity['label']
+    for labels in load_relevant_entities().values():
+        for label in labels:
             if label.startswith('Q'):
                 if len(label) >= 2 and label[1].isdigit():
                     continue
@@ -34,37 +63,29 @@ def should_keep_page(title: str, text: str):
         return False
     return True
 
+# Drops each [[File...]] up to the ]] that balances it, skipping between brackets instead of walking every character
 def remove_file_section(line: str) -> str:
     result = []
-    i = 0
-    n = len(line)
-
-    while i < n:
-        if line.startswith('[[File', i):
-            i += 6  # skip '[[File'
-            depth = 1
-
-            while i < n and depth > 0:
-                if line.startswith('[[', i):
-                    depth += 1
-                    i += 2
-                elif line.startswith(']]', i):
-                    depth -= 1
-                    i += 2
-                else:
-                    i += 1
-
-            continue
-
-        result.append(line[i])
-        i += 1
+    start = 0
+    while (i := line.find('[[File', start)) >= 0:
+        result.append(line[start:i])
+        pos = i + 6  # skip '[[File'
+        depth = 1
+        while depth > 0:
+            bracket = FILE_SECTION_BRACKETS.search(line, pos)
+            if bracket is None:
+                pos = len(line)
+                break
+            depth += 1 if bracket.group() == '[[' else -1
+            pos = bracket.end()
+        start = pos
+    result.append(line[start:])
 
     return ''.join(result)
 
-# Remove metadata, wiki formatting, and any subsections
-def strip_page(text: str):
+# Lines up to the first subsection, minus [[File...]] sections
+def truncate_page(text: str) -> str:
     truncated = []
-    use_full = False
     for line in text.splitlines():
         if line.startswith('[[File'):
             line = remove_file_section(line)
@@ -75,13 +96,21 @@ def strip_page(text: str):
         truncated.append(line)
     joined = '\n'.join(truncated)
 
-    joined = (joined.replace('}}</onlyinclude>', '')
-              .replace('<onlyinclude>{{#ifeq:', ''))
-
-    wikicode = mwparserfromhell.parse(joined)
-
-    stripped = wikicode.strip_code()
-
+    return (joined.replace('}}</onlyinclude>', '')
+            .replace('<onlyinclude>{{#ifeq:', ''))
+
+# 'auto' takes the regex fast path and falls back to mwparserfromhell for pages it can't handle;
+# 'mwparser' always parses. Also says whether the fast path was used.
+def strip_wikitext(text: str, engine='auto') -> tuple[str, bool]:
+    if engine == 'auto':
+        stripped = strip_code_fast(text)
+        if stripped is not None:
+            return stripped, True
+    elif engine != 'mwparser':
+        raise ValueError(f'Unknown strip engine: {engine}')
+    return mwparserfromhell.parse(text).strip_code(), False
+
+def normalize_stripped(stripped: str) -> str:
     stripped = (stripped.replace('( ; ) ', '')
                 .replace('( ) ', '')
                 .replace('() ', '')
@@ -90,9 +119,6 @@ def strip_page(text: str):
                 .replace('. ', ' . ')
                 .replace('.\n', ' .\n')
                 .replace('  ', ' '))
-    if len(stripped) == 0:
-        print(text)
-
     if len(stripped) > 0 and stripped[-1] == '.':
         stripped = stripped[:-1] + ' .'
 
@@ -104,43 +130,387 @@ def strip_page(text: str):
 
     return '\n'.join(wrapped_lines)
 
-def parse_pages(path, titles_to_filter: set[str], batch_num):
+def strip_page_with_engine(text: str, engine='auto') -> tuple[str, bool]:
+    stripped, used_fast = strip_wikitext(truncate_page(text), engine)
+    return normalize_stripped(stripped), used_fast
+
+# Remove metadata, wiki formatting, and any subsections
+def strip_page(text: str, engine='auto'):
+    return strip_page_with_engine(text, engine)[0]
+
+def iter_pages_tree(path, batch_num):
     tree = ET.parse(path)
 
     root = tree.getroot()
 
     ns = {'mw': 'http://www.mediawiki.org/xml/export-0.11/'}
 
-    pages = {}
-    count = 0
     for page in tqdm(root.findall('./mw:page', ns), desc=f'Processing pages for batch {batch_num}'):
-        title = page.find('mw:title', ns).text
-        text = page.find('mw:revision/mw:text', ns).text
+        yield page.find('mw:title', ns).text, page.find('mw:revision/mw:text', ns).text
+
+# Streams <page> elements one at a time and frees each after it is handled, so memory stays flat
+# regardless of dump size. Reads .bz2 dumps (including multistream ones) directly.
+def iter_pages_streaming(path, batch_num):
+    with open(path, 'rb') as raw:
+        source = bz2.BZ2File(raw) if path.endswith('.bz2') else raw
+        with tqdm(total=os.path.getsize(path), unit='B', unit_scale=True,
+                  desc=f'Processing pages for batch {batch_num}') as progress:
+            context = ET.iterparse(source, events=('start', 'end'))
+            _, root = next(context)
+            ns = root.tag[:root.tag.index('}') + 1] if root.tag.startswith('{') else ''
+            for event, elem in context:
+                if event != 'end' or elem.tag != f'{ns}page':
+                    continue
+                title = elem.find(f'{ns}title')
+                text = elem.find(f'{ns}revision/{ns}text')
+                yield (title.text if title is not None else None,
+                       text.text if text is not None else None)
+
+                root.clear()
+                progress.update(raw.tell() - progress.n)
+
+def is_wanted_page(title, text, titles_to_filter: set[str]) -> bool:
+    tracer.count('pages_read')
+    if title is None or text is None:
+        tracer.count('pages_missing_text')
+        return False
+    if title not in titles_to_filter:
+        return False
+    if not should_keep_page(title, text):
+        tracer.count('pages_redirect_skipped')
+        return False
+    tracer.count('pages_kept')
+    return True
 
-        if title is None or text is None:
-            continue
-        if title not in titles_to_filter:
-            continue
-        if not should_keep_page(title, text):
-            continue
+def filter_pages(pages_iter, titles_to_filter: set[str]):
+    for title, text in pages_iter:
+        if is_wanted_page(title, text, titles_to_filter):
+            yield title, text
+
+def record_stripped(title, stripped, used_fast):
+    tracer.count('strip_fast' if used_fast else 'strip_fallback')
+    if len(stripped) == 0:
+        tracer.count('pages_empty_strip')
+        tracer.event('empty_strip', title=title)
 
-        pages[title] = strip_page(text)
-        count += 1
+def parse_pages(path, titles_to_filter: set[str], batch_num, streaming=True):
+    pages_iter = iter_pages_streaming(path, batch_num) if streaming else iter_pages_tree(path, batch_num)
+
+    pages = {}
+    strip_time = 0.0
+    with tracer.stage('parse', batch=batch_num) as stage:
+        for title, text in filter_pages(pages_iter, titles_to_filter):
+            start = time.perf_counter()
+            pages[title], used_fast = strip_page_with_engine(text)
+            strip_time += time.perf_counter() - start
+            record_stripped(title, pages[title], used_fast)
+            stage.add()
+        stage.fields['strip_s'] = strip_time
 
     return pages
 
-def main():
-    titles_to_filter = load_dataset_article_titles()
+def strip_page_item(item):
+    title, text = item
+    return title, *strip_page_with_engine(text)
+
+# Pool.imap pulls its input as fast as it can; this caps how many pages are read ahead of the writer.
+# It runs on the pool's task thread, which terminate() waits for, so once stop is set it hands out nothing more.
+def bounded(items, slots: threading.Semaphore, stop: threading.Event):
+    for item in items:
+        slots.acquire()
+        if stop.is_set():
+            return
+        yield item
+
+# Wakes a bounded() waiting on a slot the consumer will never release now, e.g. because it raised
+def stop_bounded(slots: threading.Semaphore, stop: threading.Event, limit: int):
+    stop.set()
+    slots.release(limit)
+
+# Same result as calling parse_pages on each batch in turn and merging the dicts, with strip_page
+# spread over a process pool. imap hands results back in input order, so ids stay stable.
+def parse_pages_parallel(paths: list[str], titles_to_filter: set[str], workers=None, chunksize=8):
+    workers = workers or os.cpu_count()
+    limit = workers * chunksize * 4
+    slots, stop = threading.Semaphore(limit), threading.Event()
+
+    def wanted_pages():
+        for batch_num, path in enumerate(paths, start=1):
+            yield from filter_pages(iter_pages_streaming(path, batch_num), titles_to_filter)
 
-    all_pages = {}
-    for batch_num in range(1, 4):
-        path = f'../data/raw-wiki/enwiki-latest-pages-articles-multistream{batch_num}.xml'
+    pages = {}
+    with tracer.stage('parse', workers=workers) as stage, multiprocessing.Pool(workers) as pool:
+        try:
+            items = bounded(wanted_pages(), slots, stop)
+            for title, stripped, used_fast in pool.imap(strip_page_item, items, chunksize):
+                pages[title] = stripped
+                record_stripped(title, stripped, used_fast)
+                stage.add()
+                slots.release()
+        finally:
+            # Before the pool's exit terminates it
+            stop_bounded(slots, stop, limit)
+
+    return pages
 
-        pages = parse_pages(path, titles_to_filter, batch_num)
-        all_pages.update(pages)
+def parse_pages_multistream(dump_path, index_path, titles_to_filter: set[str]):
+    stats = MultistreamStats(os.path.getsize(dump_path))
+    pages_iter = iter_pages_multistream(dump_path, index_path, titles_to_filter, stats)
+
+    pages = {}
+    with tracer.stage('parse', multistream=True) as stage:
+        for title, text in filter_pages(pages_iter, titles_to_filter):
+            pages[title], used_fast = strip_page_with_engine(text)
+            record_stripped(title, pages[title], used_fast)
+            stage.add()
+        stage.fields.update(streams_read=stats.streams_read, bytes_read=stats.bytes_read)
+
+    print(stats)
+    return pages
+
+# Resume points travel through the pool between pages as (batch, page, None, None): every page before
+# that page of that batch has been handled once the marker comes out the other side
+def strip_checkpoint_item(item):
+    batch_num, page_num, title, text = item
+    if text is None:
+        return item
+    return (batch_num, page_num, *strip_page_item((title, text)))
+
+def get_titles_digest(titles: set[str]) -> str:
+    return hashlib.sha256('\n'.join(sorted(titles)).encode('utf-8')).hexdigest()
+
+def save_json_atomic(data, path):
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as file:
+        json.dump(data, file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, path)
+
+# The saved resume point, if it was left by a run over the same dumps and titles
+def load_checkpoint(checkpoint_path, settings: dict) -> dict | None:
+    if not os.path.exists(checkpoint_path):
+        return None
+    with open(checkpoint_path, encoding='utf-8') as file:
+        checkpoint = json.load(file)
+    if any(checkpoint.get(key) != value for key, value in settings.items()):
+        return None
+    return checkpoint
+
+# Like parse_pages over each batch followed by save_pages_to_file, but pages are appended to fn as they are
+# stripped and fn.checkpoint.json records how far the scan got (batch and page offset, plus how much of fn
+# is complete) every checkpoint_every pages and at the end of each batch. Running it again picks up from
+# there: anything fn gained after the last checkpoint is cut off and rescanned. Resuming still parses the
+# XML up to the checkpointed page (iterparse can't start mid-dump), it only skips stripping and writing
+# those pages again. Without a checkpoint for these dumps and titles, fn is written from scratch. The scan
+# stops as soon as every title has been seen (a redirect counts, it won't turn up again as an article), and
+# fn.manifest.json lists the titles found, those that were redirects and those still missing.
+# A title that turns up more than once keeps its first page.
+def extract_pages_checkpointed(paths: list[str], titles_to_filter: set[str], fn, workers=1,
+                               checkpoint_every=CHECKPOINT_EVERY, chunksize=8) -> dict:
+    base = os.path.splitext(fn)[0]
+    checkpoint_path, manifest_path = base + '.checkpoint.json', base + '.manifest.json'
+    settings = {'paths': [os.path.abspath(path) for path in paths], 'titles': get_titles_digest(titles_to_filter)}
+
+    checkpoint = load_checkpoint(checkpoint_path, settings) if os.path.exists(fn) else None
+    # Only a checkpoint whose complete part is still all there can be resumed from
+    resuming = checkpoint is not None and os.path.getsize(fn) >= checkpoint['output_bytes']
+    if resuming:
+        with open(fn, 'r+b') as file:
+            file.truncate(checkpoint['output_bytes'])
+        found = read_saved_titles(fn)
+        print(f"Resuming at batch {checkpoint['batch']}, page {checkpoint['page']} with {len(found)} pages saved")
+    else:
+        checkpoint = dict(settings, batch=1, page=0, output_bytes=0, redirects=[])
+        found = []
+
+    # Titles not yet handed out for stripping; the scan stops once it is empty
+    redirects = list(checkpoint['redirects'])
+    wanted = titles_to_filter - set(found) - set(redirects)
+    scan = {'stopped_early': False}
+
+    def wanted_pages():
+        for batch_num, path in enumerate(paths, start=1):
+            if batch_num < checkpoint['batch']:
+                continue
+            start_page = checkpoint['page'] if batch_num == checkpoint['batch'] else 0
+            for page_num, (title, text) in enumerate(iter_pages_streaming(path, batch_num)):
+                if not wanted:
+                    scan['stopped_early'] = True
+                    return
+                if page_num < start_page:
+                    continue
+                if page_num > start_page and page_num % checkpoint_every == 0:
+                    yield batch_num, page_num, None, None
+                if is_wanted_page(title, text, wanted):
+                    wanted.discard(title)
+                    yield batch_num, page_num, title, text
+                elif title in wanted and text is not None:
+                    wanted.discard(title)
+                    redirects.append(title)
+            yield batch_num + 1, 0, None, None
+
+    def save_checkpoint(file, batch_num, page_num):
+        file.flush()
+        os.fsync(file.fileno())
+        # Redirects the scan has passed beyond this point are kept too; they'd only be seen again
+        checkpoint.update(batch=batch_num, page=page_num, output_bytes=file.tell(), redirects=redirects[:])
+        save_json_atomic(checkpoint, checkpoint_path)
+
+    workers = workers or os.cpu_count()
+    limit = workers * chunksize * 4
+    slots, stop = threading.Semaphore(limit), threading.Event()
+    with tracer.stage('parse', workers=workers, checkpointed=True) as stage, \
+            open(fn, 'ab' if resuming else 'wb') as file:
+        if not resuming:
+            # Whatever fn held before is gone; a checkpoint left from then must not be resumed against it
+            save_checkpoint(file, 1, 0)
+        pool = multiprocessing.Pool(workers) if workers > 1 else None
+        try:
+            items = bounded(wanted_pages(), slots, stop)
+            results = pool.imap(strip_checkpoint_item, items, chunksize) if pool else map(strip_checkpoint_item, items)
+            for batch_num, page_num, title, stripped, *used_fast in results:
+                slots.release()
+                if title is None:
+                    save_checkpoint(file, batch_num, page_num)
+                    continue
+                # Bytes rather than text so file.tell() is an offset that truncate() can take back to
+                buffer = io.StringIO()
+                write_page(buffer, len(found) + 1, title, stripped)
+                file.write(buffer.getvalue().encode('utf-8'))
+                found.append(title)
+                record_stripped(title, stripped, used_fast[0])
+                stage.add()
+        finally:
+            stop_bounded(slots, stop, limit)
+            if pool is not None:
+                pool.terminate()
+        # Nothing is left to scan, whether or not every batch was read
+        save_checkpoint(file, len(paths) + 1, 0)
+        stage.fields['stopped_early'] = scan['stopped_early']
+
+    missing = sorted(titles_to_filter - set(found) - set(redirects))
+    manifest = {'found': found, 'redirects': sorted(set(redirects)), 'missing': missing,
+                'stopped_early': scan['stopped_early']}
+    save_json_atomic(manifest, manifest_path)
+    print(f"{len(found)} of {len(titles_to_filter)} titles extracted, {len(manifest['redirects'])} redirects, "
+          f"{len(missing)} missing"
+          + (', stopped before the end of the dumps' if scan['stopped_early'] else ''))
+    return manifest
+
+def report_strip_engine():
+    fast, fallback = tracer.counters['strip_fast'], tracer.counters['strip_fallback']
+    if fast + fallback:
+        print(f'Fast strip path: {fast}/{fast + fallback} pages ({fast / (fast + fallback):.1%}), '
+              f'{fallback} parsed with mwparserfromhell')
+
+# Uniform sample of the pages that would be stripped (all non-redirect pages unless titles are given)
+def sample_pages(paths: list[str], sample_size: int, seed=0, titles_to_filter: set[str] = None):
+    rng = random.Random(seed)
+    sample = []
+    seen = 0
+    for batch_num, path in enumerate(paths, start=1):
+        for title, text in iter_pages_streaming(path, batch_num):
+            if title is None or text is None or not should_keep_page(title, text):
+                continue
+            if titles_to_filter is not None and title not in titles_to_filter:
+                continue
+            seen += 1
+            if len(sample) < sample_size:
+                sample.append((title, text))
+            elif (slot := rng.randrange(seen)) < sample_size:
+                sample[slot] = (title, text)
+    return sample
+
+# Differential check of the fast path: strips every page with both engines and diffs the output wherever
+# the fast path didn't fall back. Mismatches are written to diff_path as unified diffs.
+def compare_strip_engines(pages, diff_path=None) -> dict:
+    fast_time = parser_time = fallback_time = 0.0
+    fast_pages = mismatches = 0
+    diffs = []
+    for title, text in tqdm(pages, desc='Comparing strip engines'):
+        source = truncate_page(text)
+        start = time.perf_counter()
+        fast = strip_code_fast(source)
+        fast_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        expected = mwparserfromhell.parse(source).strip_code()
+        parser_time += time.perf_counter() - start
+
+        if fast is None:
+            fallback_time += time.perf_counter() - start
+            continue
+        fast_pages += 1
+        if fast != expected:
+            mismatches += 1
+            diffs.extend(difflib.unified_diff(expected.splitlines(), fast.splitlines(),
+                                              f'{title} (mwparserfromhell)', f'{title} (fast)', lineterm=''))
+
+    if diff_path is not None and diffs:
+        os.makedirs(os.path.dirname(diff_path), exist_ok=True)
+        with open(diff_path, 'w', encoding='utf-8') as file:
+            file.write('\n'.join(diffs) + '\n')
+
+    auto_time = fast_time + fallback_time
+    return {
+        'pages': len(pages),
+        'fast_pages': fast_pages,
+        'hit_rate': fast_pages / len(pages) if pages else 0.0,
+        'matches': fast_pages - mismatches,
+        'mismatches': mismatches,
+        'mwparser_s': parser_time,
+        'auto_s': auto_time,
+        'speedup': parser_time / auto_time if auto_time > 0 else None,
+    }
+
+def get_batch_path(batch_num):
+    path = f'../data/raw-wiki/enwiki-latest-pages-articles-multistream{batch_num}.xml'
+    if not os.path.exists(path):
+        path += '.bz2'
+    return path
+
+def main(workers=None, use_multistream_index=False, checkpointed=False):
+    with tracer.stage('load_titles') as stage:
+        titles_to_filter = load_dataset_article_titles()
+        stage.add(len(titles_to_filter))
+
+    paths = [get_batch_path(batch_num) for batch_num in range(1, 4)]
+    if checkpointed:
+        extract_pages_checkpointed(paths, titles_to_filter, f'../data/processed/articles-1.txt', workers)
+        report_strip_engine()
+        tracer.flush()
+        return
+    if use_multistream_index:
+        all_pages = parse_pages_multistream('../data/raw-wiki/enwiki-latest-pages-articles-multistream.xml.bz2',
+                                            '../data/raw-wiki/enwiki-latest-pages-articles-multistream-index.txt.bz2',
+                                            titles_to_filter)
+    elif workers == 1:
+        all_pages = {}
+        for batch_num, path in enumerate(paths, start=1):
+            pages = parse_pages(path, titles_to_filter, batch_num)
+            all_pages.update(pages)
+    else:
+        all_pages = parse_pages_parallel(paths, titles_to_filter, workers)
 
     save_pages_to_file(all_pages, f'../data/processed/articles-1.txt')
+    report_strip_engine()
+    tracer.flush()
 
 
+# python article_extractor.py [checkpointed]  or  python article_extractor.py diff-strip [sample_size [seed]]
 if __name__ == '__main__':
-    main()
+    if sys.argv[1:2] == ['checkpointed']:
+        main(checkpointed=True)
+    elif sys.argv[1:2] == ['diff-strip']:
+        sample_size = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+        seed = int(sys.argv[3]) if len(sys.argv) > 3 else 0
+        paths = [get_batch_path(batch_num) for batch_num in range(1, 4)]
+        diff_path = '../data/results/strip_engine_diff.txt'
+        result = compare_strip_engines(sample_pages(paths, sample_size, seed), diff_path)
+        print(result)
+        if result['mismatches']:
+            print(f'Differences written to {diff_path}')
+            sys.exit(1)
+    else:
+        main()
@@ -0,0 +1,80 @@
+import os
+import numpy as np
+import scipy.sparse as sp
+from tqdm import tqdm
+
+from data_loader import DATA_DIR
+from idf_table import IdfTable
+from inverted_index import InvertedIndex, get_query_weights
+from query_vectorizer import get_query_idf, get_tf_scores, load_index, load_queries, save_ranking
+
+
+# Documents x terms, each row scaled to unit length
+def build_document_matrix(index: InvertedIndex) -> sp.csr_matrix:
+    num_terms = len(index.offsets) - 1
+    matrix = sp.csc_matrix((index.weights, index.doc_indices, index.offsets), shape=(index.num_docs, num_terms)).tocsr()
+    norms = index.norms.copy()
+    norms[norms == 0] = 1
+    matrix.data /= np.repeat(norms, np.diff(matrix.indptr))
+    return matrix
+
+
+# Queries x terms in the index's term space, each row unit length
+def build_query_matrix(index: InvertedIndex, query_tf: list[dict[str, float]], query_idf: IdfTable) -> sp.csr_matrix:
+    rows, cols, values = [], [], []
+    for row, tf in enumerate(query_tf):
+        for term_id, weight in get_query_weights(index, tf, query_idf).items():
+            rows.append(row)
+            cols.append(term_id)
+            values.append(weight)
+
+    return sp.csr_matrix((values, (rows, cols)), shape=(len(query_tf), len(index.vocabulary)), dtype=np.float64)
+
+
+# Indices of the k highest scores, ties broken by the lower document index
+def select_top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    k = min(k, len(scores))
+    if k == 0:
+        return np.empty(0, dtype=np.int64)
+    threshold = scores[np.argpartition(-scores, k - 1)[k - 1]]
+    candidates = np.flatnonzero(scores >= threshold)
+    order = np.lexsort((candidates, -scores[candidates]))
+    return candidates[order[:k]]
+
+
+# Yields (top doc indices, their scores) per query row. Queries are scored in chunks so the dense
+# chunk x documents score block stays within memory_budget bytes.
+def score_batched(doc_matrix: sp.csr_matrix, query_matrix: sp.csr_matrix, k: int = 10,
+                  memory_budget: int = 512 * 1024 * 1024):
+    num_queries, num_docs = query_matrix.shape[0], doc_matrix.shape[0]
+    chunk_size = max(1, memory_budget // (max(num_docs, 1) * np.dtype(np.float64).itemsize * 2))
+    doc_matrix_t = doc_matrix.T.tocsr()
+
+    for start in range(0, num_queries, chunk_size):
+        block = (query_matrix[start:start + chunk_size] @ doc_matrix_t).toarray()
+        for scores in block:
+            top = select_top_k(scores, k)
+            yield top, scores[top]
+
+
+def main(k=10, memory_budget_mb=512, query_idf_mode='corpus'):
+    queries, query_ids = load_queries(os.path.join(DATA_DIR, "processed/keysearch.qry"))
+    query_tf = get_tf_scores(queries)
+
+    index, doc_idf = load_index(os.path.join(DATA_DIR, "processed/articles-1.txt"))
+    query_idf = get_query_idf(queries, doc_idf, query_idf_mode)
+
+    doc_matrix = build_document_matrix(index)
+    query_matrix = build_query_matrix(index, query_tf, query_idf)
+
+    output_lines = []
+    results = score_batched(doc_matrix, query_matrix, k, memory_budget_mb * 1024 * 1024)
+    for qid, (top, scores) in enumerate(tqdm(results, total=len(queries), desc="Processing queries")):
+        for rank, (doc_idx, sim_score) in enumerate(zip(top, scores)):
+            output_lines.append(f'{query_ids[qid]} {index.doc_ids[doc_idx]} {rank + 1} {float(sim_score)}\n')
+
+    save_ranking(output_lines, "ranking_output_batch.txt")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,216 @@
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+import numpy as np
+
+from article_extractor import filter_pages, iter_pages_streaming, strip_page
+from batch_scorer import build_document_matrix, build_query_matrix, score_batched
+from compact_corpus import build_compact_corpus
+from data_loader import DATA_DIR, PROJECT_ROOT
+from evaluator import Qrels, evaluate_run
+from idf_table import build_idf_table, get_query_vector
+from inverted_index import build_inverted_index, top_documents
+from postings_codec import encode_postings
+from query_vectorizer import filter_words, get_idf_scores_dict, get_tf_scores, parse_documents, word_tokenizer
+from result_rewriter import parse_documents as parse_titles
+from synthetic_corpus import SCALES, generate_corpus
+
+BENCHMARK_DIR = os.path.join(DATA_DIR, "results/benchmarks")
+
+
+# Runs func `repeat` times for wall/CPU time (best and median), then once more under tracemalloc for the
+# peak of Python-visible allocations during the stage. Timing runs are kept free of tracemalloc overhead.
+def measure(stage: str, func, count=len, repeat=1, profile_memory=True, before=None):
+    walls, cpus = [], []
+    result = None
+    for _ in range(repeat):
+        if before is not None:
+            before()
+        gc.collect()
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        result = func()
+        walls.append(time.perf_counter() - wall_start)
+        cpus.append(time.process_time() - cpu_start)
+
+    peak = None
+    if profile_memory:
+        if before is not None:
+            before()
+        gc.collect()
+        tracemalloc.start()
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    items = count(result)
+    wall = min(walls)
+    record = {
+        'stage': stage,
+        'items': items,
+        'wall_s': wall,
+        'wall_median_s': float(np.median(walls)),
+        'cpu_s': min(cpus),
+        'items_per_s': items / wall if wall > 0 else None,
+        'peak_alloc_mb': peak / (1024 * 1024) if peak is not None else None,
+    }
+    print(f"{stage:<16} {items:>9} items  {wall:8.3f}s wall  {record['cpu_s']:8.3f}s cpu"
+          + (f"  {record['peak_alloc_mb']:8.1f} MB peak" if peak is not None else ''))
+    return result, record
+
+
+def get_commit() -> str | None:
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=PROJECT_ROOT, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=PROJECT_ROOT,
+                               capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ('-dirty' if dirty else '')
+
+
+# Synthetic qrels: a few documents per query, drawn with a fixed seed
+def get_synthetic_expected(num_queries: int, num_docs: int, seed=0) -> dict[int, np.ndarray]:
+    rng = np.random.default_rng(seed)
+    return {query_num: np.unique(rng.integers(1, num_docs + 1, size=rng.integers(1, 20)))
+            for query_num in range(1, num_queries + 1)}
+
+
+def run_benchmarks(scale='small', repeat=1, profile_memory=True, seed=0, k=10) -> dict:
+    config = dict(SCALES[scale], seed=seed)
+    corpus_dir = os.path.join(DATA_DIR, "cache/benchmark", f"{scale}-{seed}")
+    paths = {name: os.path.join(corpus_dir, rel) for name, rel in
+             (('articles', 'processed/articles-1.txt'), ('queries', 'processed/keysearch.qry'),
+              ('xml', 'raw-wiki/synthetic.xml'))}
+    if not all(os.path.exists(path) for path in paths.values()):
+        paths = generate_corpus(corpus_dir, **config)
+
+    def options(**kwargs):
+        return dict({'repeat': repeat, 'profile_memory': profile_memory}, **kwargs)
+
+    stages = []
+    (documents, doc_ids), record = measure('parse_documents', lambda: parse_documents(paths['articles']),
+                                           count=lambda r: len(r[0]), **options())
+    stages.append(record)
+    # Cold stem cache each run, as on a first pass over a new corpus
+    documents, record = measure('filter_words', lambda: filter_words(documents),
+                                before=lambda: word_tokenizer.cache.clear(), **options())
+    stages.append(record)
+    _, record = measure('get_idf_scores', lambda: get_idf_scores_dict(documents), **options())
+    stages.append(record)
+
+    doc_idf = build_idf_table(documents)
+    index, record = measure('build_index', lambda: build_inverted_index(get_tf_scores(documents), doc_idf, doc_ids),
+                            count=lambda r: r.num_docs, **options())
+    stages.append(record)
+    # The codec stores term counts, which the compact corpus has in the same postings layout
+    corpus = build_compact_corpus(zip(doc_ids, documents))
+    terms, docs, counts = corpus.get_term_doc_counts()
+    offsets = np.zeros(corpus.num_terms + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(np.bincount(terms, minlength=corpus.num_terms))
+    postings, record = measure('encode_postings', lambda: encode_postings(offsets, docs, counts),
+                               count=lambda r: r.num_postings, **options())
+    stages.append(record)
+    _, record = measure('decode_postings', postings.decode_all, count=lambda r: len(r[0]), **options())
+    stages.append(record)
+
+    queries, query_ids = parse_documents(paths['queries'])
+    queries = filter_words(queries)
+    query_tf = get_tf_scores(queries)
+    query_idf = build_idf_table(queries)
+
+    def score_legacy():
+        return [top_documents(index, query, get_query_vector(query, query_tf[qid], query_idf), k)
+                for qid, query in enumerate(queries)]
+
+    _, record = measure('score_legacy', score_legacy, **options())
+    stages.append(record)
+
+    doc_matrix = build_document_matrix(index)
+
+    def score_batch():
+        return list(score_batched(doc_matrix, build_query_matrix(index, query_tf, doc_idf), k))
+
+    batch_results, record = measure('score_batch', score_batch, **options())
+    stages.append(record)
+
+    titles = set(parse_titles(paths['articles']).values())
+    pages, record = measure('parse_xml', lambda: list(filter_pages(iter_pages_streaming(paths['xml'], 1), titles)),
+                            **options())
+    stages.append(record)
+    _, record = measure('strip_page', lambda: [strip_page(text) for _, text in pages], **options())
+    stages.append(record)
+    _, record = measure('strip_mwparser', lambda: [strip_page(text, engine='mwparser') for _, text in pages],
+                        **options())
+    stages.append(record)
+
+    run_path = os.path.join(corpus_dir, 'run.txt')
+    with open(run_path, 'w') as out:
+        for qid, (top, scores) in enumerate(batch_results):
+            for rank, (doc_idx, score) in enumerate(zip(top, scores)):
+                out.write(f'{query_ids[qid]} {index.doc_ids[doc_idx]} {rank + 1} {float(score)}\n')
+    qrels = Qrels(get_synthetic_expected(len(queries), index.num_docs, seed))
+    _, record = measure('evaluate_run', lambda: evaluate_run(run_path, qrels, k), count=lambda r: len(r['query']),
+                        **options())
+    stages.append(record)
+
+    return {
+        'commit': get_commit(),
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'scale': scale,
+        'config': config,
+        'repeat': repeat,
+        'stages': stages,
+    }
+
+
+def save_benchmark(results: dict) -> str:
+    os.makedirs(BENCHMARK_DIR, exist_ok=True)
+    path = os.path.join(BENCHMARK_DIR, f"benchmark-{results['scale']}-{results['commit'] or 'unknown'}.json")
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump(results, file, indent=2)
+    return path
+
+
+# Wall time of each stage in new relative to old; ratios above threshold are flagged
+def compare_benchmarks(old_path, new_path, threshold=1.1) -> list[tuple[str, float]]:
+    with open(old_path, encoding='utf-8') as file:
+        old = {stage['stage']: stage for stage in json.load(file)['stages']}
+    with open(new_path, encoding='utf-8') as file:
+        new = {stage['stage']: stage for stage in json.load(file)['stages']}
+
+    ratios = []
+    for name, stage in new.items():
+        if name not in old or not old[name]['wall_s']:
+            continue
+        ratio = stage['wall_s'] / old[name]['wall_s']
+        ratios.append((name, ratio))
+        flag = '  REGRESSION' if ratio > threshold else ''
+        print(f"{name:<16} {old[name]['wall_s']:8.3f}s -> {stage['wall_s']:8.3f}s  x{ratio:.2f}{flag}")
+    return ratios
+
+
+# python benchmark.py [scale [repeat]]  or  python benchmark.py compare old.json new.json
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv and argv[0] == 'compare':
+        compare_benchmarks(argv[1], argv[2])
+        return
+
+    scale = argv[0] if argv else 'small'
+    repeat = int(argv[1]) if len(argv) > 1 else 1
+    path = save_benchmark(run_benchmarks(scale, repeat))
+    print(f'Results written to {path}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+from array import array
+from typing import Iterable
+import numpy as np
+
+from idf_table import IdfTable
+from inverted_index import InvertedIndex
+
+
+# Tokenized corpus as integer term ids: one uint32 array holding every document back to back, with
+# document i at term_ids[doc_offsets[i]:doc_offsets[i + 1]]. Each distinct term string exists once,
+# in the interning table, instead of once per occurrence in a list of lists.
+class CompactCorpus:
+    def __init__(self, vocabulary: dict[str, int], term_ids: np.ndarray, doc_offsets: np.ndarray, doc_ids: list[str]):
+        self.vocabulary = vocabulary
+        self.term_ids = term_ids
+        self.doc_offsets = doc_offsets
+        self.doc_ids = doc_ids
+
+    @property
+    def num_docs(self) -> int:
+        return len(self.doc_ids)
+
+    @property
+    def num_terms(self) -> int:
+        return len(self.vocabulary)
+
+    @property
+    def doc_lengths(self) -> np.ndarray:
+        return np.diff(self.doc_offsets)
+
+    def document(self, doc_idx: int) -> np.ndarray:
+        return self.term_ids[self.doc_offsets[doc_idx]:self.doc_offsets[doc_idx + 1]]
+
+    def get_terms(self) -> list[str]:
+        terms = [''] * len(self.vocabulary)
+        for term, term_id in self.vocabulary.items():
+            terms[term_id] = term
+        return terms
+
+    def get_nbytes(self) -> int:
+        return self.term_ids.nbytes + self.doc_offsets.nbytes
+
+    # Distinct (term, document) pairs sorted by term, then document, with how often the term occurs there;
+    # the postings layout of InvertedIndex
+    def get_term_doc_counts(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        doc_of_token = np.repeat(np.arange(self.num_docs, dtype=np.int64), self.doc_lengths)
+        keys, counts = np.unique(self.term_ids.astype(np.int64) * max(self.num_docs, 1) + doc_of_token,
+                                 return_counts=True)
+        return keys // max(self.num_docs, 1), keys % max(self.num_docs, 1), counts
+
+
+# Interns tokens as they stream in, so the corpus is never held as strings
+def build_compact_corpus(documents: Iterable[tuple[str, list[str]]]) -> CompactCorpus:
+    vocabulary: dict[str, int] = {}
+    term_ids = array('I')
+    doc_offsets = array('q', [0])
+    doc_ids = []
+    for doc_id, tokens in documents:
+        term_ids.extend([vocabulary.setdefault(token, len(vocabulary)) for token in tokens])
+        doc_offsets.append(len(term_ids))
+        doc_ids.append(doc_id)
+
+    return CompactCorpus(vocabulary, np.frombuffer(term_ids, dtype=np.uint32),
+                         np.frombuffer(doc_offsets, dtype=np.int64), doc_ids)
+
+
+def build_corpus_idf_table(corpus: CompactCorpus) -> IdfTable:
+    terms, _, _ = corpus.get_term_doc_counts()
+    df = np.bincount(terms, minlength=corpus.num_terms).astype(np.int64)
+    return IdfTable(corpus.vocabulary, df, corpus.num_docs)
+
+
+# Same index as build_inverted_index(get_tf_scores(documents), idf_table, doc_ids), with TF as
+# count / document length, computed for all postings at once
+def build_corpus_index(corpus: CompactCorpus, idf_table: IdfTable) -> InvertedIndex:
+    terms, docs, counts = corpus.get_term_doc_counts()
+    weights = counts / corpus.doc_lengths[docs] * np.asarray(idf_table.idf)[terms]
+
+    offsets = np.zeros(corpus.num_terms + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(np.bincount(terms, minlength=corpus.num_terms))
+    norms = np.sqrt(np.bincount(docs, weights=weights * weights, minlength=corpus.num_docs))
+
+    return InvertedIndex(corpus.vocabulary, offsets, docs, weights, norms, corpus.doc_ids)
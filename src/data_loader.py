@@ -1,10 +1,16 @@
+import hashlib
 import json
 import os
+import re
+import numpy as np
 
 # paths
 PROJECT_ROOT = os.path.dirname(os.path.dirname(__file__))
 DATA_DIR = os.path.join(PROJECT_ROOT, "data")
 RAW_DIR = os.path.join(DATA_DIR, "raw")
+CACHE_DIR = os.path.join(DATA_DIR, "cache")
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
 
 # individual loaders
 def load_documents():
@@ -16,6 +22,89 @@ def load_documents():
         docs = json.load(f)
     return docs
 
+# Yields the elements of a top-level JSON array one at a time, reading the file in chunks,
+# so only one record is ever materialized
+def iter_json_array(path, chunk_size=1024 * 1024):
+    decoder = json.JSONDecoder()
+    with open(path, "r", encoding="utf-8") as f:
+        buffer = f.read(chunk_size)
+        while buffer.isspace() and (more := f.read(chunk_size)):
+            buffer += more
+        pos = WHITESPACE.match(buffer).end()
+        if buffer[pos:pos + 1] != '[':
+            raise ValueError(f"{path} is not a JSON array.")
+        pos += 1
+        while True:
+            pos = WHITESPACE.match(buffer, pos).end()
+            if buffer[pos:pos + 1] == ',':
+                pos = WHITESPACE.match(buffer, pos + 1).end()
+            if buffer[pos:pos + 1] == ']':
+                return
+            try:
+                if pos == len(buffer):
+                    raise json.JSONDecodeError("Need more data", buffer, pos)
+                item, pos = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                more = f.read(chunk_size)
+                if not more:
+                    raise
+                buffer = buffer[pos:] + more
+                pos = 0
+                continue
+            yield item
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def pack_strings(strings):
+    encoded = [s.encode("utf-8") for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(b) for b in encoded])
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+def unpack_strings(blob, offsets):
+    data = blob.tobytes()
+    return [data[start:end].decode("utf-8") for start, end in zip(offsets[:-1].tolist(), offsets[1:].tolist())]
+
+# queryID -> relevantEntities labels, the only fields the pipeline reads from KeySearchWiki-JSON.json.
+# Extracted with the streaming reader once, then served from a compact .npz of string tables that is
+# rebuilt whenever the JSON file's hash changes.
+def load_relevant_entities():
+    json_path = os.path.join(RAW_DIR, "KeySearchWiki-JSON.json")
+    if not os.path.exists(json_path):
+        raise FileNotFoundError(f"{json_path} does not exist.")
+
+    source_hash = file_sha256(json_path)
+    cache_path = os.path.join(CACHE_DIR, "keysearch_entities.npz")
+    if os.path.exists(cache_path):
+        with np.load(cache_path) as cache:
+            if str(cache["source_hash"]) == source_hash:
+                query_ids = unpack_strings(cache["query_ids_blob"], cache["query_ids_offsets"])
+                labels = unpack_strings(cache["labels_blob"], cache["labels_offsets"])
+                bounds = cache["entity_offsets"].tolist()
+                return {qid: labels[bounds[i]:bounds[i + 1]] for i, qid in enumerate(query_ids)}
+
+    entities = {}
+    for doc in iter_json_array(json_path):
+        entities[doc["queryID"]] = [entity["label"] for entity in doc["relevantEntities"]]
+
+    query_ids_blob, query_ids_offsets = pack_strings(list(entities))
+    labels_blob, labels_offsets = pack_strings([label for labels in entities.values() for label in labels])
+    entity_offsets = np.zeros(len(entities) + 1, dtype=np.int64)
+    entity_offsets[1:] = np.cumsum([len(labels) for labels in entities.values()])
+
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    tmp_path = cache_path + ".tmp.npz"
+    np.savez(tmp_path, source_hash=np.array(source_hash), query_ids_blob=query_ids_blob,
+             query_ids_offsets=query_ids_offsets, labels_blob=labels_blob, labels_offsets=labels_offsets,
+             entity_offsets=entity_offsets)
+    os.replace(tmp_path, cache_path)
+    return entities
+
 def load_queries():
     path = os.path.join(RAW_DIR, "KeySearchWiki-queries-iri.txt")
     if not os.path.exists(path):
@@ -0,0 +1,265 @@
+import json
+import os
+import time
+import numpy as np
+import scipy.sparse as sp
+from tqdm import tqdm
+
+from batch_scorer import build_document_matrix, build_query_matrix
+from data_loader import DATA_DIR
+from index_store import MANIFEST_NAME, get_cache_key
+from inverted_index import InvertedIndex
+from query_vectorizer import get_query_idf, get_tf_scores, load_index, load_queries, save_ranking, word_tokenizer
+
+DENSE_FORMAT_VERSION = 1
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return matrix / norms
+
+
+# S and Vt of the rank-r approximation matrix ~ U diag(S) Vt from a random sketch of its range (Halko,
+# Martinsson & Tropp), touching the sparse matrix only through products with tall dense blocks. Power
+# iterations sharpen the sketch when the spectrum decays slowly, as it does for term-document matrices.
+# LSA only projects onto Vt, so the document-sized U is never formed.
+def randomized_svd(matrix: sp.csr_matrix, rank: int, oversample=10, power_iterations=4,
+                   seed=0) -> tuple[np.ndarray, np.ndarray]:
+    rank = min(rank, *matrix.shape)
+    sketch_size = min(rank + oversample, *matrix.shape)
+    rng = np.random.default_rng(seed)
+
+    basis, _ = np.linalg.qr(matrix @ rng.standard_normal((matrix.shape[1], sketch_size)))
+    for _ in range(power_iterations):
+        row_basis, _ = np.linalg.qr(matrix.T @ basis)
+        basis, _ = np.linalg.qr(matrix @ row_basis)
+
+    small = (matrix.T @ basis).T
+    _, singular_values, components = np.linalg.svd(small, full_matrices=False)
+    return singular_values[:rank], components[:rank]
+
+
+# Maps TF-IDF rows (in the index's term space) into the rank-r LSA space, as unit-length float32 vectors
+class LsaProjection:
+    def __init__(self, components: np.ndarray, singular_values: np.ndarray):
+        self.components = components
+        self.singular_values = singular_values
+
+    @property
+    def rank(self) -> int:
+        return len(self.singular_values)
+
+    def project(self, matrix: sp.csr_matrix) -> np.ndarray:
+        return normalize_rows(np.asarray(matrix @ self.components.T, dtype=np.float64)).astype(np.float32)
+
+
+# Nearest centroid by cosine for every row, a chunk of rows at a time so the score block stays small
+def assign_lists(vectors: np.ndarray, centroids: np.ndarray, chunk_size=65_536) -> np.ndarray:
+    assignment = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), chunk_size):
+        assignment[start:start + chunk_size] = np.argmax(vectors[start:start + chunk_size] @ centroids.T, axis=1)
+    return assignment
+
+
+# Spherical k-means on a sample of the vectors; centroids stay unit length, empty lists are reseeded
+def train_centroids(vectors: np.ndarray, num_lists: int, iterations=10, sample_per_list=256, seed=0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    num_lists = max(1, min(num_lists, len(vectors)))
+    sample_size = min(len(vectors), num_lists * sample_per_list)
+    sample = vectors[np.sort(rng.choice(len(vectors), sample_size, replace=False))]
+    centroids = sample[rng.choice(sample_size, num_lists, replace=False)].copy()
+
+    for _ in range(iterations):
+        assignment = assign_lists(sample, centroids)
+        membership = sp.csr_matrix((np.ones(sample_size, dtype=np.float32), (assignment, np.arange(sample_size))),
+                                   shape=(num_lists, sample_size))
+        sums = np.asarray(membership @ sample)
+        empty = np.flatnonzero(np.bincount(assignment, minlength=num_lists) == 0)
+        sums[empty] = sample[rng.choice(sample_size, len(empty), replace=False)]
+        centroids = normalize_rows(sums).astype(np.float32)
+
+    return centroids
+
+
+# Indices of the k highest scores, ties broken by the lower document index
+def select_top_candidates(docs: np.ndarray, scores: np.ndarray, k: int) -> np.ndarray:
+    k = min(k, len(scores))
+    if k == 0:
+        return np.empty(0, dtype=np.int64)
+    threshold = scores[np.argpartition(-scores, k - 1)[k - 1]]
+    candidates = np.flatnonzero(scores >= threshold)
+    return candidates[np.lexsort((docs[candidates], -scores[candidates]))[:k]]
+
+
+# Inverted file over dense vectors: documents are grouped by nearest centroid, each list stored
+# contiguously, and a query scans only the nprobe lists whose centroids are closest to it
+class IvfIndex:
+    def __init__(self, centroids: np.ndarray, list_offsets: np.ndarray, doc_indices: np.ndarray, vectors: np.ndarray):
+        # Vectors of list l are vectors[list_offsets[l]:list_offsets[l + 1]], for documents doc_indices[same range]
+        self.centroids = centroids
+        self.list_offsets = list_offsets
+        self.doc_indices = doc_indices
+        self.vectors = vectors
+
+    @property
+    def num_lists(self) -> int:
+        return len(self.centroids)
+
+    def probe_lists(self, query_vec: np.ndarray, nprobe: int) -> np.ndarray:
+        nprobe = min(nprobe, self.num_lists)
+        centroid_scores = self.centroids @ query_vec
+        return np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+
+    # (doc indices, scores) of the k best documents among the probed lists, best first
+    def search(self, query_vec: np.ndarray, k: int = 10, nprobe: int = 8) -> tuple[np.ndarray, np.ndarray]:
+        docs, scores = [], []
+        for list_id in self.probe_lists(query_vec, nprobe):
+            start, end = self.list_offsets[list_id], self.list_offsets[list_id + 1]
+            docs.append(self.doc_indices[start:end])
+            scores.append(self.vectors[start:end] @ query_vec)
+        if not docs:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        docs, scores = np.concatenate(docs), np.concatenate(scores)
+        top = select_top_candidates(docs, scores, k)
+        return docs[top], scores[top]
+
+    # Every list scanned; what search returns with nprobe = num_lists, and the reference for its recall
+    def exhaustive_search(self, query_vec: np.ndarray, k: int = 10) -> tuple[np.ndarray, np.ndarray]:
+        scores = self.vectors @ query_vec
+        top = select_top_candidates(self.doc_indices, scores, k)
+        return self.doc_indices[top], scores[top]
+
+
+def build_ivf_index(doc_vectors: np.ndarray, num_lists: int, iterations=10, seed=0) -> IvfIndex:
+    centroids = train_centroids(doc_vectors, num_lists, iterations, seed=seed)
+    assignment = assign_lists(doc_vectors, centroids)
+    doc_indices = np.argsort(assignment, kind='stable')
+    list_offsets = np.zeros(len(centroids) + 1, dtype=np.int64)
+    list_offsets[1:] = np.cumsum(np.bincount(assignment, minlength=len(centroids)))
+    return IvfIndex(centroids, list_offsets, doc_indices, doc_vectors[doc_indices])
+
+
+class DenseIndex:
+    def __init__(self, projection: LsaProjection, ivf: IvfIndex):
+        self.projection = projection
+        self.ivf = ivf
+
+
+def get_default_num_lists(num_docs: int) -> int:
+    return max(1, int(np.sqrt(num_docs)))
+
+
+def build_dense_index(index: InvertedIndex, rank=128, num_lists=None, seed=0) -> DenseIndex:
+    doc_matrix = build_document_matrix(index)
+    singular_values, components = randomized_svd(doc_matrix, rank, seed=seed)
+    projection = LsaProjection(components.astype(np.float32), singular_values)
+    num_lists = num_lists or get_default_num_lists(index.num_docs)
+    return DenseIndex(projection, build_ivf_index(projection.project(doc_matrix), num_lists, seed=seed))
+
+
+def get_dense_settings(cache_key: str, rank: int, num_lists: int, seed: int) -> dict:
+    return {'cache_key': cache_key, 'rank': rank, 'num_lists': num_lists, 'seed': seed,
+            'format_version': DENSE_FORMAT_VERSION}
+
+
+def save_dense_index(dense: DenseIndex, directory, settings: dict):
+    os.makedirs(directory, exist_ok=True)
+    # Drop the manifest first so a half-written index can never be opened under the old settings
+    manifest_path = os.path.join(directory, MANIFEST_NAME)
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+
+    np.save(os.path.join(directory, 'components.npy'), dense.projection.components.astype(np.float32))
+    np.save(os.path.join(directory, 'singular_values.npy'), dense.projection.singular_values)
+    np.save(os.path.join(directory, 'centroids.npy'), dense.ivf.centroids.astype(np.float32))
+    np.save(os.path.join(directory, 'list_offsets.npy'), dense.ivf.list_offsets)
+    np.save(os.path.join(directory, 'doc_indices.npy'), dense.ivf.doc_indices)
+    np.save(os.path.join(directory, 'vectors.npy'), dense.ivf.vectors.astype(np.float32))
+
+    with open(manifest_path, 'w', encoding='utf-8') as file:
+        json.dump(settings, file)
+
+
+# Memory-mapped dense index, or None when there is none built with exactly these settings
+def open_dense_index(directory, settings: dict) -> DenseIndex | None:
+    manifest_path = os.path.join(directory, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, encoding='utf-8') as file:
+        if json.load(file) != settings:
+            return None
+
+    def load(name):
+        return np.load(os.path.join(directory, f'{name}.npy'), mmap_mode='r')
+
+    projection = LsaProjection(load('components'), load('singular_values'))
+    return DenseIndex(projection, IvfIndex(load('centroids'), load('list_offsets'), load('doc_indices'), load('vectors')))
+
+
+# LSA components are indexed by term id, so index has to be load_index's index for the same cache_key
+def load_dense_index(file_name, index: InvertedIndex, rank=128, num_lists=None, seed=0,
+                     cache_key=None) -> DenseIndex:
+    directory = os.path.join(DATA_DIR, "cache/dense", os.path.splitext(os.path.basename(file_name))[0])
+    num_lists = num_lists or get_default_num_lists(index.num_docs)
+    settings = get_dense_settings(cache_key or get_cache_key(file_name, word_tokenizer), rank, num_lists, seed)
+
+    dense = open_dense_index(directory, settings)
+    if dense is None:
+        save_dense_index(build_dense_index(index, rank, num_lists, seed), directory, settings)
+        dense = open_dense_index(directory, settings)
+    return dense
+
+
+# Exact TF-IDF cosine of the query row against each candidate document; the k best, ties by document index
+def rerank_exact(doc_matrix: sp.csr_matrix, query_row: sp.csr_matrix, candidates: np.ndarray,
+                 k: int = 10) -> tuple[np.ndarray, np.ndarray]:
+    scores = np.asarray((doc_matrix[candidates] @ query_row.T).todense()).ravel()
+    top = select_top_candidates(candidates, scores, k)
+    return candidates[top], scores[top]
+
+
+# Share of the exhaustive dense top k that IVF finds, and the mean search latency, for each nprobe
+def measure_recall(ivf: IvfIndex, query_vecs: np.ndarray, k: int, nprobe_values) -> list[dict]:
+    expected = [set(ivf.exhaustive_search(query_vec, k)[0].tolist()) for query_vec in query_vecs]
+    results = []
+    for nprobe in nprobe_values:
+        found = 0
+        start = time.perf_counter()
+        for query_vec, relevant in zip(query_vecs, expected):
+            found += len(relevant.intersection(ivf.search(query_vec, k, nprobe)[0].tolist()))
+        elapsed = time.perf_counter() - start
+        results.append({'nprobe': nprobe, 'recall': found / max(1, sum(len(r) for r in expected)),
+                        'ms_per_query': 1000 * elapsed / max(1, len(query_vecs))})
+    return results
+
+
+# hybrid=True takes the rerank_depth best IVF candidates and orders them by exact TF-IDF cosine instead
+def main(k=10, rank=128, num_lists=None, nprobe=8, hybrid=False, rerank_depth=100, query_idf_mode='corpus'):
+    queries, query_ids = load_queries(os.path.join(DATA_DIR, "processed/keysearch.qry"))
+    query_tf = get_tf_scores(queries)
+
+    file_name = os.path.join(DATA_DIR, "processed/articles-1.txt")
+    cache_key = get_cache_key(file_name, word_tokenizer)
+    index, doc_idf = load_index(file_name, cache_key)
+    query_matrix = build_query_matrix(index, query_tf, get_query_idf(queries, doc_idf, query_idf_mode))
+
+    dense = load_dense_index(file_name, index, rank, num_lists, seed=0, cache_key=cache_key)
+    query_vecs = dense.projection.project(query_matrix)
+    doc_matrix = build_document_matrix(index) if hybrid else None
+
+    output_lines = []
+    for qid, query_vec in enumerate(tqdm(query_vecs, desc="Processing queries")):
+        docs, scores = dense.ivf.search(query_vec, rerank_depth if hybrid else k, nprobe)
+        if hybrid:
+            docs, scores = rerank_exact(doc_matrix, query_matrix[qid], docs, k)
+        for rank_num, (doc_idx, sim_score) in enumerate(zip(docs, scores)):
+            output_lines.append(f'{query_ids[qid]} {index.doc_ids[doc_idx]} {rank_num + 1} {float(sim_score)}\n')
+
+    save_ranking(output_lines, "ranking_output_lsa_hybrid.txt" if hybrid else "ranking_output_lsa.txt")
+    for result in measure_recall(dense.ivf, query_vecs, k, sorted({1, nprobe, dense.ivf.num_lists})):
+        print(f"nprobe={result['nprobe']:<5} recall@{k}={result['recall']:.3f} {result['ms_per_query']:.2f} ms/query")
+
+
+if __name__ == '__main__':
+    main()
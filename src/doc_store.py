@@ -0,0 +1,171 @@
+import hashlib
+import json
+import mmap
+import os
+import re
+import numpy as np
+
+DOC_STORE_FORMAT_VERSION = 1
+
+RECORD_START = re.compile(rb'^\.I (\d+)[ \t\r]*\n', re.MULTILINE)
+EMPTY_SLOT = -1
+
+
+def hash_title(title: bytes) -> int:
+    return int.from_bytes(hashlib.blake2b(title, digest_size=8).digest(), 'little')
+
+
+# Byte spans of every record of an .I/.T/.W file: one row per document of
+# (title start, title end, body start, body end), title being the .T line and body everything after .W
+def scan_records(data) -> tuple[np.ndarray, np.ndarray]:
+    starts = [(int(match.group(1)), match.start(), match.end()) for match in RECORD_START.finditer(data)]
+    doc_ids = np.array([doc_id for doc_id, _, _ in starts], dtype=np.int64)
+    spans = np.zeros((len(starts), 4), dtype=np.int64)
+    for row, (_, _, header_end) in enumerate(starts):
+        record_end = starts[row + 1][1] if row + 1 < len(starts) else len(data)
+        title_start = data.find(b'.T\n', header_end, record_end)
+        body_marker = data.find(b'.W\n', header_end, record_end)
+        if title_start == -1 or body_marker == -1:
+            title_start = title_end = header_end
+        else:
+            title_start += 3
+            title_end = body_marker
+        body_start = body_marker + 3 if body_marker != -1 else header_end
+        body_end = record_end - 1 if record_end > body_start and data[record_end - 1:record_end] == b'\n' else record_end
+        spans[row] = (title_start, title_end, body_start, max(body_end, body_start))
+    return doc_ids, spans
+
+
+# Open-addressing table of row + 1 per slot, probed linearly from the title hash. Later rows replace earlier
+# ones with the same title, like building a reversed {title: id} dict.
+def build_title_table(titles: list[bytes]) -> tuple[np.ndarray, np.ndarray]:
+    title_hashes = np.array([hash_title(title) for title in titles], dtype=np.uint64)
+    size = 1
+    while size < 2 * len(titles):
+        size *= 2
+    table = np.full(size, EMPTY_SLOT, dtype=np.int64)
+    mask = size - 1
+    for row, title in enumerate(titles):
+        slot = int(title_hashes[row]) & mask
+        while table[slot] != EMPTY_SLOT:
+            other = table[slot]
+            if title_hashes[other] == title_hashes[row] and titles[other] == title:
+                break
+            slot = (slot + 1) & mask
+        table[slot] = row
+    return title_hashes, table
+
+
+# Documents of an .I/.T/.W corpus served straight from a memory map: id -> row through a dense lookup
+# array, title -> row through the persisted hash table, so only the referenced records are ever read
+class DocumentStore:
+    def __init__(self, corpus_path, doc_ids: np.ndarray, spans: np.ndarray, title_hashes: np.ndarray,
+                 title_table: np.ndarray):
+        self.file = open(corpus_path, 'rb')
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(corpus_path) else b''
+        self.doc_ids = doc_ids
+        self.spans = spans
+        self.title_hashes = title_hashes
+        self.title_table = title_table
+        self.rows = np.full(int(doc_ids.max()) + 1 if len(doc_ids) else 0, EMPTY_SLOT, dtype=np.int64)
+        self.rows[doc_ids] = np.arange(len(doc_ids))
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    def __contains__(self, doc_id):
+        return self.get_row(doc_id) != EMPTY_SLOT
+
+    def get_row(self, doc_id: int) -> int:
+        if 0 <= doc_id < len(self.rows):
+            return int(self.rows[doc_id])
+        return EMPTY_SLOT
+
+    def read(self, start, end) -> str:
+        return self.data[start:end].decode('utf-8')
+
+    def get_title(self, doc_id: int) -> str | None:
+        row = self.get_row(doc_id)
+        if row == EMPTY_SLOT:
+            return None
+        return self.read(self.spans[row, 0], self.spans[row, 1]).strip()
+
+    def get_body(self, doc_id: int) -> str | None:
+        row = self.get_row(doc_id)
+        if row == EMPTY_SLOT:
+            return None
+        return self.read(self.spans[row, 2], self.spans[row, 3])
+
+    def get_id(self, title: str) -> int | None:
+        encoded = title.encode('utf-8')
+        title_hash = hash_title(encoded)
+        mask = len(self.title_table) - 1
+        slot = title_hash & mask
+        while len(self.title_table):
+            row = int(self.title_table[slot])
+            if row == EMPTY_SLOT:
+                return None
+            if int(self.title_hashes[row]) == title_hash:
+                start, end = self.spans[row, 0], self.spans[row, 1]
+                if self.data[start:end].strip() == encoded:
+                    return int(self.doc_ids[row])
+            slot = (slot + 1) & mask
+        return None
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.file.close()
+
+
+# Hashing the corpus would mean reading all of it, which the store exists to avoid; size and mtime are enough
+# to notice it was rewritten
+def get_store_key(corpus_path) -> str:
+    stat = os.stat(corpus_path)
+    return f'{DOC_STORE_FORMAT_VERSION}:{stat.st_size}:{stat.st_mtime_ns}'
+
+
+def build_doc_store(corpus_path, directory):
+    with open(corpus_path, 'rb') as file:
+        if os.path.getsize(corpus_path):
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                doc_ids, spans = scan_records(data)
+                titles = [data[start:end].strip() for start, end in spans[:, :2].tolist()]
+        else:
+            doc_ids, spans, titles = np.empty(0, dtype=np.int64), np.empty((0, 4), dtype=np.int64), []
+    title_hashes, title_table = build_title_table(titles)
+
+    os.makedirs(directory, exist_ok=True)
+    manifest_path = os.path.join(directory, 'manifest.json')
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+    np.save(os.path.join(directory, 'doc_ids.npy'), doc_ids)
+    np.save(os.path.join(directory, 'spans.npy'), spans)
+    np.save(os.path.join(directory, 'title_hashes.npy'), title_hashes)
+    np.save(os.path.join(directory, 'title_table.npy'), title_table)
+    with open(manifest_path, 'w') as file:
+        json.dump({'key': get_store_key(corpus_path), 'num_docs': len(doc_ids)}, file)
+
+
+def open_doc_store(corpus_path, directory) -> DocumentStore | None:
+    manifest_path = os.path.join(directory, 'manifest.json')
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path) as file:
+        manifest = json.load(file)
+    if manifest.get('key') != get_store_key(corpus_path):
+        return None
+
+    def load(name):
+        return np.load(os.path.join(directory, name), mmap_mode='r')
+
+    return DocumentStore(corpus_path, load('doc_ids.npy'), load('spans.npy'), load('title_hashes.npy'),
+                         load('title_table.npy'))
+
+
+def load_doc_store(corpus_path, directory) -> DocumentStore:
+    store = open_doc_store(corpus_path, directory)
+    if store is None:
+        build_doc_store(corpus_path, directory)
+        store = open_doc_store(corpus_path, directory)
+    return store
@@ -1,7 +1,11 @@
-from nltk import precision
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 
-from src.data_loader import load_documents
-from src.result_rewriter import parse_documents
+from data_loader import load_relevant_entities
+from doc_store import load_doc_store
+
+METRICS = ['precision', 'recall', 'f1', 'ap', 'rr', 'ndcg']
 
 # Map queryID from JSON dataset to query number in keysearch.qry (e.g. MH10 -> 001)
 def load_query_id_mapping():
@@ -17,83 +21,145 @@ def load_query_id_mapping():
 
     return mapping
 
-def main():
-    docs = load_documents()
+# Relevant article ids per query number, from the JSON relevantEntities labels matched to article titles
+def load_expected() -> dict[int, np.ndarray]:
+    entities = load_relevant_entities()
 
     query_id_map = load_query_id_mapping()
-    articles = parse_documents('../data/processed/all_articles.txt')
-    reversed_articles = {v: k for k, v in articles.items()}
+    articles = load_doc_store('../data/processed/all_articles.txt', '../data/cache/docstore/all_articles')
 
     expected = {}
-    for doc in docs:
-        next_query_id = doc['queryID']
+    for next_query_id, labels in entities.items():
         query_num = query_id_map[next_query_id]
 
-        relevant = doc['relevantEntities']
-
         article_ids = []
-        for entity in relevant:
-            label = entity['label']
+        for label in labels:
             if len(label) >= 2 and label[0] == 'Q' and label[1].isdigit():
                 continue
 
-            article_id = reversed_articles.get(label)
+            article_id = articles.get_id(label)
             if article_id is not None:
                 article_ids.append(int(article_id))
 
-        expected[query_num] = article_ids
-
-    total_precision = 0
-    total_recall = 0
-    total_queries = 0
-
-    with open('../data/results/ranking_output_rust.txt') as file:
-        with open('../data/results/queries_scored.txt', 'w', encoding='utf-8') as out:
-            curr_query_id = None
-            curr_query_articles = []
-
-            for line in file:
-                split = line.split(' ')
-
-                next_query_id = split[0]
-                if curr_query_id is None:
-                    curr_query_id = next_query_id
-                # We moved to the next query
-                if next_query_id != curr_query_id:
-                    expected_articles = expected[int(curr_query_id)]
-
-                    num_relevant = 0
-                    for generated_article in curr_query_articles:
-                        if generated_article in expected_articles:
-                            num_relevant += 1
-
-                    precision_at_10 = num_relevant / 10
-
-                    num_expected = len(expected_articles)
-                    if num_expected > 0:
-                        recall_at_10 = num_relevant / num_expected
-                    else:
-                        recall_at_10 = 0
-
-                    if precision_at_10 == 0 and recall_at_10 == 0:
-                        f1 = 0
-                    else:
-                        f1 = 2 * (precision_at_10 * recall_at_10) / (precision_at_10 + recall_at_10)
-
-                    out.write(f'{curr_query_id} precision={precision_at_10} recall={recall_at_10} f1={f1}\n')
-
-                    total_precision += precision_at_10
-                    total_recall += recall_at_10
-                    total_queries += 1
-
-                    curr_query_id = next_query_id
-                    curr_query_articles = []
-
-                article_id = split[1]
-                curr_query_articles.append(int(article_id))
-
-    print(f'Average precision: {total_precision / total_queries}, Average recall: {total_recall / total_queries}')
+        expected[query_num] = np.unique(np.array(article_ids, dtype=np.int64))
+
+    articles.close()
+    return expected
+
+# Relevance judgments as one sorted array of query_num * stride + doc_id keys, so every run line
+# can be judged with a single np.isin, plus the number of relevant documents per query number
+class Qrels:
+    def __init__(self, expected: dict[int, np.ndarray]):
+        self.stride = max((int(ids.max()) for ids in expected.values() if len(ids)), default=0) + 1
+        self.num_relevant = np.zeros(max(expected, default=0) + 1, dtype=np.int64)
+        keys = []
+        for query_num, ids in expected.items():
+            self.num_relevant[query_num] = len(ids)
+            keys.append(query_num * self.stride + ids)
+        self.keys = np.sort(np.concatenate(keys)) if keys else np.empty(0, dtype=np.int64)
+
+    def judge(self, query_nums: np.ndarray, doc_ids: np.ndarray) -> np.ndarray:
+        in_range = doc_ids < self.stride
+        return in_range & np.isin(query_nums * self.stride + np.where(in_range, doc_ids, 0), self.keys)
+
+    def get_num_relevant(self, query_nums: np.ndarray) -> np.ndarray:
+        counts = np.zeros(len(query_nums), dtype=np.int64)
+        known = query_nums < len(self.num_relevant)
+        counts[known] = self.num_relevant[query_nums[known]]
+        return counts
+
+# Run lines are "query doc rank score"; a query's results are taken in file order
+def load_run(path) -> tuple[np.ndarray, np.ndarray]:
+    query_nums, doc_ids = [], []
+    with open(path) as file:
+        for line in file:
+            split = line.split(' ')
+            if len(split) < 2:
+                continue
+            query_nums.append(int(split[0]))
+            doc_ids.append(int(split[1]))
+    query_nums = np.array(query_nums, dtype=np.int64)
+    doc_ids = np.array(doc_ids, dtype=np.int64)
+    order = np.argsort(query_nums, kind='stable')
+    return query_nums[order], doc_ids[order]
+
+# Per-query P@k, R@k, F1@k, average precision, reciprocal rank and nDCG@k (binary relevance),
+# computed for every query of the run at once with grouped cumulative sums
+def evaluate_run(path, qrels: Qrels, k=10) -> dict[str, np.ndarray]:
+    query_nums, doc_ids = load_run(path)
+    queries, starts, counts = np.unique(query_nums, return_index=True, return_counts=True)
+    group = np.repeat(np.arange(len(queries)), counts)
+    position = np.arange(len(query_nums)) - starts[group]
+
+    relevant = qrels.judge(query_nums, doc_ids).astype(np.float64)
+    num_relevant = qrels.get_num_relevant(queries).astype(np.float64)
+    has_relevant = num_relevant > 0
+    safe_relevant = np.where(has_relevant, num_relevant, 1)
+
+    in_k = position < k
+    hits = np.bincount(group, weights=relevant * in_k, minlength=len(queries))
+    precision = hits / k
+    recall = np.where(has_relevant, hits / safe_relevant, 0)
+    total = precision + recall
+    f1 = np.where(total > 0, 2 * precision * recall / np.where(total > 0, total, 1), 0)
+
+    cumulative = np.cumsum(relevant)
+    hits_so_far = cumulative - (cumulative[starts] - relevant[starts])[group]
+    ap = np.bincount(group, weights=relevant * hits_so_far / (position + 1), minlength=len(queries))
+    ap = np.where(has_relevant, ap / safe_relevant, 0)
+    rr = np.bincount(group, weights=relevant * (hits_so_far == 1) / (position + 1), minlength=len(queries))
+
+    discounts = 1 / np.log2(np.arange(k) + 2)
+    ideal = np.concatenate([[0], np.cumsum(discounts)])
+    dcg = np.bincount(group, weights=relevant * in_k / np.log2(position + 2), minlength=len(queries))
+    idcg = ideal[np.minimum(num_relevant.astype(np.int64), k)]
+    ndcg = np.where(idcg > 0, dcg / np.where(idcg > 0, idcg, 1), 0)
+
+    return {'query': queries, 'precision': precision, 'recall': recall, 'f1': f1, 'ap': ap, 'rr': rr, 'ndcg': ndcg}
+
+def evaluate_runs(paths: list[str], qrels: Qrels, k=10, workers=None) -> list[dict[str, np.ndarray]]:
+    with ProcessPoolExecutor(workers) as executor:
+        return list(executor.map(evaluate_run, paths, [qrels] * len(paths), [k] * len(paths)))
+
+def get_summary(results: dict[str, np.ndarray]) -> dict[str, float]:
+    if len(results['query']) == 0:
+        return {metric: 0.0 for metric in METRICS}
+    return {metric: float(results[metric].mean()) for metric in METRICS}
+
+def save_per_query(results: dict[str, np.ndarray], path, k=10):
+    with open(path, 'w', encoding='utf-8') as out:
+        out.write(f'query\tP@{k}\tR@{k}\tF1@{k}\tAP\tRR\tnDCG@{k}\n')
+        for i, query_num in enumerate(results['query']):
+            out.write(f'{query_num:03d}\t' + '\t'.join(f'{results[metric][i]:.6f}' for metric in METRICS) + '\n')
+
+def save_summary(run_names: list[str], all_results: list[dict[str, np.ndarray]], path, k=10):
+    with open(path, 'w', encoding='utf-8') as out:
+        out.write(f'run\tqueries\tP@{k}\tR@{k}\tF1@{k}\tMAP\tMRR\tnDCG@{k}\n')
+        for name, results in zip(run_names, all_results):
+            summary = get_summary(results)
+            out.write(f'{name}\t{len(results["query"])}\t' + '\t'.join(f'{summary[metric]:.6f}' for metric in METRICS) + '\n')
+
+def save_queries_scored(results: dict[str, np.ndarray], path):
+    with open(path, 'w', encoding='utf-8') as out:
+        for i, query_num in enumerate(results['query']):
+            precision, recall, f1 = (float(results[metric][i]) for metric in ('precision', 'recall', 'f1'))
+            out.write(f'{query_num:03d} precision={precision} recall={recall} f1={f1 or 0}\n')
+
+def main(run_files=('ranking_output_rust.txt',), k=10):
+    qrels = Qrels(load_expected())
+
+    paths = [os.path.join('../data/results', run_file) for run_file in run_files]
+    all_results = evaluate_runs(paths, qrels, k)
+
+    run_names = [os.path.splitext(run_file)[0] for run_file in run_files]
+    for name, results in zip(run_names, all_results):
+        save_per_query(results, f'../data/results/{name}.eval.tsv', k)
+    save_summary(run_names, all_results, '../data/results/evaluation_summary.tsv', k)
+    save_queries_scored(all_results[0], '../data/results/queries_scored.txt')
+
+    summary = get_summary(all_results[0])
+    print(f'Average precision: {summary["precision"]}, Average recall: {summary["recall"]}')
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,50 @@
+import math
+from typing import Iterable
+import numpy as np
+
+
+class IdfTable:
+    def __init__(self, vocabulary: dict[str, int], df: np.ndarray, num_docs: int, idf: np.ndarray = None):
+        self.vocabulary = vocabulary
+        self.df = df
+        self.num_docs = num_docs
+        # math.log rather than np.log so values match the old per-document dicts bit for bit
+        if idf is None:
+            idf = np.fromiter((math.log(num_docs / d) for d in df.tolist()), dtype=np.float64, count=len(df))
+        self.idf = idf
+
+    def __len__(self):
+        return len(self.vocabulary)
+
+    def term_id(self, term: str) -> int | None:
+        return self.vocabulary.get(term)
+
+    def get_idf(self, term: str) -> float:
+        term_id = self.vocabulary.get(term)
+        if term_id is None:
+            return 0.0
+        return float(self.idf[term_id])
+
+
+# Document frequencies in a single pass; documents can be any iterable, e.g. a generator over a file
+def build_idf_table(documents: Iterable[list[str]]) -> IdfTable:
+    vocabulary: dict[str, int] = {}
+    df: list[int] = []
+    num_docs = 0
+    for doc in documents:
+        num_docs += 1
+        for term in set(doc):
+            term_id = vocabulary.get(term)
+            if term_id is None:
+                vocabulary[term] = len(df)
+                df.append(1)
+            else:
+                df[term_id] += 1
+
+    return IdfTable(vocabulary, np.array(df, dtype=np.int64), num_docs)
+
+
+# Query weights against a table. With the corpus table, queries and documents share one IDF; the old
+# behaviour computed IDF over the query collection itself, which is build_idf_table(queries).
+def get_query_vector(query: list[str], query_tf: dict[str, float], table: IdfTable) -> list[float]:
+    return [query_tf[word] * table.get_idf(word) for word in query]
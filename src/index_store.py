@@ -0,0 +1,176 @@
+import hashlib
+import json
+import os
+import numpy as np
+
+from idf_table import IdfTable
+from inverted_index import InvertedIndex
+from tokenizer import Tokenizer
+
+INDEX_FORMAT_VERSION = 1
+MANIFEST_NAME = 'manifest.json'
+FULL_HASH_ENV = 'INDEX_FULL_HASH'
+
+
+# Strings packed into one UTF-8 blob plus an offset array, so both can be memory-mapped
+class StringTable:
+    def __init__(self, blob: np.ndarray, offsets: np.ndarray):
+        self.blob = blob
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i) -> str:
+        return self.get_bytes(i).decode('utf-8')
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def get_bytes(self, i) -> bytes:
+        return self.blob[self.offsets[i]:self.offsets[i + 1]].tobytes()
+
+
+# Writes to a temporary file and renames it into place: a process that has the old file mapped keeps
+# reading the old contents instead of seeing them truncated and rewritten under it
+def save_array(path, array: np.ndarray):
+    with open(path + '.tmp', 'wb') as file:
+        np.save(file, array)
+    os.replace(path + '.tmp', path)
+
+
+def save_string_table(strings: list[str], directory, name):
+    encoded = [s.encode('utf-8') for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(b) for b in encoded])
+    save_array(os.path.join(directory, f'{name}_offsets.npy'), offsets)
+    save_array(os.path.join(directory, f'{name}_blob.npy'), np.frombuffer(b''.join(encoded), dtype=np.uint8))
+
+
+def open_string_table(directory, name) -> StringTable:
+    return StringTable(np.load(os.path.join(directory, f'{name}_blob.npy'), mmap_mode='r'),
+                       np.load(os.path.join(directory, f'{name}_offsets.npy'), mmap_mode='r'))
+
+
+# Read-only term -> term id mapping over a sorted string table, looked up by binary search.
+# UTF-8 byte order is code point order, so the table is sorted the same way Python sorts the terms.
+class MappedVocabulary:
+    def __init__(self, terms: StringTable):
+        self.terms = terms
+
+    def __len__(self):
+        return len(self.terms)
+
+    def __contains__(self, term):
+        return self.get(term) is not None
+
+    def __getitem__(self, term) -> int:
+        term_id = self.get(term)
+        if term_id is None:
+            raise KeyError(term)
+        return term_id
+
+    def get(self, term: str, default=None):
+        key = term.encode('utf-8')
+        lo, hi = 0, len(self.terms)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.terms.get_bytes(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(self.terms) and self.terms.get_bytes(lo) == key:
+            return lo
+        return default
+
+    def items(self):
+        return ((term, term_id) for term_id, term in enumerate(self.terms))
+
+
+# Key covering everything the index depends on: the corpus, the tokenizer settings and this format. Like the
+# doc store's key, the corpus counts by size and mtime, since hashing it would read all of it on every open;
+# full_hash (or INDEX_FULL_HASH=1) hashes the bytes instead, e.g. for copies that don't keep their mtime.
+def get_cache_key(corpus_path, tokenizer: Tokenizer, full_hash: bool = None) -> str:
+    if full_hash is None:
+        full_hash = os.environ.get(FULL_HASH_ENV) == '1'
+    digest = hashlib.sha256()
+    if full_hash:
+        with open(corpus_path, 'rb') as file:
+            for chunk in iter(lambda: file.read(1024 * 1024), b''):
+                digest.update(chunk)
+    else:
+        stat = os.stat(corpus_path)
+        digest.update(f'stat:{stat.st_size}:{stat.st_mtime_ns}'.encode('utf-8'))
+    digest.update(tokenizer.settings_hash.encode('utf-8'))
+    digest.update(str(INDEX_FORMAT_VERSION).encode('utf-8'))
+    return digest.hexdigest()
+
+
+# The saved layout puts terms in UTF-8 byte order, which MappedVocabulary's binary search needs. Returns the
+# terms in that order, the old term id of each, the new postings offsets, and for each posting in the new
+# layout its position in the old one.
+def get_sorted_layout(vocabulary, offsets: np.ndarray) -> tuple[list[str], np.ndarray, np.ndarray, np.ndarray]:
+    terms = [''] * len(vocabulary)
+    for term, term_id in vocabulary.items():
+        terms[term_id] = term
+    order = np.array(sorted(range(len(terms)), key=lambda i: terms[i].encode('utf-8')), dtype=np.int64)
+
+    lengths = np.diff(offsets)[order]
+    sorted_offsets = np.zeros(len(order) + 1, dtype=np.int64)
+    sorted_offsets[1:] = np.cumsum(lengths)
+    gather = np.repeat(offsets[order] - sorted_offsets[:-1], lengths) + np.arange(sorted_offsets[-1])
+    return [terms[i] for i in order], order, sorted_offsets, gather
+
+
+def save_index(index: InvertedIndex, idf_table: IdfTable, directory, cache_key: str):
+    os.makedirs(directory, exist_ok=True)
+    # Drop the manifest first so a half-written index can never be opened under the old key
+    manifest_path = os.path.join(directory, MANIFEST_NAME)
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+
+    terms, order, offsets, gather = get_sorted_layout(index.vocabulary, index.offsets)
+    save_string_table(terms, directory, 'terms')
+    save_string_table(list(index.doc_ids), directory, 'doc_ids')
+    save_array(os.path.join(directory, 'offsets.npy'), offsets)
+    save_array(os.path.join(directory, 'doc_indices.npy'), index.doc_indices[gather])
+    save_array(os.path.join(directory, 'weights.npy'), index.weights[gather])
+    save_array(os.path.join(directory, 'norms.npy'), index.norms)
+    save_array(os.path.join(directory, 'df.npy'), idf_table.df[order])
+    save_array(os.path.join(directory, 'idf.npy'), idf_table.idf[order])
+
+    save_manifest(directory, {'cache_key': cache_key, 'num_docs': idf_table.num_docs, 'num_terms': len(terms)})
+
+
+def save_manifest(directory, manifest: dict):
+    path = os.path.join(directory, MANIFEST_NAME)
+    with open(path + '.tmp', 'w', encoding='utf-8') as file:
+        json.dump(manifest, file)
+    os.replace(path + '.tmp', path)
+
+
+def read_manifest(directory) -> dict | None:
+    try:
+        with open(os.path.join(directory, MANIFEST_NAME), encoding='utf-8') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+
+
+# Returns (index, idf table) backed by memory maps, or None when there is no index built for cache_key
+def open_index(directory, cache_key: str) -> tuple[InvertedIndex, IdfTable] | None:
+    manifest = read_manifest(directory)
+    if manifest is None or manifest.get('cache_key') != cache_key:
+        return None
+
+    def load(name):
+        return np.load(os.path.join(directory, f'{name}.npy'), mmap_mode='r')
+
+    vocabulary = MappedVocabulary(open_string_table(directory, 'terms'))
+    index = InvertedIndex(vocabulary, load('offsets'), load('doc_indices'), load('weights'), load('norms'),
+                          open_string_table(directory, 'doc_ids'))
+    idf_table = IdfTable(vocabulary, load('df'), manifest['num_docs'], load('idf'))
+    # A rebuild that started while the files were being opened may have swapped some of them already
+    if read_manifest(directory) != manifest:
+        return None
+    return index, idf_table
@@ -0,0 +1,215 @@
+import atexit
+import json
+import os
+import resource
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+# Set PIPELINE_TRACE to a file path to write traces there; PIPELINE_PROFILE=1 starts with the sampling
+# profiler on (it can also be toggled while running with SIGUSR1 or Tracer.set_profiling)
+TRACE_ENV = 'PIPELINE_TRACE'
+PROFILE_ENV = 'PIPELINE_PROFILE'
+
+
+def get_rss_mb() -> float | None:
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+# Resident pages not shared with other processes; file-backed pages such as a memory-mapped index count as shared
+def get_private_rss_mb() -> float | None:
+    try:
+        with open('/proc/self/statm') as file:
+            fields = file.read().split()
+        return (int(fields[1]) - int(fields[2])) * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class StageTrace:
+    def __init__(self, name: str, items: int = 0):
+        self.name = name
+        self.items = items
+        self.fields = {}
+
+    def add(self, n: int = 1):
+        self.items += n
+
+
+# Samples the process RSS at a fixed interval for the life of one stage. ru_maxrss can't stand in for this:
+# it is the peak of the whole process so far, so every stage after the largest one would report that.
+class RssSampler(threading.Thread):
+    def __init__(self, interval: float):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.start_mb = get_rss_mb()
+        self.peak_mb = self.start_mb
+        self.stopped = threading.Event()
+
+    def sample(self):
+        rss = get_rss_mb()
+        if rss is not None and (self.peak_mb is None or rss > self.peak_mb):
+            self.peak_mb = rss
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.sample()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        self.sample()
+
+
+# Samples the stack of one thread at a fixed interval while profiling is switched on, keeping counts of
+# folded stacks ("outer;inner;innermost"), the format flame graph tools read
+class StackSampler(threading.Thread):
+    def __init__(self, tracer: 'Tracer', thread_id: int, interval: float, depth: int):
+        super().__init__(daemon=True)
+        self.tracer = tracer
+        self.thread_id = thread_id
+        self.interval = interval
+        self.depth = depth
+        self.samples: Counter[str] = Counter()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            if not self.tracer.profiling:
+                continue
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None and len(stack) < self.depth:
+                code = frame.f_code
+                stack.append(f'{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}')
+                frame = frame.f_back
+            if stack:
+                self.samples[';'.join(reversed(stack))] += 1
+
+
+# Structured traces for pipeline stages, written as JSON lines. Without a trace file nothing is written,
+# and stages only cost a few clock reads.
+class Tracer:
+    def __init__(self, path: str = None, profiling: bool = False):
+        self.path = path
+        self.profiling = profiling
+        self.counters: Counter[str] = Counter()
+        self.lock = threading.Lock()
+        self.file = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.path is not None
+
+    def configure(self, path: str | None):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+            self.path = path
+
+    def write(self, record: dict):
+        if self.path is None:
+            return
+        record = dict(record, pid=os.getpid(), time=time.time())
+        with self.lock:
+            # configure may have switched tracing off since the check above
+            if self.path is None:
+                return
+            if self.file is None:
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                self.file = open(self.path, 'a', encoding='utf-8', buffering=1)
+            self.file.write(json.dumps(record) + '\n')
+
+    # Called from worker threads as well as the main one, so the read-modify-write is locked
+    def count(self, event: str, n: int = 1):
+        with self.lock:
+            self.counters[event] += n
+
+    def event(self, name: str, **fields):
+        self.write(dict(fields, type='event', event=name))
+
+    # Wall time, CPU time (own and reaped child processes), RSS and items/s of the enclosed block;
+    # items are given up front or added through the yielded StageTrace, extra fields go into the record.
+    # peak_rss_mb is the highest RSS sampled every rss_interval seconds while the block ran, and
+    # peak_rss_delta_mb how far that is above the RSS the block started at.
+    @contextmanager
+    def stage(self, name: str, items: int = 0, rss_interval: float = 0.01, **fields):
+        trace = StageTrace(name, items)
+        trace.fields.update(fields)
+        rss = None
+        if self.path is not None:
+            rss = RssSampler(rss_interval)
+            rss.start()
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        children_start = resource.getrusage(resource.RUSAGE_CHILDREN)
+        try:
+            yield trace
+        finally:
+            wall = time.perf_counter() - wall_start
+            if rss is not None:
+                rss.stop()
+                children = resource.getrusage(resource.RUSAGE_CHILDREN)
+                self.write(dict(
+                    trace.fields,
+                    type='stage',
+                    stage=name,
+                    wall_s=wall,
+                    cpu_s=time.process_time() - cpu_start,
+                    children_cpu_s=max(0.0, (children.ru_utime + children.ru_stime)
+                                       - (children_start.ru_utime + children_start.ru_stime)),
+                    items=trace.items,
+                    items_per_s=trace.items / wall if wall > 0 else None,
+                    rss_mb=get_rss_mb(),
+                    peak_rss_mb=rss.peak_mb,
+                    peak_rss_delta_mb=(rss.peak_mb - rss.start_mb
+                                       if rss.peak_mb is not None and rss.start_mb is not None else None),
+                ))
+
+    # Wraps a hot loop with the sampling profiler. The sampler runs whenever tracing is on but only takes
+    # samples while self.profiling is set, so profiling can be switched on and off mid-loop.
+    @contextmanager
+    def profile(self, name: str, interval: float = 0.005, depth: int = 32, top: int = 50):
+        if self.path is None:
+            yield
+            return
+        sampler = StackSampler(self, threading.get_ident(), interval, depth)
+        sampler.start()
+        try:
+            yield
+        finally:
+            sampler.stopped.set()
+            sampler.join()
+            if sampler.samples:
+                self.write({'type': 'profile', 'stage': name, 'interval_s': interval,
+                            'samples': sum(sampler.samples.values()),
+                            'stacks': sampler.samples.most_common(top)})
+
+    def set_profiling(self, enabled: bool):
+        self.profiling = enabled
+
+    def toggle_profiling(self, *_):
+        self.profiling = not self.profiling
+
+    # Lets `kill -USR1 <pid>` switch the profiler; only possible from the main thread
+    def install_signal_toggle(self, signum=getattr(signal, 'SIGUSR1', None)):
+        if signum is not None and threading.current_thread() is threading.main_thread():
+            signal.signal(signum, self.toggle_profiling)
+
+    def flush(self):
+        with self.lock:
+            counters = dict(self.counters)
+            self.counters.clear()
+        if counters:
+            self.write({'type': 'counters', 'counters': counters})
+
+
+tracer = Tracer(os.environ.get(TRACE_ENV) or None, os.environ.get(PROFILE_ENV, '') not in ('', '0'))
+atexit.register(tracer.flush)
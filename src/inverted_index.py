@@ -0,0 +1,119 @@
+import math
+import numpy as np
+from numpy.linalg import norm
+from idf_table import IdfTable
+
+EMPTY_DOCS = np.empty(0, dtype=np.int64)
+EMPTY_WEIGHTS = np.empty(0, dtype=np.float64)
+
+
+class InvertedIndex:
+    def __init__(self, vocabulary: dict[str, int], offsets: np.ndarray, doc_indices: np.ndarray,
+                 weights: np.ndarray, norms: np.ndarray, doc_ids: list[str]):
+        # Postings of term t are doc_indices/weights[offsets[t]:offsets[t + 1]], sorted by doc index
+        self.vocabulary = vocabulary
+        self.offsets = offsets
+        self.doc_indices = doc_indices
+        self.weights = weights
+        self.norms = norms
+        self.doc_ids = doc_ids
+
+    @property
+    def num_docs(self) -> int:
+        return len(self.doc_ids)
+
+    def postings(self, term: str) -> tuple[np.ndarray, np.ndarray]:
+        term_id = self.vocabulary.get(term)
+        if term_id is None:
+            return EMPTY_DOCS, EMPTY_WEIGHTS
+        start, end = self.offsets[term_id], self.offsets[term_id + 1]
+        return self.doc_indices[start:end], self.weights[start:end]
+
+
+def build_inverted_index(doc_tf: list[dict[str, float]], idf_table: IdfTable, doc_ids: list[str]) -> InvertedIndex:
+    vocabulary = idf_table.vocabulary
+    idf = idf_table.idf.tolist()
+    postings: list[tuple[list[int], list[float]]] = [([], []) for _ in range(len(vocabulary))]
+    for doc_idx, tf in enumerate(doc_tf):
+        for word, word_tf in tf.items():
+            term_id = vocabulary[word]
+            docs, weights = postings[term_id]
+            docs.append(doc_idx)
+            weights.append(word_tf * idf[term_id])
+
+    offsets = np.zeros(len(postings) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(docs) for docs, _ in postings])
+
+    doc_indices = np.fromiter((d for docs, _ in postings for d in docs), dtype=np.int64, count=offsets[-1])
+    weights = np.fromiter((w for _, ws in postings for w in ws), dtype=np.float64, count=offsets[-1])
+    norms = np.sqrt(np.bincount(doc_indices, weights=weights * weights, minlength=len(doc_ids)))
+
+    return InvertedIndex(vocabulary, offsets, doc_indices, weights, norms, doc_ids)
+
+
+# Cosine between the query vector and the document restricted to the query's words, one entry per
+# query word occurrence, exactly as the per-document loop in query_vectorizer used to compute it.
+# Only documents containing at least one query word are scored; every other document scores 0.
+def score_query(index: InvertedIndex, query: list[str], query_vec: list[float]) -> tuple[np.ndarray, np.ndarray]:
+    term_postings = [index.postings(word) for word in query]
+    candidates = np.unique(np.concatenate([docs for docs, _ in term_postings] or [EMPTY_DOCS]))
+
+    doc_matrix = np.zeros((len(candidates), len(query)), dtype=np.float64)
+    for col, (docs, weights) in enumerate(term_postings):
+        doc_matrix[np.searchsorted(candidates, docs), col] = weights
+
+    a = np.array(query_vec)
+    norm_a = norm(a)
+    scores = np.zeros(len(candidates), dtype=np.float64)
+    if norm_a == 0:
+        return candidates, scores
+
+    for row, b in enumerate(doc_matrix):
+        norm_b = norm(b)
+        if norm_b != 0:
+            cos_similarity = np.dot(a, b) / (norm_a * norm_b)
+            if not math.isnan(cos_similarity):
+                scores[row] = cos_similarity
+
+    return candidates, scores
+
+
+# Pads a ranking with unscored documents in corpus order, as a stable sort over every document would
+def fill_ranking(ranked: list[int], num_docs: int, k: int) -> list[int]:
+    ranked = list(ranked)
+    seen = set(ranked)
+    doc_idx = 0
+    while len(ranked) < k and doc_idx < num_docs:
+        if doc_idx not in seen:
+            ranked.append(doc_idx)
+        doc_idx += 1
+    return ranked
+
+
+# Top k (doc_id, score) pairs, ties broken by corpus order like a stable sort over every document
+def top_documents(index: InvertedIndex, query: list[str], query_vec: list[float], k: int = 10) -> list[tuple[str, float]]:
+    candidates, scores = score_query(index, query, query_vec)
+    order = np.argsort(-scores, kind='stable')
+
+    doc_scores = {}
+    for i in order[:k]:
+        if scores[i] <= 0:
+            break
+        doc_scores[int(candidates[i])] = float(scores[i])
+
+    return [(index.doc_ids[doc_idx], doc_scores.get(doc_idx, 0.0))
+            for doc_idx in fill_ranking(list(doc_scores), index.num_docs, k)]
+
+
+# Unit-length query weights by term id for full-vector cosine; words not in the index can't match and are dropped
+def get_query_weights(index: InvertedIndex, query_tf: dict[str, float], query_idf: IdfTable) -> dict[int, float]:
+    weights = {}
+    for word, word_tf in query_tf.items():
+        term_id = index.vocabulary.get(word)
+        if term_id is not None:
+            weights[term_id] = word_tf * query_idf.get_idf(word)
+
+    query_norm = math.sqrt(sum(w * w for w in weights.values()))
+    if query_norm == 0:
+        return {}
+    return {term_id: w / query_norm for term_id, w in weights.items()}
@@ -0,0 +1,101 @@
+import bz2
+import os
+import xml.etree.ElementTree as ET
+from xml.sax.saxutils import escape
+
+from tqdm import tqdm
+
+MW_NS = 'http://www.mediawiki.org/xml/export-0.11/'
+READ_SIZE = 256 * 1024
+
+
+# Index lines are "offset:page_id:title"; titles may contain ':' themselves.
+# Returns stream offset -> titles wanted from that stream.
+def load_multistream_index(index_path, titles_to_filter: set[str]) -> dict[int, set[str]]:
+    opener = bz2.open if index_path.endswith('.bz2') else open
+    streams: dict[int, set[str]] = {}
+    with opener(index_path, 'rt', encoding='utf-8') as file:
+        for line in file:
+            offset, _, title = line.rstrip('\n').split(':', 2)
+            if title in titles_to_filter:
+                streams.setdefault(int(offset), set()).add(title)
+    return streams
+
+
+# Decompresses the single bz2 stream starting at offset. Returns the XML and the compressed bytes read.
+def read_stream(file, offset: int) -> tuple[bytes, int]:
+    file.seek(offset)
+    decompressor = bz2.BZ2Decompressor()
+    chunks = []
+    bytes_read = 0
+    while not decompressor.eof:
+        data = file.read(READ_SIZE)
+        if not data:
+            break
+        bytes_read += len(data)
+        chunks.append(decompressor.decompress(data))
+    bytes_read -= len(decompressor.unused_data)
+    return b''.join(chunks), bytes_read
+
+
+# A page stream is a run of bare <page> elements with no enclosing root or namespace declaration
+def parse_stream_pages(xml: bytes):
+    root = ET.fromstring(b'<pages>' + xml + b'</pages>')
+    for page in root.iter('page'):
+        title = page.find('title')
+        text = page.find('revision/text')
+        yield (title.text if title is not None else None,
+               text.text if text is not None else None)
+
+
+class MultistreamStats:
+    def __init__(self, dump_size: int):
+        self.dump_size = dump_size
+        self.streams_read = 0
+        self.bytes_read = 0
+
+    def __str__(self):
+        fraction = self.bytes_read / self.dump_size if self.dump_size else 0
+        return f'Read {self.streams_read} streams, {self.bytes_read} of {self.dump_size} bytes ({fraction:.2%})'
+
+
+# Yields (title, text) for the target pages, in dump order, decompressing only the streams that hold them
+def iter_pages_multistream(dump_path, index_path, titles_to_filter: set[str], stats: MultistreamStats = None):
+    streams = load_multistream_index(index_path, titles_to_filter)
+    if stats is None:
+        stats = MultistreamStats(os.path.getsize(dump_path))
+
+    with open(dump_path, 'rb') as file:
+        for offset in tqdm(sorted(streams), desc='Processing multistream blocks'):
+            xml, bytes_read = read_stream(file, offset)
+            stats.streams_read += 1
+            stats.bytes_read += bytes_read
+
+            wanted = streams[offset]
+            for title, text in parse_stream_pages(xml):
+                if title in wanted:
+                    yield title, text
+
+
+# Writes pages the way enwiki's multistream dumps are laid out: a header stream, independent bz2 streams
+# of pages_per_stream pages each, a footer stream, and a bz2 index of offset:page_id:title lines
+def write_multistream_fixture(pages: list[tuple[str, str]], dump_path, index_path, pages_per_stream=100):
+    index_lines = []
+    with open(dump_path, 'wb') as dump:
+        header = f'<mediawiki xmlns="{MW_NS}" version="0.11" xml:lang="en">\n  <siteinfo>\n  </siteinfo>\n'
+        dump.write(bz2.compress(header.encode('utf-8')))
+
+        for start in range(0, len(pages), pages_per_stream):
+            offset = dump.tell()
+            xml = []
+            for page_id, (title, text) in enumerate(pages[start:start + pages_per_stream], start=start + 1):
+                xml.append(f'  <page>\n    <title>{escape(title)}</title>\n    <ns>0</ns>\n    <id>{page_id}</id>\n'
+                           f'    <revision>\n      <text xml:space="preserve">{escape(text)}</text>\n    </revision>\n'
+                           f'  </page>\n')
+                index_lines.append(f'{offset}:{page_id}:{title}\n')
+            dump.write(bz2.compress(''.join(xml).encode('utf-8')))
+
+        dump.write(bz2.compress(b'</mediawiki>\n'))
+
+    with bz2.open(index_path, 'wt', encoding='utf-8') as index:
+        index.writelines(index_lines)
@@ -0,0 +1,168 @@
+import os
+import queue
+import threading
+import traceback
+from multiprocessing import Process, Queue
+from tqdm import tqdm
+
+from data_loader import DATA_DIR
+from idf_table import get_query_vector
+from index_store import get_cache_key, open_index
+from instrumentation import get_private_rss_mb, get_rss_mb, tracer
+from inverted_index import top_documents
+from query_vectorizer import (get_index_cache_dir, get_query_idf, get_tf_scores, load_index, load_queries,
+                              word_tokenizer)
+
+
+# Worker loop: maps the saved index (the pages are shared with every other worker through the page cache,
+# nothing is copied), then scores chunks of (query id, query, query vector) until it gets None. Replies are
+# ('ok', chunk number, ranking lines), ('error', chunk number, traceback) and finally
+# ('done', pid, (RSS, private RSS) in MB). A worker that can't open the index replies ('error', None, traceback).
+def score_worker(cache_dir, cache_key, tasks: Queue, results: Queue, k: int):
+    try:
+        opened = open_index(cache_dir, cache_key)
+        if opened is None:
+            raise RuntimeError(f'No index for cache key {cache_key} in {cache_dir}')
+        index, _ = opened
+    except Exception:
+        results.put(('error', None, traceback.format_exc()))
+        return
+    while (task := tasks.get()) is not None:
+        chunk_num, chunk = task
+        try:
+            lines = []
+            for query_id, query, query_vec in chunk:
+                for rank, (doc_id, sim_score) in enumerate(top_documents(index, query, query_vec, k)):
+                    lines.append(f'{query_id} {doc_id} {rank + 1} {sim_score}\n')
+            results.put(('ok', chunk_num, lines))
+        except Exception:
+            results.put(('error', chunk_num, traceback.format_exc()))
+    results.put(('done', os.getpid(), (get_rss_mb(), get_private_rss_mb())))
+
+
+# Writes chunks in chunk order as they arrive in any order, holding back only those that came early
+class OrderedWriter:
+    def __init__(self, file):
+        self.file = file
+        self.next_chunk = 0
+        self.pending: dict[int, list[str]] = {}
+
+    def add(self, chunk_num: int, lines: list[str]):
+        self.pending[chunk_num] = lines
+        while self.next_chunk in self.pending:
+            self.file.writelines(self.pending.pop(self.next_chunk))
+            self.next_chunk += 1
+
+
+# Next reply from the workers. Polls so that a worker that died without replying (killed, out of memory,
+# crashed in native code) fails the run instead of leaving it waiting forever.
+def get_result(results: Queue, processes: list[Process], finished: dict[int, tuple], poll_interval: float):
+    while True:
+        try:
+            return results.get(timeout=poll_interval)
+        except queue.Empty:
+            pass
+        dead = [process for process in processes if process.exitcode is not None and process.pid not in finished]
+        if dead:
+            # A worker that exited normally flushed its 'done' first; one more poll lets it arrive
+            try:
+                return results.get(timeout=poll_interval)
+            except queue.Empty:
+                raise RuntimeError(f'Worker {dead[0].pid} exited with code {dead[0].exitcode} without finishing')
+
+
+# Scores the legacy way (query_vectorizer.main's top_documents) across worker processes and streams the
+# ranking to output_path in query order. At most max_pending chunks are queued ahead of the workers.
+# Returns (RSS, private RSS) in MB of each worker when it finished, by pid. cache_key saves hashing the
+# corpus again when the caller already has it.
+def score_parallel(file_name, queries: list[list[str]], query_vecs: list[list[float]], query_ids: list[str],
+                   output_path, k=10, workers=None, chunk_size=32, max_pending=None, cache_key=None,
+                   poll_interval=1.0) -> dict[int, tuple]:
+    cache_key = cache_key or get_cache_key(file_name, word_tokenizer)
+    # Builds the on-disk index if needed; the workers then map it rather than each rebuilding it
+    load_index(file_name, cache_key)
+    cache_dir = get_index_cache_dir(file_name)
+
+    workers = workers or os.cpu_count()
+    tasks = Queue(max_pending or workers * 4)
+    results = Queue()
+    processes = [Process(target=score_worker, args=(cache_dir, cache_key, tasks, results, k), daemon=True)
+                 for _ in range(workers)]
+    for process in processes:
+        process.start()
+
+    chunks = [list(zip(query_ids[start:start + chunk_size], queries[start:start + chunk_size],
+                       query_vecs[start:start + chunk_size]))
+              for start in range(0, len(queries), chunk_size)]
+
+    def feed():
+        for task in enumerate(chunks):
+            tasks.put(task)
+        for _ in processes:
+            tasks.put(None)
+
+    feeder = threading.Thread(target=feed, daemon=True)
+    feeder.start()
+
+    worker_rss = {}
+    try:
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        with open(output_path, 'w') as out, tqdm(total=len(queries), desc="Processing queries") as progress:
+            writer = OrderedWriter(out)
+            while len(worker_rss) < len(processes):
+                status, key, value = get_result(results, processes, worker_rss, poll_interval)
+                if status == 'error' and key is None:
+                    raise RuntimeError(f'Worker failed to open the index:\n{value}')
+                if status == 'error':
+                    raise RuntimeError(f'Scoring chunk {key} failed:\n{value}')
+                if status == 'done':
+                    worker_rss[key] = value
+                    continue
+                writer.add(key, value)
+                progress.update(len(chunks[key]))
+    finally:
+        # Workers that haven't said they're done are stuck behind a failed run; don't wait for them
+        for process in processes:
+            if len(worker_rss) < len(processes):
+                process.terminate()
+            process.join()
+
+    return worker_rss
+
+
+def format_mb(value: float | None) -> str:
+    return 'n/a' if value is None else f'{value:.1f} MB'
+
+
+def main(query_idf_mode='queries', workers=None, chunk_size=32):
+    stem_cache_path = os.path.join(DATA_DIR, "cache/stems.json")
+    word_tokenizer.load(stem_cache_path)
+
+    with tracer.stage('load_queries') as stage:
+        queries, query_ids = load_queries(os.path.join(DATA_DIR, "processed/keysearch.qry"))
+        query_tf = get_tf_scores(queries)
+        stage.add(len(queries))
+
+    file_name = os.path.join(DATA_DIR, "processed/articles-1.txt")
+    cache_key = get_cache_key(file_name, word_tokenizer)
+    with tracer.stage('load_index') as stage:
+        _, doc_idf = load_index(file_name, cache_key)
+        stage.add(doc_idf.num_docs)
+    query_idf = get_query_idf(queries, doc_idf, query_idf_mode)
+    query_vecs = [get_query_vector(query, query_tf[qid], query_idf) for qid, query in enumerate(queries)]
+
+    workers = workers or os.cpu_count()
+    with tracer.stage('score', items=len(queries), workers=workers, chunk_size=chunk_size) as stage:
+        worker_rss = score_parallel(file_name, queries, query_vecs, query_ids,
+                                    os.path.join(DATA_DIR, "results", "ranking_output_parallel.txt"),
+                                    workers=workers, chunk_size=chunk_size, cache_key=cache_key)
+        stage.fields['worker_rss_mb'] = [worker_rss[pid] for pid in sorted(worker_rss)]
+
+    for pid, (rss, private_rss) in sorted(worker_rss.items()):
+        print(f'Worker {pid}: RSS {format_mb(rss)}, private {format_mb(private_rss)}')
+    word_tokenizer.save(stem_cache_path)
+    tracer.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,489 @@
+import os
+import sys
+import time
+import numpy as np
+
+from tqdm import tqdm
+
+from compact_corpus import build_corpus_idf_table, build_corpus_index
+from data_loader import DATA_DIR
+from index_store import (MANIFEST_NAME, MappedVocabulary, get_cache_key, get_sorted_layout, open_string_table,
+                         read_manifest, save_array, save_manifest, save_string_table)
+from idf_table import IdfTable, get_query_vector
+from inverted_index import EMPTY_DOCS, EMPTY_WEIGHTS, InvertedIndex, score_query, top_documents
+from query_vectorizer import (get_index_cache_dir, get_query_idf, get_tf_scores, load_corpus, load_index,
+                              load_queries, save_ranking, word_tokenizer)
+
+CODEC_FORMAT_VERSION = 2
+BLOCK_SIZE = 128
+# Widest doc gap or term count a block can hold, in bits
+MAX_WIDTH = 32
+# Each value is read as the 8 bytes from the byte its first bit is in: up to 7 bits of shift plus the value
+READ_BYTES = 8
+
+
+# Number of bits needed for each value (0 for 0)
+def bit_widths(values: np.ndarray) -> np.ndarray:
+    widths = np.zeros(len(values), dtype=np.int64)
+    nonzero = values > 0
+    widths[nonzero] = np.floor(np.log2(values[nonzero])).astype(np.int64) + 1
+    return widths
+
+
+# Writes each value into the bit stream at its bit offset, least significant bit first
+def pack_bits(values: np.ndarray, bit_starts: np.ndarray, widths: np.ndarray, total_bits: int) -> np.ndarray:
+    bits = np.zeros(total_bits, dtype=np.uint8)
+    values = values.astype(np.uint64)
+    for bit in range(int(widths.max(initial=0))):
+        has_bit = widths > bit
+        bits[bit_starts[has_bit] + bit] = (values[has_bit] >> np.uint64(bit)) & np.uint64(1)
+    return np.packbits(bits, bitorder='little')
+
+
+# Reads values back out of a packed stream (padded with READ_BYTES spare bytes) without a loop per value:
+# one gather from a view of every unaligned 8-byte window of the stream, then a shift and a mask
+def unpack_bits(data: np.ndarray, bit_starts: np.ndarray, widths) -> np.ndarray:
+    data = np.ascontiguousarray(data)
+    windows = np.ndarray((len(data) - READ_BYTES + 1,), dtype='<u8', buffer=data, strides=(1,))
+    masks = (np.uint64(1) << np.asarray(widths, dtype=np.uint64)) - np.uint64(1)
+    return (windows[bit_starts >> 3] >> (bit_starts & 7).astype(np.uint64)) & masks
+
+
+# Each term's postings cut into blocks of block_size (the last one shorter), each block byte-aligned in data:
+#   doc gaps - 1 (the first gap of a term counts from -1), bit-packed at the block's doc width,
+#   then term counts - 1, bit-packed at the block's count width.
+# Both are lossless; the TF-IDF weights are recomputed from the counts on decode (see CompressedIndex).
+# offsets are those of the raw index; term t's bytes start at data_offsets[t].
+class CompressedPostings:
+    def __init__(self, offsets: np.ndarray, data_offsets: np.ndarray, doc_widths: np.ndarray,
+                 count_widths: np.ndarray, data: np.ndarray, block_size: int):
+        self.offsets = offsets
+        self.data_offsets = data_offsets
+        self.doc_widths = doc_widths
+        self.count_widths = count_widths
+        self.data = data
+        self.block_size = block_size
+        self.term_blocks = np.zeros(len(offsets), dtype=np.int64)
+        self.term_blocks[1:] = np.cumsum(-(-np.diff(offsets) // block_size))
+
+    @property
+    def num_postings(self) -> int:
+        return int(self.offsets[-1])
+
+    # (doc indices, term counts) of terms first_term:last_term, back to back as in InvertedIndex
+    def decode_terms(self, first_term: int, last_term: int) -> tuple[np.ndarray, np.ndarray]:
+        offsets = self.offsets[first_term:last_term + 1] - self.offsets[first_term]
+        num_postings = int(offsets[-1])
+        if num_postings == 0:
+            return EMPTY_DOCS, EMPTY_DOCS
+        term_blocks = self.term_blocks[first_term:last_term + 1] - self.term_blocks[first_term]
+
+        if last_term - first_term == 1:
+            position = np.arange(num_postings)
+        else:
+            lengths = np.diff(offsets)
+            position = np.arange(num_postings) - np.repeat(offsets[:-1] - term_blocks[:-1] * self.block_size, lengths)
+        # position is now counted from the start of the term's first block as if every block were full
+        block_of = position // self.block_size
+        position -= block_of * self.block_size
+
+        blocks = slice(self.term_blocks[first_term], self.term_blocks[last_term])
+        doc_widths = self.doc_widths[blocks].astype(np.int64)
+        count_widths = self.count_widths[blocks].astype(np.int64)
+        block_lengths = np.bincount(block_of, minlength=len(doc_widths))
+        block_bits = np.zeros(len(doc_widths), dtype=np.int64)
+        block_bits[1:] = 8 * np.cumsum(-(-(block_lengths * (doc_widths + count_widths)) // 8))[:-1]
+        data = self.data[self.data_offsets[first_term]:self.data_offsets[last_term] + READ_BYTES]
+
+        posting_widths = doc_widths[block_of]
+        gaps = unpack_bits(data, block_bits[block_of] + position * posting_widths, posting_widths)
+        posting_widths = count_widths[block_of]
+        count_starts = (block_bits + block_lengths * doc_widths)[block_of] + position * posting_widths
+        counts = unpack_bits(data, count_starts, posting_widths).astype(np.int64) + 1
+
+        docs = np.cumsum(gaps.astype(np.int64) + 1)
+        if last_term - first_term > 1:
+            # Gaps run on from one term into the next; take off where the previous term ended
+            term_starts = offsets[1:-1][(offsets[1:-1] > 0) & (offsets[1:-1] < num_postings)]
+            restart = np.zeros(num_postings, dtype=np.int64)
+            restart[term_starts] = docs[term_starts - 1]
+            docs -= np.maximum.accumulate(restart)
+        return docs - 1, counts
+
+    def decode_term(self, term_id: int) -> tuple[np.ndarray, np.ndarray]:
+        return self.decode_terms(term_id, term_id + 1)
+
+    # Every term's postings, decoded about max_postings at a time
+    def decode_all(self, max_postings=1 << 16) -> tuple[np.ndarray, np.ndarray]:
+        num_terms = len(self.offsets) - 1
+        docs = np.empty(self.num_postings, dtype=np.int64)
+        counts = np.empty(self.num_postings, dtype=np.int64)
+        first_term = 0
+        while first_term < num_terms:
+            last_term = int(np.searchsorted(self.offsets, self.offsets[first_term] + max_postings, 'right')) - 1
+            last_term = min(max(last_term, first_term + 1), num_terms)
+            start, end = self.offsets[first_term], self.offsets[last_term]
+            docs[start:end], counts[start:end] = self.decode_terms(first_term, last_term)
+            first_term = last_term
+        return docs, counts
+
+
+def encode_postings(offsets: np.ndarray, doc_indices: np.ndarray, counts: np.ndarray,
+                    block_size=BLOCK_SIZE) -> CompressedPostings:
+    offsets = np.asarray(offsets, dtype=np.int64)
+    doc_indices = np.asarray(doc_indices, dtype=np.int64)
+    counts = np.asarray(counts, dtype=np.int64)
+    lengths = np.diff(offsets)
+
+    term_blocks = np.zeros(len(lengths) + 1, dtype=np.int64)
+    term_blocks[1:] = np.cumsum(-(-lengths // block_size))
+    num_blocks = int(term_blocks[-1])
+
+    term_of = np.repeat(np.arange(len(lengths)), lengths)
+    position_in_term = np.arange(len(doc_indices)) - offsets[term_of]
+    block_of = term_blocks[term_of] + position_in_term // block_size
+    position = position_in_term % block_size
+
+    previous = np.empty(len(doc_indices), dtype=np.int64)
+    previous[1:] = doc_indices[:-1]
+    previous[position_in_term == 0] = -1
+    gaps = doc_indices - previous - 1
+    if len(gaps) and (gaps.min() < 0 or gaps.max() >= 1 << MAX_WIDTH):
+        raise ValueError(f'Postings must be sorted by doc index with gaps below 2 ** {MAX_WIDTH}')
+    if len(counts) and (counts.min() < 1 or counts.max() > 1 << MAX_WIDTH):
+        raise ValueError(f'Term counts must be between 1 and 2 ** {MAX_WIDTH}')
+
+    block_lengths = np.bincount(block_of, minlength=num_blocks).astype(np.int64)
+    doc_widths = np.zeros(num_blocks, dtype=np.int64)
+    count_widths = np.zeros(num_blocks, dtype=np.int64)
+    if len(gaps):
+        np.maximum.at(doc_widths, block_of, bit_widths(gaps))
+        np.maximum.at(count_widths, block_of, bit_widths(counts - 1))
+
+    block_bytes = -(-(block_lengths * (doc_widths + count_widths)) // 8)
+    block_offsets = np.zeros(num_blocks + 1, dtype=np.int64)
+    block_offsets[1:] = np.cumsum(block_bytes)
+    block_bits = 8 * block_offsets[:-1]
+
+    gap_starts = block_bits[block_of] + position * doc_widths[block_of]
+    count_starts = block_bits[block_of] + block_lengths[block_of] * doc_widths[block_of] + position * count_widths[block_of]
+    data = pack_bits(np.concatenate([gaps, counts - 1]), np.concatenate([gap_starts, count_starts]),
+                     np.concatenate([doc_widths[block_of], count_widths[block_of]]), 8 * int(block_offsets[-1]))
+    data = np.concatenate([data, np.zeros(READ_BYTES, dtype=np.uint8)])
+
+    return CompressedPostings(offsets, block_offsets[term_blocks], doc_widths.astype(np.uint8),
+                              count_widths.astype(np.uint8), data, block_size)
+
+
+# Drop-in for InvertedIndex where only postings lookups are needed (top_documents, score_query). Weights are
+# recomputed from the decoded counts as count / document length * idf, the same operations in the same order
+# as build_corpus_index, so they are bit-identical to the raw index's and so are the rankings.
+class CompressedIndex:
+    def __init__(self, vocabulary, postings: CompressedPostings, doc_lengths: np.ndarray, idf_table: IdfTable,
+                 norms: np.ndarray, doc_ids):
+        self.vocabulary = vocabulary
+        self.compressed = postings
+        self.doc_lengths = doc_lengths
+        self.idf_table = idf_table
+        self.norms = norms
+        self.doc_ids = doc_ids
+
+    @property
+    def num_docs(self) -> int:
+        return len(self.doc_ids)
+
+    def postings(self, term: str) -> tuple[np.ndarray, np.ndarray]:
+        term_id = self.vocabulary.get(term)
+        if term_id is None:
+            return EMPTY_DOCS, EMPTY_WEIGHTS
+        docs, counts = self.compressed.decode_term(term_id)
+        return docs, counts / self.doc_lengths[docs] * self.idf_table.idf[term_id]
+
+    def to_inverted_index(self) -> InvertedIndex:
+        docs, counts = self.compressed.decode_all()
+        idf = np.repeat(np.asarray(self.idf_table.idf), np.diff(self.compressed.offsets))
+        return InvertedIndex(self.vocabulary, self.compressed.offsets, docs, counts / self.doc_lengths[docs] * idf,
+                             self.norms, self.doc_ids)
+
+
+POSTINGS_ARRAYS = ('offsets', 'data_offsets', 'doc_widths', 'count_widths', 'data')
+# Everything besides the postings that recomputing the weights and scoring needs
+INDEX_ARRAYS = ('doc_lengths', 'df', 'idf', 'norms')
+
+
+def get_compressed_cache_dir(file_name):
+    return os.path.join(DATA_DIR, "cache/compressed", os.path.splitext(os.path.basename(file_name))[0])
+
+
+# Tokenizes the corpus for its term counts (the saved raw index only has the weights) and writes the compressed
+# index in the saved index's term order
+def build_compressed_index(file_name, directory, settings: dict):
+    corpus = load_corpus(file_name)
+    doc_idf = build_corpus_idf_table(corpus)
+    # Norms exactly as load_index's index has them
+    index = build_corpus_index(corpus, doc_idf)
+    _, _, counts = corpus.get_term_doc_counts()
+
+    os.makedirs(directory, exist_ok=True)
+    # Drop the manifest first so a half-written index can never be opened under the old settings
+    manifest_path = os.path.join(directory, MANIFEST_NAME)
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+
+    terms, order, offsets, gather = get_sorted_layout(index.vocabulary, index.offsets)
+    postings = encode_postings(offsets, index.doc_indices[gather], counts[gather], settings['block_size'])
+    for name in POSTINGS_ARRAYS:
+        save_array(os.path.join(directory, f'{name}.npy'), getattr(postings, name))
+    save_array(os.path.join(directory, 'doc_lengths.npy'), corpus.doc_lengths)
+    save_array(os.path.join(directory, 'df.npy'), doc_idf.df[order])
+    save_array(os.path.join(directory, 'idf.npy'), doc_idf.idf[order])
+    save_array(os.path.join(directory, 'norms.npy'), index.norms)
+    save_string_table(terms, directory, 'terms')
+    save_string_table(list(index.doc_ids), directory, 'doc_ids')
+    save_manifest(directory, dict(settings, num_docs=corpus.num_docs))
+
+
+def load_compressed_postings(directory, settings: dict, mmap_mode='r') -> CompressedPostings:
+    return CompressedPostings(*(np.load(os.path.join(directory, f'{name}.npy'), mmap_mode=mmap_mode)
+                                for name in POSTINGS_ARRAYS), settings['block_size'])
+
+
+def open_compressed_index(directory, settings: dict, mmap_mode='r') -> CompressedIndex | None:
+    manifest = read_manifest(directory)
+    if manifest is None or {key: manifest.get(key) for key in settings} != settings:
+        return None
+
+    def load(name):
+        return np.load(os.path.join(directory, f'{name}.npy'), mmap_mode=mmap_mode)
+
+    vocabulary = MappedVocabulary(open_string_table(directory, 'terms'))
+    return CompressedIndex(vocabulary, load_compressed_postings(directory, settings, mmap_mode), load('doc_lengths'),
+                           IdfTable(vocabulary, load('df'), manifest['num_docs'], load('idf')), load('norms'),
+                           open_string_table(directory, 'doc_ids'))
+
+
+def get_compressed_settings(file_name, block_size=BLOCK_SIZE, cache_key=None) -> dict:
+    return {'cache_key': cache_key or get_cache_key(file_name, word_tokenizer), 'block_size': block_size,
+            'format_version': CODEC_FORMAT_VERSION}
+
+
+# The compressed counterpart of load_index: opens the compressed index for this corpus file, building it
+# first if it is missing or was built from different corpus bytes, tokenizer settings or block size
+def load_compressed_index(file_name, block_size=BLOCK_SIZE, cache_key=None) -> CompressedIndex:
+    settings = get_compressed_settings(file_name, block_size, cache_key)
+    directory = get_compressed_cache_dir(file_name)
+    compressed = open_compressed_index(directory, settings)
+    if compressed is None:
+        build_compressed_index(file_name, directory, settings)
+        compressed = open_compressed_index(directory, settings)
+    return compressed
+
+
+# Encodes, decodes (per term, in chunks and whole) and compares. Returns what didn't match.
+def check_postings(offsets, doc_indices, counts, block_size=BLOCK_SIZE) -> list[str]:
+    offsets = np.asarray(offsets, dtype=np.int64)
+    doc_indices = np.asarray(doc_indices, dtype=np.int64)
+    counts = np.asarray(counts, dtype=np.int64)
+    postings = encode_postings(offsets, doc_indices, counts, block_size)
+
+    failures = []
+    for max_postings in (1, block_size + 1, 1 << 20):
+        docs, decoded = postings.decode_all(max_postings)
+        if not np.array_equal(docs, doc_indices):
+            failures.append(f'decode_all({max_postings}) doc indices differ')
+        if not np.array_equal(decoded, counts):
+            failures.append(f'decode_all({max_postings}) counts differ')
+    for term_id in range(len(offsets) - 1):
+        start, end = offsets[term_id], offsets[term_id + 1]
+        docs, decoded = postings.decode_term(term_id)
+        if not np.array_equal(docs, doc_indices[start:end]):
+            failures.append(f'term {term_id} doc indices differ')
+        if not np.array_equal(decoded, counts[start:end]):
+            failures.append(f'term {term_id} counts differ')
+    return failures
+
+
+def random_postings(rng: np.random.Generator, num_terms: int, num_docs: int):
+    lengths = np.minimum(rng.geometric(rng.choice([0.5, 0.05, 0.005], num_terms)), num_docs)
+    lengths[rng.random(num_terms) < 0.1] = 0
+    docs = [np.sort(rng.choice(num_docs, length, replace=False)) for length in lengths]
+    offsets = np.zeros(num_terms + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(lengths)
+    doc_indices = np.concatenate(docs or [EMPTY_DOCS]).astype(np.int64)
+    counts = rng.geometric(rng.choice([0.9, 0.3, 0.001]), len(doc_indices))
+    return offsets, doc_indices, counts
+
+
+# The codec's round-trip checks: edge cases first, then random postings under several block sizes
+def check_round_trip(seed=0, random_cases=20) -> list[str]:
+    def postings(*lists):
+        offsets = np.zeros(len(lists) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(docs) for docs in lists])
+        doc_indices = np.concatenate([np.asarray(docs, dtype=np.int64) for docs in lists] or [EMPTY_DOCS])
+        return offsets, doc_indices, np.arange(len(doc_indices)) % 5 + 1
+
+    cases = {
+        'no terms': postings(),
+        'empty terms': postings([], [3], [], [], [0, 1], []),
+        'single posting': postings([0]),
+        'consecutive docs': postings(range(1000), range(5, 300)),
+        'largest gap': postings([0, (1 << 32) - 1], [(1 << 32) - 1, (1 << 32) + (1 << 31)]),
+        'block edges': postings(range(0, 256, 2), range(0, 258, 2), range(0, 254, 2), range(0, 1, 2)),
+        'single counts': (np.array([0, 3]), np.array([1, 2, 9]), np.ones(3)),
+        'largest count': (np.array([0, 3]), np.array([1, 2, 9]), np.array([1, 1 << 32, 7])),
+    }
+    failures = []
+    for name, case in cases.items():
+        for block_size in (BLOCK_SIZE, 1, 7):
+            failures += [f'{name} (block {block_size}): {failure}' for failure in check_postings(*case, block_size)]
+
+    rng = np.random.default_rng(seed)
+    for case in range(random_cases):
+        block_size = int(rng.choice([1, 16, BLOCK_SIZE, 1000]))
+        failures += [f'random case {case} (block {block_size}): {failure}'
+                     for failure in check_postings(*random_postings(rng, 200, int(rng.choice([50, 5000, 1 << 32]))),
+                                                   block_size)]
+
+    for name, case in (('unsorted doc indices', ([0, 2], [5, 5], [1, 1])), ('a zero count', ([0, 1], [5], [0]))):
+        try:
+            encode_postings(*case)
+            failures.append(f'{name} were accepted')
+        except ValueError:
+            pass
+    return failures
+
+
+# Drops a file's pages from the page cache so the next read comes from disk
+def evict_from_page_cache(path) -> bool:
+    if not hasattr(os, 'posix_fadvise'):
+        return False
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+    return True
+
+
+def time_call(func, repeat: int) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+# Size, decode throughput and read time (from the page cache and, where it can be evicted, from disk) of the
+# compressed postings against the raw doc_indices.npy/weights.npy of the saved index. Reading the compressed
+# side includes recomputing the weights, and the per-document lengths and per-term IDF that takes.
+def measure_codec(raw_dir, compressed_dir, repeat=3) -> dict:
+    raw_files = [os.path.join(raw_dir, f'{name}.npy') for name in ('offsets', 'doc_indices', 'weights')]
+    compressed_files = [os.path.join(compressed_dir, f'{name}.npy') for name in POSTINGS_ARRAYS + ('doc_lengths', 'idf')]
+    settings = read_manifest(compressed_dir)
+    settings = {key: settings[key] for key in ('cache_key', 'block_size', 'format_version')}
+
+    def read_raw():
+        return [np.load(path) for path in raw_files]
+
+    def read_compressed():
+        return open_compressed_index(compressed_dir, settings, mmap_mode=None).to_inverted_index()
+
+    num_postings = len(np.load(raw_files[1], mmap_mode='r'))
+    raw_bytes = sum(os.path.getsize(path) for path in raw_files)
+    compressed_bytes = sum(os.path.getsize(path) for path in compressed_files)
+
+    postings = load_compressed_postings(compressed_dir, settings, mmap_mode=None)
+    decode_seconds = time_call(postings.decode_all, repeat)
+
+    report = {'postings': num_postings, 'raw_bytes': raw_bytes, 'compressed_bytes': compressed_bytes,
+              'ratio': raw_bytes / compressed_bytes if compressed_bytes else 0.0,
+              'bits_per_posting': 8 * compressed_bytes / num_postings if num_postings else 0.0,
+              'decode_seconds': decode_seconds,
+              'decode_postings_per_second': num_postings / decode_seconds if decode_seconds else 0.0,
+              'warm_raw_read_seconds': time_call(read_raw, repeat),
+              'warm_compressed_read_seconds': time_call(read_compressed, repeat)}
+
+    def cold(read, files):
+        def run():
+            for path in files:
+                evict_from_page_cache(path)
+            start = time.perf_counter()
+            read()
+            return time.perf_counter() - start
+        return min(run() for _ in range(repeat))
+
+    if evict_from_page_cache(raw_files[0]):
+        report['cold_raw_read_seconds'] = cold(read_raw, raw_files)
+        report['cold_compressed_read_seconds'] = cold(read_compressed, compressed_files)
+    return report
+
+
+# Queries whose candidate scores or top k differ in any bit between the raw and the compressed index;
+# with exact weights there should be none
+def count_ranking_differences(index: InvertedIndex, compressed: CompressedIndex, queries, query_vecs, k=10) -> int:
+    differences = 0
+    for query, query_vec in zip(queries, query_vecs):
+        expected_docs, expected_scores = score_query(index, query, query_vec)
+        docs, scores = score_query(compressed, query, query_vec)
+        if (not np.array_equal(docs, expected_docs) or not np.array_equal(scores, expected_scores)
+                or top_documents(index, query, query_vec, k) != top_documents(compressed, query, query_vec, k)):
+            differences += 1
+    return differences
+
+
+# query_vectorizer.main's scoring, with the postings read from the compressed index
+def score_compressed(query_idf_mode='queries', k=10):
+    queries, query_ids = load_queries(os.path.join(DATA_DIR, "processed/keysearch.qry"))
+    query_tf = get_tf_scores(queries)
+    compressed = load_compressed_index(os.path.join(DATA_DIR, "processed/articles-1.txt"))
+    query_idf = get_query_idf(queries, compressed.idf_table, query_idf_mode)
+
+    output_lines = []
+    for qid, query in enumerate(tqdm(queries, desc="Processing queries")):
+        query_vec = get_query_vector(query, query_tf[qid], query_idf)
+        for rank, (doc_id, sim_score) in enumerate(top_documents(compressed, query, query_vec, k)):
+            output_lines.append(f'{query_ids[qid]} {doc_id} {rank + 1} {sim_score}\n')
+    save_ranking(output_lines, "ranking_output_compressed.txt")
+
+
+# python postings_codec.py check | score [query_idf_mode] | [block_size] (size, speed and agreement report)
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv and argv[0] == 'check':
+        failures = check_round_trip()
+        for failure in failures:
+            print(failure)
+        print(f'{len(failures)} round-trip failures')
+        sys.exit(1 if failures else 0)
+    if argv and argv[0] == 'score':
+        score_compressed(*argv[1:2])
+        return
+
+    block_size = int(argv[0]) if argv else BLOCK_SIZE
+    file_name = os.path.join(DATA_DIR, "processed/articles-1.txt")
+    cache_key = get_cache_key(file_name, word_tokenizer)
+    compressed = load_compressed_index(file_name, block_size, cache_key)
+    index, doc_idf = load_index(file_name, cache_key)
+
+    report = measure_codec(get_index_cache_dir(file_name), get_compressed_cache_dir(file_name))
+    queries, _ = load_queries(os.path.join(DATA_DIR, "processed/keysearch.qry"))
+    query_tf = get_tf_scores(queries)
+    query_idf = get_query_idf(queries, doc_idf, 'queries')
+    query_vecs = [get_query_vector(query, query_tf[qid], query_idf) for qid, query in enumerate(queries)]
+    report['queries_ranked_differently'] = count_ranking_differences(index, compressed, queries, query_vecs)
+
+    print(f"{report['postings']} postings: {report['raw_bytes'] / 2 ** 20:.1f} MB raw, "
+          f"{report['compressed_bytes'] / 2 ** 20:.1f} MB compressed ({report['ratio']:.2f}x, "
+          f"{report['bits_per_posting']:.1f} bits per posting)")
+    print(f"Decode: {report['decode_postings_per_second'] / 1e6:.1f}M postings/s")
+    for temperature in ('warm', 'cold'):
+        if f'{temperature}_raw_read_seconds' in report:
+            print(f"{temperature.capitalize()} read: raw {report[f'{temperature}_raw_read_seconds'] * 1000:.1f} ms, "
+                  f"compressed + decode {report[f'{temperature}_compressed_read_seconds'] * 1000:.1f} ms")
+    print(f"{report['queries_ranked_differently']} of {len(queries)} queries ranked differently from the raw index")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+import os
+from collections import OrderedDict
+import numpy as np
+from tqdm import tqdm
+
+from batch_scorer import select_top_k
+from data_loader import DATA_DIR
+from idf_table import IdfTable
+from index_store import get_cache_key
+from inverted_index import InvertedIndex, get_query_weights
+from query_vectorizer import get_query_idf, get_tf_scores, load_index, load_queries, save_ranking, word_tokenizer
+
+
+# Least recently used entries are evicted once there are more than max_entries of them or, when
+# size_of is given, once their summed size passes max_bytes
+class LRUCache:
+    def __init__(self, max_entries=10_000, max_bytes=None, size_of=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size_of = size_of
+        self.entries: OrderedDict = OrderedDict()
+        self.sizes = {}
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key, default=None):
+        if key not in self.entries:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return self.entries[key]
+
+    def put(self, key, value):
+        if key in self.entries:
+            self.total_bytes -= self.sizes.pop(key, 0)
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        if self.size_of is not None:
+            self.sizes[key] = self.size_of(value)
+            self.total_bytes += self.sizes[key]
+
+        while self.entries and (len(self.entries) > self.max_entries
+                                or (self.max_bytes is not None and self.total_bytes > self.max_bytes)):
+            evicted, _ = self.entries.popitem(last=False)
+            self.total_bytes -= self.sizes.pop(evicted, 0)
+            self.evictions += 1
+
+    def clear(self):
+        self.entries.clear()
+        self.sizes.clear()
+        self.total_bytes = 0
+        self.invalidations += 1
+
+    # Sizes are only tracked with size_of, so 'bytes' is only reported then
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        stats = {'entries': len(self.entries), 'hits': self.hits, 'misses': self.misses,
+                 'hit_rate': self.hits / lookups if lookups else 0.0, 'evictions': self.evictions,
+                 'invalidations': self.invalidations}
+        if self.size_of is not None:
+            stats['bytes'] = self.total_bytes
+        return stats
+
+
+# Cache key for a tokenized query: its terms as a sorted multiset, so word order doesn't matter
+def normalize_query(query: list[str]) -> tuple[str, ...]:
+    return tuple(sorted(query))
+
+
+# Full-vector cosine search with two caches in front of the index: query -> top k hits, and per term the
+# postings with each document's partial score (weight / document norm), which every query sharing the term
+# reuses. Both are tied to the generation of the index they were filled from and dropped when it changes.
+class CachedSearcher:
+    def __init__(self, index: InvertedIndex, query_idf: IdfTable, generation: str, max_results=10_000,
+                 max_postings_bytes=256 * 1024 * 1024):
+        self.results = LRUCache(max_results)
+        self.postings = LRUCache(max_entries=len(index.vocabulary) or 1, max_bytes=max_postings_bytes,
+                                 size_of=lambda entry: entry[0].nbytes + entry[1].nbytes)
+        self.generation = None
+        self.set_index(index, query_idf, generation)
+
+    def set_index(self, index: InvertedIndex, query_idf: IdfTable, generation: str):
+        self.index = index
+        self.query_idf = query_idf
+        self.norms = np.where(index.norms == 0, 1, index.norms)
+        if generation != self.generation:
+            if self.generation is not None:
+                self.results.clear()
+                self.postings.clear()
+            self.generation = generation
+
+    def get_partial_scores(self, term_id: int) -> tuple[np.ndarray, np.ndarray]:
+        entry = self.postings.get(term_id)
+        if entry is None:
+            start, end = self.index.offsets[term_id], self.index.offsets[term_id + 1]
+            docs = np.array(self.index.doc_indices[start:end])
+            entry = (docs, self.index.weights[start:end] / self.norms[docs])
+            self.postings.put(term_id, entry)
+        return entry
+
+    # [(doc index, score)], best first, positive scores only
+    def search(self, query: list[str], k: int = 10) -> list[tuple[int, float]]:
+        key = (normalize_query(query), k)
+        hits = self.results.get(key)
+        if hits is not None:
+            return hits
+
+        scores = np.zeros(self.index.num_docs, dtype=np.float64)
+        for term_id, query_weight in sorted(get_query_weights(self.index, get_tf_scores([query])[0], self.query_idf).items()):
+            docs, partial_scores = self.get_partial_scores(term_id)
+            scores[docs] += query_weight * partial_scores
+
+        hits = [(int(doc_idx), float(scores[doc_idx])) for doc_idx in select_top_k(scores, k) if scores[doc_idx] > 0]
+        self.results.put(key, hits)
+        return hits
+
+    def stats(self) -> dict:
+        return {'generation': self.generation, 'results': self.results.stats(), 'postings': self.postings.stats()}
+
+
+def main(k=10, query_idf_mode='corpus'):
+    queries, query_ids = load_queries(os.path.join(DATA_DIR, "processed/keysearch.qry"))
+
+    file_name = os.path.join(DATA_DIR, "processed/articles-1.txt")
+    index, doc_idf = load_index(file_name)
+    searcher = CachedSearcher(index, get_query_idf(queries, doc_idf, query_idf_mode), get_cache_key(file_name, word_tokenizer))
+
+    output_lines = []
+    for qid, query in enumerate(tqdm(queries, desc="Processing queries")):
+        for rank, (doc_idx, sim_score) in enumerate(searcher.search(query, k)):
+            output_lines.append(f'{query_ids[qid]} {index.doc_ids[doc_idx]} {rank + 1} {sim_score}\n')
+
+    save_ranking(output_lines, "ranking_output_cached.txt")
+    print(searcher.stats())
+
+
+if __name__ == '__main__':
+    main()
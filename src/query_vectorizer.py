@@ -1,9 +1,12 @@
-import math
-import numpy as np
-from numpy.linalg import norm
-from nltk.stem import PorterStemmer
+from collections import Counter
 import os
+from compact_corpus import CompactCorpus, build_compact_corpus, build_corpus_idf_table, build_corpus_index
 from data_loader import DATA_DIR
+from idf_table import IdfTable, build_idf_table, get_query_vector
+from index_store import get_cache_key, open_index, save_index
+from instrumentation import tracer
+from inverted_index import top_documents
+from tokenizer import Tokenizer
 from tqdm import tqdm
 
 stop_list = ['a','the','an','and','or','but','about','above','after','along','amid','among',\
@@ -31,9 +34,8 @@ stop_list = ['a','the','an','and','or','but','about','above','after','along','am
 
 punctuation = ['.', ',', ':', '(', ')', '/', '\'', '=', '?', '!', ';', '"', '&']
 
-def parse_documents(file_name):
-    documents = []
-    doc_ids = []
+# Yields (doc id, words) one document at a time; documents without any .W text are skipped
+def iter_documents(file_name):
     with open(file_name, encoding='utf-8') as file:
         is_text = False
         curr_doc = []
@@ -41,8 +43,7 @@ def parse_documents(file_name):
         for line in file:
             if line.startswith('.I '):
                 if curr_doc:
-                    documents.append(curr_doc)
-                    doc_ids.append(curr_id)
+                    yield curr_id, curr_doc
                 curr_id = line.split()[1]
                 curr_doc = []
                 is_text = False
@@ -51,146 +52,126 @@ def parse_documents(file_name):
             elif is_text:
                 [curr_doc.append(word.strip()) for word in line.split(' ')]
         if curr_doc:
-            documents.append(curr_doc)
-            doc_ids.append(curr_id)
+            yield curr_id, curr_doc
+
+def parse_documents(file_name):
+    documents = []
+    doc_ids = []
+    for doc_id, doc in iter_documents(file_name):
+        documents.append(doc)
+        doc_ids.append(doc_id)
     return documents, doc_ids
 
+word_tokenizer = Tokenizer(stop_list, punctuation)
+
 def filter_words(document_set: list[list[str]]):
-    filtered_docs = []
-    ps = PorterStemmer()
-    for doc in document_set:
-        filtered_doc = []
-        for word in doc:
-            if word in punctuation:
-                continue
-            # Skip anything with a digit
-            if any(c.isdigit() for c in word):
-                continue
-            # Remove punctuation from larger word
-            for punc in punctuation:
-                word = word.replace(punc, '')
-
-            if word == '':
-                continue
-
-            if word in stop_list:
-                continue
-
-            word = word.replace('--', '-')
-
-            if '-' in word:
-                for part in word.split('-'):
-                    if part.strip() != '':
-                        filtered_doc.append(ps.stem(part.lower()))
-            else:
-                filtered_doc.append(ps.stem(word.lower()))
-        filtered_docs.append(filtered_doc)
-    return filtered_docs
+    return [word_tokenizer.tokenize(doc) for doc in document_set]
 
+# Per-document dicts kept for callers that still expect them; the values come from one shared table
 def get_idf_scores_dict(documents: list[list[str]]):
-    num_docs = len(documents)
-    docs_as_sets = []
-    for doc in documents:
-        docs_as_sets.append(set(doc))
+    table = build_idf_table(documents)
     idf_docs = []
-    for doc in tqdm(documents, desc="Calculating IDF scores"):
-        doc_idf: dict[str, float] = {}
-        for t in doc:
-            num_docs_containing_t = 0
-            for checked_doc in docs_as_sets:
-                if t in checked_doc:
-                    num_docs_containing_t += 1
-            idf = math.log(num_docs / num_docs_containing_t)
-            doc_idf[t] = idf
-
-        idf_docs.append(doc_idf)
+    for doc in documents:
+        idf_docs.append({t: table.get_idf(t) for t in doc})
     return idf_docs
 
-def main():
-    queries, query_ids = parse_documents(os.path.join(DATA_DIR, "processed/keysearch.qry"))
-    queries = filter_words(queries)
-    
-    query_idf = get_idf_scores_dict(queries)
-    query_tf = []
-    for query in queries:
-        tf = {}
-        for word in query:
-            instances = query.count(word)
-            tf[word] = instances / len(query) if len(query) > 0 else 0
-        query_tf.append(tf)
-    
-    documents, doc_ids = parse_documents(os.path.join(DATA_DIR, "processed/articles-1.txt"))
-    
-    # TESTING
-    """
-    documents = documents[:1000]
-    doc_ids = doc_ids[:1000]
-    print(f"Using subset of {len(documents)} documents for testing")
-    """
-    documents = filter_words(documents)
-
-    doc_idf = get_idf_scores_dict(documents)
-    doc_tf = []
+def get_tf_scores(documents: list[list[str]]):
+    tf_docs = []
     for document in documents:
-        tf = {}
-        for word in document:
-            instances = document.count(word)
-            tf[word] = instances / len(document) if len(document) > 0 else 0
-        doc_tf.append(tf)
-
-    output_lines = []
-
-    for qid, query in enumerate(tqdm(queries, desc="Processing queries")):
-        sims = []
-        for doc_idx, document in enumerate(documents):
-            document_vec: list[float] = []
-            for word in query:
-                if word in document:
-                    doc_word_tf = doc_tf[doc_idx][word]
-                    doc_word_idf = doc_idf[doc_idx][word]
-                    doc_tf_idf: float = doc_word_tf * doc_word_idf
-                    document_vec.append(doc_tf_idf)
-                else:
-                    document_vec.append(0)
-            
-            query_vec = []
-            for word in query:
-                query_word_tf = query_tf[qid][word]
-                query_word_idf = query_idf[qid][word]
-                query_tf_idf = query_word_tf * query_word_idf
-                query_vec.append(query_tf_idf)
-
-            a = np.array(query_vec)
-            b = np.array(document_vec)
-
-            norm_a = norm(a)
-            norm_b = norm(b)
-            cos_similarity = 0
-            if norm_a != 0 and norm_b != 0:
-                cos_similarity = np.dot(a, b) / (norm_a * norm_b)
-
-            if math.isnan(cos_similarity):
-                cos_similarity = 0
-
-            sims.append((doc_ids[doc_idx], float(cos_similarity)))
-
-        sims.sort(key=lambda x: x[1], reverse=True)
-
-        output_query_id = query_ids[qid]
-        for rank, entry in enumerate(sims):
-            doc_id = entry[0]
-            sim_score = entry[1]
-
-            if rank + 1 > 10:
-                break
-
-            output_lines.append(f'{output_query_id} {doc_id} {rank + 1} {sim_score}\n')
-
-    output_path = os.path.join(DATA_DIR, "results/ranking_output.txt")
+        counts = Counter(document)
+        tf_docs.append({word: instances / len(document) for word, instances in counts.items()})
+    return tf_docs
+
+def load_queries(file_name):
+    queries, query_ids = parse_documents(file_name)
+    return filter_words(queries), query_ids
+
+def load_corpus(file_name) -> CompactCorpus:
+    return build_compact_corpus((doc_id, word_tokenizer.tokenize(doc)) for doc_id, doc in iter_documents(file_name))
+
+def build_index(file_name):
+    hits, misses = word_tokenizer.hits, word_tokenizer.misses
+    with tracer.stage('tokenize', file=os.path.basename(file_name)) as stage:
+        corpus = load_corpus(file_name)
+        stage.add(corpus.num_docs)
+        stage.fields.update(tokens=len(corpus.term_ids), terms=corpus.num_terms, corpus_bytes=corpus.get_nbytes())
+    tracer.count('stem_cache_hits', word_tokenizer.hits - hits)
+    tracer.count('stem_cache_misses', word_tokenizer.misses - misses)
+
+    with tracer.stage('idf', items=corpus.num_docs):
+        doc_idf = build_corpus_idf_table(corpus)
+    with tracer.stage('index', items=corpus.num_docs):
+        index = build_corpus_index(corpus, doc_idf)
+
+    return index, doc_idf
+
+def get_index_cache_dir(file_name):
+    return os.path.join(DATA_DIR, "cache/index", os.path.splitext(os.path.basename(file_name))[0])
+
+# Opens the memory-mapped index for this corpus file, building and saving it first if the cached
+# one is missing or was built from a different corpus or tokenizer settings. A fresh build is opened
+# from disk too, so callers always get sorted term ids and string tables whatever the cache held.
+def load_index(file_name, cache_key=None):
+    cache_dir = get_index_cache_dir(file_name)
+    cache_key = cache_key or get_cache_key(file_name, word_tokenizer)
+
+    cached = open_index(cache_dir, cache_key)
+    if cached is not None:
+        return cached
+
+    index, doc_idf = build_index(file_name)
+    save_index(index, doc_idf, cache_dir, cache_key)
+    opened = open_index(cache_dir, cache_key)
+    if opened is None:
+        raise RuntimeError(f'Index in {cache_dir} was replaced while it was being saved')
+    return opened
+
+# query_idf_mode='queries' weights queries by IDF over the query collection (the original behaviour),
+# 'corpus' weights them with the same IDF table as the documents
+def get_query_idf(queries: list[list[str]], doc_idf: IdfTable, query_idf_mode: str) -> IdfTable:
+    if query_idf_mode == 'queries':
+        return build_idf_table(queries)
+    if query_idf_mode == 'corpus':
+        return doc_idf
+    raise ValueError(f'Unknown query IDF mode: {query_idf_mode}')
+
+def save_ranking(output_lines: list[str], file_name: str):
+    output_path = os.path.join(DATA_DIR, "results", file_name)
     os.makedirs(os.path.dirname(output_path), exist_ok=True)
     
     with open(output_path, 'w') as out:
         out.writelines(output_lines)
 
+def main(query_idf_mode='queries'):
+    stem_cache_path = os.path.join(DATA_DIR, "cache/stems.json")
+    word_tokenizer.load(stem_cache_path)
+
+    tracer.install_signal_toggle()
+
+    with tracer.stage('load_queries') as stage:
+        queries, query_ids = load_queries(os.path.join(DATA_DIR, "processed/keysearch.qry"))
+        query_tf = get_tf_scores(queries)
+        stage.add(len(queries))
+
+    with tracer.stage('load_index') as stage:
+        index, doc_idf = load_index(os.path.join(DATA_DIR, "processed/articles-1.txt"))
+        stage.add(index.num_docs)
+    query_idf = get_query_idf(queries, doc_idf, query_idf_mode)
+
+    output_lines = []
+
+    with tracer.stage('score', items=len(queries)), tracer.profile('score'):
+        for qid, query in enumerate(tqdm(queries, desc="Processing queries")):
+            query_vec = get_query_vector(query, query_tf[qid], query_idf)
+
+            output_query_id = query_ids[qid]
+            for rank, (doc_id, sim_score) in enumerate(top_documents(index, query, query_vec, k=10)):
+                output_lines.append(f'{output_query_id} {doc_id} {rank + 1} {sim_score}\n')
+
+    with tracer.stage('write', items=len(output_lines)):
+        save_ranking(output_lines, "ranking_output.txt")
+    word_tokenizer.save(stem_cache_path)
+    tracer.flush()
+
 if __name__ == '__main__':
     main()
\ No newline at end of file
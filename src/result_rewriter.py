@@ -1,3 +1,5 @@
+from doc_store import load_doc_store
+
 def parse_documents(file_name, has_title=True):
     documents = {}
     with open(file_name, encoding='utf-8') as file:
@@ -26,7 +28,7 @@ def parse_documents(file_name, has_title=True):
 
 def main():
     queries = parse_documents('../data/processed/keysearch.qry', has_title=False)
-    articles = parse_documents('../data/processed/all_articles.txt')
+    articles = load_doc_store('../data/processed/all_articles.txt', '../data/cache/docstore/all_articles')
 
     with open('../data/results/ranking_output_rust.txt') as file:
         with open('../data/results/ranking_output_titles.txt', 'w', encoding='utf-8') as output:
@@ -36,8 +38,9 @@ def main():
                 article_id = split[1]
 
                 output.write('"' + queries[int(query_id)] + '" ')
-                output.write('"' + articles[int(article_id)] + '" ')
+                output.write('"' + articles.get_title(int(article_id)) + '" ')
                 output.write(' '.join(split[2:]))
+    articles.close()
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,255 @@
+import asyncio
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+from batch_scorer import build_document_matrix, build_query_matrix, select_top_k
+from data_loader import DATA_DIR
+from index_store import get_cache_key, open_index, read_manifest
+from query_cache import LRUCache, normalize_query
+from query_vectorizer import filter_words, get_index_cache_dir, get_tf_scores, load_index, word_tokenizer
+
+# Per worker process: the memory-mapped index and its transposed document matrix, set up by init_worker
+# and again whenever a batch asks for a newer cache key
+worker_cache_dir = None
+worker_cache_key = None
+worker_index = None
+worker_idf = None
+worker_doc_matrix_t = None
+
+
+def init_worker(cache_dir, cache_key):
+    global worker_cache_dir, worker_cache_key, worker_index, worker_idf, worker_doc_matrix_t
+    opened = open_index(cache_dir, cache_key)
+    if opened is None:
+        raise RuntimeError(f'No index for cache key {cache_key} in {cache_dir}')
+    worker_index, worker_idf = opened
+    worker_doc_matrix_t = build_document_matrix(worker_index).T.tocsr()
+    worker_cache_dir, worker_cache_key = cache_dir, cache_key
+
+
+# One sparse product for every query in the batch; returns [(doc_id, score)] per query, positive scores only
+def score_batch(query_tf: list[dict[str, float]], k: int, cache_key: str) -> list[list[tuple[str, float]]]:
+    if cache_key != worker_cache_key:
+        init_worker(worker_cache_dir, cache_key)
+    query_matrix = build_query_matrix(worker_index, query_tf, worker_idf)
+    block = (query_matrix @ worker_doc_matrix_t).toarray()
+
+    results = []
+    for scores in block:
+        top = select_top_k(scores, k)
+        results.append([(worker_index.doc_ids[doc_idx], float(scores[doc_idx])) for doc_idx in top if scores[doc_idx] > 0])
+    return results
+
+
+class ServiceStats:
+    def __init__(self, window=10_000, qps_window=10.0):
+        self.started = time.monotonic()
+        self.latencies = deque(maxlen=window)
+        self.completed = deque()
+        self.qps_window = qps_window
+        self.requests = 0
+        self.batches = 0
+        self.batched_queries = 0
+
+    def record_request(self, latency: float):
+        now = time.monotonic()
+        self.requests += 1
+        self.latencies.append(latency)
+        self.completed.append(now)
+        while self.completed and self.completed[0] < now - self.qps_window:
+            self.completed.popleft()
+
+    def record_batch(self, size: int):
+        self.batches += 1
+        self.batched_queries += size
+
+    def snapshot(self) -> dict:
+        now = time.monotonic()
+        while self.completed and self.completed[0] < now - self.qps_window:
+            self.completed.popleft()
+        window = min(self.qps_window, now - self.started) or 1
+        latencies = np.array(self.latencies) * 1000
+        return {
+            'requests': self.requests,
+            'batches': self.batches,
+            'mean_batch_size': self.batched_queries / self.batches if self.batches else 0,
+            'qps': len(self.completed) / window,
+            'p50_ms': float(np.percentile(latencies, 50)) if len(latencies) else 0,
+            'p99_ms': float(np.percentile(latencies, 99)) if len(latencies) else 0,
+        }
+
+
+# Collects queries that arrive within max_wait of each other (up to max_batch) and scores them together
+# on the process pool, with at most one batch in flight per worker. Batches are scored against the index
+# built for cache_key; workers still holding an older one reopen it first.
+class MicroBatcher:
+    def __init__(self, executor: ProcessPoolExecutor, workers: int, stats: ServiceStats, cache_key: str,
+                 max_batch=64, max_wait=0.002):
+        self.executor = executor
+        self.cache_key = cache_key
+        self.stats = stats
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.slots = asyncio.Semaphore(workers)
+
+    async def submit(self, query_tf: dict[str, float], k: int) -> list[tuple[str, float]]:
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((query_tf, k, future))
+        return await future
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            await self.slots.acquire()
+            asyncio.create_task(self.score(batch))
+
+    async def score(self, batch):
+        try:
+            k = max(k for _, k, _ in batch)
+            results = await asyncio.get_running_loop().run_in_executor(
+                self.executor, score_batch, [query_tf for query_tf, _, _ in batch], k, self.cache_key)
+            self.stats.record_batch(len(batch))
+            for (_, query_k, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result[:query_k])
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            self.slots.release()
+
+
+# Line-delimited JSON: {"id": ..., "query": "...", "k": 10} -> {"id": ..., "results": [[doc_id, score], ...]},
+# {"stats": true} -> latency/QPS counters. Requests on one connection are answered as they finish.
+# Repeated queries are answered from an LRU of normalized query -> results, tied to the index's cache key;
+# identical queries arriving while one is being scored wait for that one instead of scoring again.
+# When the index is rebuilt under a new cache key, set_generation moves the workers onto it and drops
+# everything cached from the old one.
+class SearchService:
+    def __init__(self, batcher: MicroBatcher, stats: ServiceStats, generation: str, result_cache_size=10_000):
+        self.batcher = batcher
+        self.stats = stats
+        self.generation = generation
+        self.results = LRUCache(result_cache_size)
+        self.in_flight: dict[tuple, asyncio.Future] = {}
+
+    def set_generation(self, generation: str):
+        if generation != self.generation:
+            self.batcher.cache_key = generation
+            self.results.clear()
+            self.generation = generation
+
+    async def handle_request(self, request: dict) -> dict:
+        if request.get('stats'):
+            return {'id': request.get('id'), 'stats': dict(self.stats.snapshot(), cache=self.results.stats())}
+
+        start = time.perf_counter()
+        query = filter_words([request['query'].split()])[0]
+        k = int(request.get('k', 10))
+        key = (normalize_query(query), k)
+        generation = self.generation
+        flight_key = (generation, key)
+        results = self.results.get(key)
+        if results is None and flight_key in self.in_flight:
+            results = await asyncio.shield(self.in_flight[flight_key])
+        elif results is None:
+            self.in_flight[flight_key] = asyncio.ensure_future(self.batcher.submit(get_tf_scores([query])[0], k))
+            try:
+                results = await asyncio.shield(self.in_flight[flight_key])
+            finally:
+                del self.in_flight[flight_key]
+            if generation == self.generation:
+                self.results.put(key, results)
+        latency = time.perf_counter() - start
+        self.stats.record_request(latency)
+        return {'id': request.get('id'), 'results': results, 'latency_ms': latency * 1000}
+
+    async def respond(self, line: bytes, writer: asyncio.StreamWriter):
+        try:
+            response = await self.handle_request(json.loads(line))
+        except Exception as e:
+            response = {'error': str(e)}
+        writer.write(json.dumps(response).encode('utf-8') + b'\n')
+        await writer.drain()
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        pending = set()
+        try:
+            while line := await reader.readline():
+                if line.strip():
+                    task = asyncio.create_task(self.respond(line, writer))
+                    pending.add(task)
+                    task.add_done_callback(pending.discard)
+            if pending:
+                await asyncio.wait(pending)
+        finally:
+            writer.close()
+
+
+# Polls the corpus and the index manifest. A changed corpus is reindexed (load_index saves the new index
+# beside the old one's mapped files, never over them); a manifest under a new cache key, whoever wrote
+# it, becomes the service's generation.
+async def watch_index(service: SearchService, file_name, cache_dir, interval=5.0):
+    stat = os.stat(file_name)
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            new_stat = os.stat(file_name)
+            if (new_stat.st_mtime_ns, new_stat.st_size) != (stat.st_mtime_ns, stat.st_size):
+                stat = new_stat
+                await asyncio.to_thread(load_index, file_name)
+            manifest = read_manifest(cache_dir)
+            if manifest is not None and manifest['cache_key'] != service.generation:
+                print(f'Index changed, now serving {manifest["cache_key"]}')
+                service.set_generation(manifest['cache_key'])
+        except Exception as e:
+            print(f'Index watch failed: {e}')
+
+
+async def serve(file_name, host='127.0.0.1', port=8765, workers=None, max_batch=64, max_wait=0.002,
+                watch_interval=5.0):
+    # Builds the on-disk index if needed; the workers then map it rather than each rebuilding it
+    load_index(file_name)
+    cache_dir = get_index_cache_dir(file_name)
+    cache_key = get_cache_key(file_name, word_tokenizer)
+
+    workers = workers or os.cpu_count()
+    stats = ServiceStats()
+    with ProcessPoolExecutor(workers, initializer=init_worker, initargs=(cache_dir, cache_key)) as executor:
+        batcher = MicroBatcher(executor, workers, stats, cache_key, max_batch, max_wait)
+        service = SearchService(batcher, stats, cache_key)
+        batcher_task = asyncio.create_task(batcher.run())
+        watch_task = asyncio.create_task(watch_index(service, file_name, cache_dir, watch_interval))
+        server = await asyncio.start_server(service.handle_connection, host, port)
+        print(f'Serving on {host}:{port}')
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batcher_task.cancel()
+            watch_task.cancel()
+
+
+def main(host='127.0.0.1', port=8765, workers=None):
+    asyncio.run(serve(os.path.join(DATA_DIR, "processed/articles-1.txt"), host, port, workers))
+
+
+if __name__ == '__main__':
+    main()
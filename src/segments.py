@@ -0,0 +1,427 @@
+import hashlib
+import json
+import math
+import os
+import shutil
+import threading
+from collections import Counter
+import numpy as np
+
+from compact_corpus import build_corpus_idf_table, build_corpus_index
+from data_loader import DATA_DIR
+from idf_table import IdfTable
+from index_store import open_index, save_index
+from inverted_index import InvertedIndex
+from query_cache import LRUCache, normalize_query
+from query_vectorizer import load_corpus
+
+MANIFEST_NAME = 'segments.json'
+
+
+# An immutable piece of the index built from one shard (or from merging segments). Stored in the
+# index_store layout with raw TF as the postings weights and the segment's own document frequencies,
+# so nothing in it depends on global statistics. Deletions are kept beside it as a tombstone mask, saved
+# under a new file name each time (tombstones_file) so the manifest decides which one is current.
+class Segment:
+    def __init__(self, name, directory, index: InvertedIndex, local_df: IdfTable, tombstones: np.ndarray,
+                 tombstones_file: str = None):
+        self.name = name
+        self.directory = directory
+        self.index = index
+        self.local_df = local_df
+        self.tombstones = tombstones
+        self.tombstones_file = tombstones_file
+        # Set when tombstones changed since they were last saved
+        self.tombstones_changed = False
+        self.terms = None
+
+    @property
+    def num_docs(self) -> int:
+        return self.index.num_docs
+
+    @property
+    def live_docs(self) -> int:
+        return self.num_docs - int(self.tombstones.sum())
+
+    # Terms in term id order, built the first time documents are removed from the segment
+    def get_terms(self) -> list[str]:
+        if self.terms is None:
+            self.terms = [None] * len(self.local_df.vocabulary)
+            for term, term_id in self.local_df.vocabulary.items():
+                self.terms[term_id] = term
+        return self.terms
+
+    # Number of documents among docs (a boolean mask) that contain each term
+    def get_df(self, docs: np.ndarray) -> np.ndarray:
+        offsets = self.index.offsets
+        posting_terms = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+        return np.bincount(posting_terms[docs[self.index.doc_indices]], minlength=len(offsets) - 1)
+
+    def save_tombstones(self, file_name: str):
+        path = os.path.join(self.directory, file_name)
+        np.save(path + '.tmp.npy', self.tombstones)
+        os.replace(path + '.tmp.npy', path)
+        self.tombstones_file = file_name
+        self.tombstones_changed = False
+
+
+def open_segment(directory, name, tombstones_file: str = None) -> Segment:
+    seg_dir = os.path.join(directory, name)
+    index, local_df = open_index(seg_dir, name)
+    if tombstones_file is not None:
+        tombstones = np.load(os.path.join(seg_dir, tombstones_file))
+    else:
+        tombstones = np.zeros(index.num_docs, dtype=bool)
+    return Segment(name, seg_dir, index, local_df, tombstones, tombstones_file)
+
+
+def write_segment(directory, name, index: InvertedIndex, local_df: IdfTable) -> Segment:
+    save_index(index, local_df, os.path.join(directory, name), name)
+    return open_segment(directory, name)
+
+
+def build_segment(directory, name, file_name) -> Segment:
+    corpus = load_corpus(file_name)
+    local_df = build_corpus_idf_table(corpus)
+    # Unit IDF makes the postings weights the plain TF values
+    tf_only = IdfTable(local_df.vocabulary, local_df.df, local_df.num_docs, np.ones(len(local_df.df)))
+    return write_segment(directory, name, build_corpus_index(corpus, tf_only), local_df)
+
+
+# Rewrites the live documents of several segments as one, dropping tombstoned documents for good.
+# Works on the postings arrays directly: terms are remapped into the merged vocabulary, documents renumbered.
+def merge_segments(directory, name, segments: list[Segment]) -> Segment:
+    terms = sorted({term for segment in segments for term, _ in segment.index.vocabulary.items()})
+    merged_vocabulary = {term: term_id for term_id, term in enumerate(terms)}
+
+    doc_ids = []
+    all_terms, all_docs, all_tfs = [], [], []
+    for segment in segments:
+        index = segment.index
+        live = ~segment.tombstones
+        new_doc = np.where(live, np.cumsum(live) - 1 + len(doc_ids), -1)
+        doc_ids.extend(index.doc_ids[i] for i in np.flatnonzero(live))
+
+        term_map = np.array([merged_vocabulary[term] for term, _ in index.vocabulary.items()], dtype=np.int64)
+        posting_terms = np.repeat(term_map, np.diff(index.offsets))
+        posting_docs = new_doc[index.doc_indices]
+        keep = posting_docs >= 0
+        all_terms.append(posting_terms[keep])
+        all_docs.append(posting_docs[keep])
+        all_tfs.append(np.asarray(index.weights)[keep])
+
+    posting_terms = np.concatenate(all_terms)
+    posting_docs = np.concatenate(all_docs)
+    order = np.lexsort((posting_docs, posting_terms))
+    df = np.bincount(posting_terms, minlength=len(terms)).astype(np.int64)
+    offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(df)
+
+    index = InvertedIndex(merged_vocabulary, offsets, posting_docs[order], np.concatenate(all_tfs)[order],
+                          np.zeros(len(doc_ids)), doc_ids)
+    local_df = IdfTable(merged_vocabulary, df, len(doc_ids), np.ones(len(terms)))
+    return write_segment(directory, name, index, local_df)
+
+
+def file_hash(file_name) -> str:
+    digest = hashlib.sha256()
+    with open(file_name, 'rb') as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# Index made of immutable segments. Adding a shard only tokenizes that shard and adds its document
+# frequencies to the global table; older postings are never touched. A document id seen again in a
+# newer shard replaces the old copy, which is tombstoned, and so is every document a re-ingested shard
+# no longer has. DF/N only count live documents: tombstoning a document takes its terms back out.
+class SegmentedIndex:
+    def __init__(self, directory, merge_factor=4, result_cache_size=10_000):
+        self.directory = directory
+        self.merge_factor = merge_factor
+        self.lock = threading.RLock()
+        self.merge_requested = threading.Event()
+        self.merge_thread = None
+        self.stopping = False
+        # Any change to the segments or their tombstones changes scores, so cached results are only
+        # valid for the generation they were computed in
+        self.generation = 0
+        self.result_cache = LRUCache(result_cache_size)
+
+        self.manifest = {'next_segment': 1, 'segments': [], 'shards': {}}
+        manifest_path = os.path.join(directory, MANIFEST_NAME)
+        if os.path.exists(manifest_path):
+            with open(manifest_path, encoding='utf-8') as file:
+                self.manifest = json.load(file)
+        if 'tombstones' not in self.manifest:
+            # Written before the manifest named its tombstone files, when each segment had one fixed name
+            self.manifest['tombstones'] = {name: 'tombstones.npy' for name in self.manifest['segments']
+                                           if os.path.exists(os.path.join(directory, name, 'tombstones.npy'))}
+        self.manifest.setdefault('next_tombstones', 1)
+
+        self.segments = [open_segment(directory, name, self.manifest['tombstones'].get(name))
+                         for name in self.manifest['segments']]
+        self.global_df: Counter[str] = Counter()
+        self.num_docs = 0
+        self.doc_locations: dict[str, tuple[Segment, int]] = {}
+        for segment in self.segments:
+            self.add_segment_stats(segment)
+            self.add_segment_docs(segment)
+        # Shard each live document came from, so a re-ingested shard can drop what it no longer has
+        self.doc_shards: dict[str, str] = {}
+        for shard, doc_ids in self.manifest.setdefault('shard_docs', {}).items():
+            for doc_id in doc_ids:
+                if doc_id in self.doc_locations:
+                    self.doc_shards[doc_id] = shard
+
+    # Changed tombstones go to new files first and the manifest, renamed into place last, switches to them.
+    # A crash before that rename leaves the old manifest naming the old tombstones, which are still there.
+    def save_manifest(self):
+        os.makedirs(self.directory, exist_ok=True)
+        replaced = []
+        for segment in self.segments:
+            if segment.tombstones_changed:
+                if segment.tombstones_file is not None:
+                    replaced.append(os.path.join(segment.directory, segment.tombstones_file))
+                segment.save_tombstones(f'tombstones-{self.manifest["next_tombstones"]:06d}.npy')
+                self.manifest['next_tombstones'] += 1
+        self.manifest['segments'] = [segment.name for segment in self.segments]
+        self.manifest['tombstones'] = {segment.name: segment.tombstones_file for segment in self.segments
+                                       if segment.tombstones_file is not None}
+        path = os.path.join(self.directory, MANIFEST_NAME)
+        with open(path + '.tmp', 'w', encoding='utf-8') as file:
+            json.dump(self.manifest, file)
+        os.replace(path + '.tmp', path)
+        for old_path in replaced:
+            os.remove(old_path)
+
+    def add_segment_stats(self, segment: Segment, sign=1):
+        df = segment.local_df.df
+        if segment.tombstones.any():
+            df = df - segment.get_df(segment.tombstones)
+        for term, term_id in segment.local_df.vocabulary.items():
+            self.global_df[term] += sign * int(df[term_id])
+        self.num_docs += sign * segment.live_docs
+
+    def tombstone_docs(self, segment: Segment, doc_idxs: list[int]):
+        dead = np.zeros(segment.num_docs, dtype=bool)
+        dead[doc_idxs] = True
+        dead &= ~segment.tombstones
+        df = segment.get_df(dead)
+        terms = segment.get_terms()
+        for term_id in np.flatnonzero(df):
+            self.global_df[terms[term_id]] -= int(df[term_id])
+            if self.global_df[terms[term_id]] <= 0:
+                del self.global_df[terms[term_id]]
+        self.num_docs -= int(dead.sum())
+        segment.tombstones |= dead
+        segment.tombstones_changed = True
+
+    def add_segment_docs(self, segment: Segment):
+        for doc_idx in np.flatnonzero(~segment.tombstones):
+            self.doc_locations[segment.index.doc_ids[doc_idx]] = (segment, int(doc_idx))
+
+    def next_generation(self):
+        self.generation += 1
+        self.result_cache.clear()
+
+    def next_segment_name(self) -> str:
+        name = f'seg_{self.manifest["next_segment"]:06d}'
+        self.manifest['next_segment'] += 1
+        return name
+
+    def get_idf(self, term: str) -> float:
+        df = self.global_df.get(term, 0)
+        return math.log(self.num_docs / df) if df > 0 else 0.0
+
+    # Cost is proportional to the shard: one new segment plus DF updates for the shard's own vocabulary
+    def add_shard(self, file_name) -> Segment | None:
+        shard = os.path.basename(file_name)
+        shard_hash = file_hash(file_name)
+        if self.manifest['shards'].get(shard) == shard_hash:
+            return None
+
+        with self.lock:
+            name = self.next_segment_name()
+        segment = build_segment(self.directory, name, file_name)
+
+        with self.lock:
+            doc_ids = list(segment.index.doc_ids)
+            shard_docs = self.manifest['shard_docs']
+            new_ids = set(doc_ids)
+            removed = [doc_id for doc_id in shard_docs.get(shard, [])
+                       if doc_id not in new_ids and self.doc_shards.get(doc_id) == shard]
+
+            # Old copies of the shard's documents, wherever they came from, and whatever it dropped
+            dead: dict[str, tuple[Segment, list[int]]] = {}
+            moved_from = set()
+            for doc_id in doc_ids + removed:
+                location = self.doc_locations.pop(doc_id, None)
+                if location is not None:
+                    old_segment, old_idx = location
+                    dead.setdefault(old_segment.name, (old_segment, []))[1].append(old_idx)
+                old_shard = self.doc_shards.pop(doc_id, None)
+                if old_shard is not None and old_shard != shard:
+                    moved_from.add(old_shard)
+            for old_segment, old_idxs in dead.values():
+                self.tombstone_docs(old_segment, old_idxs)
+
+            self.segments.append(segment)
+            self.add_segment_stats(segment)
+            self.add_segment_docs(segment)
+            for doc_id in doc_ids:
+                self.doc_shards[doc_id] = shard
+            shard_docs[shard] = doc_ids
+            for old_shard in moved_from:
+                shard_docs[old_shard] = [doc_id for doc_id in shard_docs[old_shard]
+                                         if self.doc_shards.get(doc_id) == old_shard]
+            self.manifest['shards'][shard] = shard_hash
+            self.save_manifest()
+            self.next_generation()
+
+        self.merge_requested.set()
+        return segment
+
+    def delete(self, doc_id: str) -> bool:
+        with self.lock:
+            location = self.doc_locations.pop(doc_id, None)
+            if location is None:
+                return False
+            self.doc_shards.pop(doc_id, None)
+            segment, doc_idx = location
+            self.tombstone_docs(segment, [doc_idx])
+            self.save_manifest()
+            self.next_generation()
+        self.merge_requested.set()
+        return True
+
+    # Tiered policy: segments are grouped by log_merge_factor(live docs); once a tier holds merge_factor
+    # segments (or any segment is mostly tombstones) the smallest ones in it are merged into one
+    def find_merge(self) -> list[Segment]:
+        tiers: dict[int, list[Segment]] = {}
+        for segment in self.segments:
+            if segment.live_docs < segment.num_docs / 2:
+                return [segment]
+            tier = int(math.log(max(segment.live_docs, 1), self.merge_factor))
+            tiers.setdefault(tier, []).append(segment)
+        for tier in sorted(tiers):
+            if len(tiers[tier]) >= self.merge_factor:
+                return sorted(tiers[tier], key=lambda s: s.live_docs)[:self.merge_factor]
+        return []
+
+    def maybe_merge(self) -> bool:
+        with self.lock:
+            to_merge = self.find_merge()
+            if not to_merge:
+                return False
+            name = self.next_segment_name()
+            # Tombstones set while the merge runs are carried over afterwards
+            snapshots = [segment.tombstones.copy() for segment in to_merge]
+
+        merged = merge_segments(self.directory, name, [Segment(s.name, s.directory, s.index, s.local_df, snap)
+                                                       for s, snap in zip(to_merge, snapshots)])
+
+        with self.lock:
+            merged_idx = 0
+            for segment, snapshot in zip(to_merge, snapshots):
+                for doc_idx in np.flatnonzero(~snapshot):
+                    if segment.tombstones[doc_idx]:
+                        merged.tombstones[merged_idx] = True
+                    merged_idx += 1
+            merged.tombstones_changed = bool(merged.tombstones.any())
+
+            position = self.segments.index(to_merge[0])
+            self.segments = [s for s in self.segments if s not in to_merge]
+            for segment in to_merge:
+                self.add_segment_stats(segment, sign=-1)
+            if merged.num_docs > 0:
+                self.segments.insert(min(position, len(self.segments)), merged)
+                self.add_segment_stats(merged)
+                self.add_segment_docs(merged)
+            self.global_df = +self.global_df
+            self.save_manifest()
+            self.next_generation()
+
+        if merged.num_docs == 0:
+            shutil.rmtree(merged.directory, ignore_errors=True)
+        for segment in to_merge:
+            shutil.rmtree(segment.directory, ignore_errors=True)
+        return True
+
+    def merge_loop(self):
+        while not self.stopping:
+            self.merge_requested.wait()
+            self.merge_requested.clear()
+            while not self.stopping and self.maybe_merge():
+                pass
+
+    def start_background_merges(self):
+        if self.merge_thread is None:
+            self.merge_thread = threading.Thread(target=self.merge_loop, daemon=True)
+            self.merge_thread.start()
+
+    def stop_background_merges(self):
+        self.stopping = True
+        self.merge_requested.set()
+        if self.merge_thread is not None:
+            self.merge_thread.join()
+            self.merge_thread = None
+
+    # Same scoring as query_vectorizer's default: cosine over the query's words with global IDF,
+    # which needs no per-document norms and so stays valid as DF changes
+    def search(self, query: list[str], k: int = 10) -> list[tuple[str, float]]:
+        key = (normalize_query(query), k)
+        with self.lock:
+            cached = self.result_cache.get(key)
+            if cached is not None:
+                return list(cached)
+            generation = self.generation
+            segments = list(self.segments)
+            tombstones = [segment.tombstones.copy() for segment in segments]
+            counts = Counter(query)
+            idf = {term: self.get_idf(term) for term in counts}
+
+        query_weights = {term: count / len(query) * idf[term] for term, count in counts.items()}
+        query_norm = math.sqrt(sum(counts[term] * w * w for term, w in query_weights.items()))
+        if query_norm == 0:
+            return []
+
+        hits = []
+        for seg_order, (segment, dead) in enumerate(zip(segments, tombstones)):
+            dot = np.zeros(segment.num_docs)
+            doc_sq = np.zeros(segment.num_docs)
+            for term, query_weight in query_weights.items():
+                docs, tfs = segment.index.postings(term)
+                if len(docs) == 0:
+                    continue
+                weights = tfs * idf[term]
+                dot[docs] += counts[term] * query_weight * weights
+                doc_sq[docs] += counts[term] * weights * weights
+
+            matched = np.flatnonzero((doc_sq > 0) & ~dead)
+            scores = dot[matched] / (query_norm * np.sqrt(doc_sq[matched]))
+            hits.extend((-float(score), seg_order, int(doc_idx)) for doc_idx, score in zip(matched, scores) if score > 0)
+
+        hits.sort()
+        results = [(segments[seg_order].index.doc_ids[doc_idx], -neg_score) for neg_score, seg_order, doc_idx in hits[:k]]
+        with self.lock:
+            if self.generation == generation:
+                self.result_cache.put(key, results)
+        return list(results)
+
+
+def main():
+    index = SegmentedIndex(os.path.join(DATA_DIR, "cache/segments"))
+    index.start_background_merges()
+    for i in range(1, 10):
+        file_name = os.path.join(DATA_DIR, f"processed/articles-{i}.txt")
+        if os.path.exists(file_name) and index.add_shard(file_name) is not None:
+            print(f'Indexed {file_name}')
+    index.stop_background_merges()
+    while index.maybe_merge():
+        pass
+    print(f'{len(index.segments)} segments, {index.num_docs} documents, {len(index.doc_locations)} live')
+
+
+if __name__ == '__main__':
+    main()
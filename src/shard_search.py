@@ -0,0 +1,233 @@
+import heapq
+import math
+import os
+from multiprocessing import Pipe, Process
+from multiprocessing.connection import Client, Connection, Listener
+import numpy as np
+import scipy.sparse as sp
+from tqdm import tqdm
+
+from batch_scorer import build_document_matrix, select_top_k
+from compact_corpus import build_corpus_idf_table, build_corpus_index
+from data_loader import DATA_DIR
+from idf_table import IdfTable
+from index_store import get_cache_key, open_index, save_index
+from inverted_index import InvertedIndex
+from query_vectorizer import get_query_idf, get_tf_scores, load_corpus, load_queries, save_ranking, word_tokenizer
+
+
+# A shard's own index: raw TF as the postings weights plus the shard's document frequencies, so it can be
+# built without knowing anything about the other shards. Cached like query_vectorizer.load_index.
+def load_shard(file_name) -> tuple[InvertedIndex, IdfTable]:
+    cache_dir = os.path.join(DATA_DIR, "cache/shards", os.path.splitext(os.path.basename(file_name))[0])
+    cache_key = get_cache_key(file_name, word_tokenizer)
+    cached = open_index(cache_dir, cache_key)
+    if cached is not None:
+        return cached
+
+    corpus = load_corpus(file_name)
+    local_df = build_corpus_idf_table(corpus)
+    tf_only = IdfTable(local_df.vocabulary, local_df.df, local_df.num_docs, np.ones(len(local_df.df)))
+    save_index(build_corpus_index(corpus, tf_only), local_df, cache_dir, cache_key)
+    return open_index(cache_dir, cache_key)
+
+
+# Reweights a shard's TF postings with the global IDF (global_df is aligned with the shard's term ids)
+# and recomputes the document norms from them
+def apply_global_idf(index: InvertedIndex, global_df: np.ndarray, num_docs: int) -> InvertedIndex:
+    idf = IdfTable(index.vocabulary, global_df, num_docs).idf
+    weights = np.asarray(index.weights) * np.repeat(idf, np.diff(index.offsets))
+    norms = np.sqrt(np.bincount(index.doc_indices, weights=weights * weights, minlength=index.num_docs))
+    return InvertedIndex(index.vocabulary, index.offsets, index.doc_indices, weights, norms, index.doc_ids)
+
+
+# Shard side of the protocol. Every request is a tuple naming the operation; every reply is ('ok', result)
+# or ('error', message):
+#   ('stats',)                       -> (num_docs, terms in term id order, local df)
+#   ('idf', global_df, num_docs)     -> None, global DF aligned with the terms sent in 'stats'
+#   ('search', query_weights, k)     -> per query [(doc_id, score)], best first, positive scores only
+#   ('close',)
+def serve_shard(file_name, conn: Connection):
+    index, local_df = load_shard(file_name)
+    doc_matrix_t = None
+    try:
+        while True:
+            request = conn.recv()
+            try:
+                if request[0] == 'stats':
+                    terms = [term for term, _ in index.vocabulary.items()]
+                    conn.send(('ok', (index.num_docs, terms, np.asarray(local_df.df))))
+                elif request[0] == 'idf':
+                    _, global_df, num_docs = request
+                    doc_matrix_t = build_document_matrix(apply_global_idf(index, global_df, num_docs)).T.tocsr()
+                    conn.send(('ok', None))
+                elif request[0] == 'search':
+                    if doc_matrix_t is None:
+                        raise RuntimeError('search before global IDF was received')
+                    _, query_weights, k = request
+                    conn.send(('ok', search_shard(index, doc_matrix_t, query_weights, k)))
+                elif request[0] == 'close':
+                    break
+                else:
+                    raise ValueError(f'Unknown request: {request[0]}')
+            except Exception as e:
+                conn.send(('error', f'{type(e).__name__}: {e}'))
+    finally:
+        conn.close()
+
+
+def search_shard(index: InvertedIndex, doc_matrix_t: sp.csr_matrix, query_weights: list[dict[str, float]],
+                 k: int) -> list[list[tuple[str, float]]]:
+    rows, cols, values = [], [], []
+    for row, weights in enumerate(query_weights):
+        for term, weight in weights.items():
+            term_id = index.vocabulary.get(term)
+            if term_id is not None:
+                rows.append(row)
+                cols.append(term_id)
+                values.append(weight)
+    query_matrix = sp.csr_matrix((values, (rows, cols)), shape=(len(query_weights), len(index.vocabulary)),
+                                 dtype=np.float64)
+    block = (query_matrix @ doc_matrix_t).toarray()
+
+    results = []
+    for scores in block:
+        top = select_top_k(scores, k)
+        results.append([(index.doc_ids[doc_idx], float(scores[doc_idx])) for doc_idx in top if scores[doc_idx] > 0])
+    return results
+
+
+# For shards on other hosts: serves one coordinator connection on a socket
+def listen_shard(file_name, address: tuple[str, int], authkey: bytes):
+    with Listener(address, authkey=authkey) as listener:
+        serve_shard(file_name, listener.accept())
+
+
+def connect_shards(addresses: list[tuple[str, int]], authkey: bytes) -> list[Connection]:
+    return [Client(address, authkey=authkey) for address in addresses]
+
+
+def start_local_shards(file_names: list[str]) -> tuple[list[Connection], list[Process]]:
+    connections, processes = [], []
+    for file_name in file_names:
+        coordinator_end, shard_end = Pipe()
+        process = Process(target=serve_shard, args=(file_name, shard_end), daemon=True)
+        process.start()
+        shard_end.close()
+        connections.append(coordinator_end)
+        processes.append(process)
+    return connections, processes
+
+
+# Scatter-gather over shard connections. Statistics are exchanged once so every shard weights its postings
+# with the same global IDF, which makes scores comparable and the merged ranking equal to one over the
+# concatenated corpus. Requests go out to all shards before any reply is read, so shards work in parallel.
+class ShardCoordinator:
+    def __init__(self, connections: list[Connection]):
+        self.connections = connections
+        self.global_idf: IdfTable | None = None
+
+    # Every shard that got its request has its reply read before any failure is raised; a reply left unread
+    # would be taken as the answer to the next request
+    def broadcast(self, requests: list[tuple]) -> list:
+        replies = [None] * len(self.connections)
+        for shard, (conn, request) in enumerate(zip(self.connections, requests)):
+            try:
+                conn.send(request)
+            except OSError as e:
+                replies[shard] = ('error', f'{type(e).__name__}: {e}')
+        for shard, conn in enumerate(self.connections):
+            if replies[shard] is not None:
+                continue
+            try:
+                replies[shard] = conn.recv()
+            except (EOFError, OSError) as e:
+                replies[shard] = ('error', f'{type(e).__name__}: {e}')
+
+        failures = [f'Shard {shard} failed: {result}' for shard, (status, result) in enumerate(replies)
+                    if status != 'ok']
+        if failures:
+            raise RuntimeError('; '.join(failures))
+        return [result for _, result in replies]
+
+    def exchange_statistics(self) -> IdfTable:
+        stats = self.broadcast([('stats',)] * len(self.connections))
+
+        vocabulary: dict[str, int] = {}
+        shard_term_ids = []
+        for _, terms, _ in stats:
+            term_ids = np.empty(len(terms), dtype=np.int64)
+            for i, term in enumerate(terms):
+                term_ids[i] = vocabulary.setdefault(term, len(vocabulary))
+            shard_term_ids.append(term_ids)
+        df = np.zeros(len(vocabulary), dtype=np.int64)
+        for (_, _, local_df), term_ids in zip(stats, shard_term_ids):
+            np.add.at(df, term_ids, local_df)
+        num_docs = sum(shard_docs for shard_docs, _, _ in stats)
+
+        self.broadcast([('idf', df[term_ids], num_docs) for term_ids in shard_term_ids])
+        self.global_idf = IdfTable(vocabulary, df, num_docs)
+        return self.global_idf
+
+    # Unit-length query weights over the global vocabulary; each shard looks the terms up in its own
+    def get_query_weights(self, query_tf: dict[str, float], query_idf: IdfTable) -> dict[str, float]:
+        weights = {word: word_tf * query_idf.get_idf(word) for word, word_tf in query_tf.items()
+                   if word in self.global_idf.vocabulary}
+        query_norm = math.sqrt(sum(w * w for w in weights.values()))
+        if query_norm == 0:
+            return {}
+        return {word: w / query_norm for word, w in weights.items()}
+
+    # Per query, the shards' top-k lists merged by score; ties go to the earlier shard, then the earlier document
+    def search(self, query_tf: list[dict[str, float]], query_idf: IdfTable, k: int = 10) -> list[list[tuple[str, float]]]:
+        query_weights = [self.get_query_weights(tf, query_idf) for tf in query_tf]
+        shard_results = self.broadcast([('search', query_weights, k)] * len(self.connections))
+
+        merged = []
+        for query in range(len(query_tf)):
+            ranked = heapq.merge(*([(-score, shard, rank, doc_id) for rank, (doc_id, score) in enumerate(results[query])]
+                                   for shard, results in enumerate(shard_results)))
+            merged.append([(doc_id, -neg_score) for neg_score, _, _, doc_id in list(ranked)[:k]])
+        return merged
+
+    # Runs in finally blocks, so a shard that is already gone must not replace the error being raised
+    def close(self):
+        for conn in self.connections:
+            try:
+                conn.send(('close',))
+            except OSError:
+                pass
+            conn.close()
+
+
+def get_shard_files() -> list[str]:
+    file_names = [os.path.join(DATA_DIR, f"processed/articles-{i}.txt") for i in range(1, 10)]
+    return [file_name for file_name in file_names if os.path.exists(file_name)]
+
+
+def main(k=10, query_idf_mode='corpus', batch_size=64):
+    queries, query_ids = load_queries(os.path.join(DATA_DIR, "processed/keysearch.qry"))
+    query_tf = get_tf_scores(queries)
+
+    connections, processes = start_local_shards(get_shard_files())
+    coordinator = ShardCoordinator(connections)
+    try:
+        global_idf = coordinator.exchange_statistics()
+        query_idf = get_query_idf(queries, global_idf, query_idf_mode)
+
+        output_lines = []
+        for start in tqdm(range(0, len(queries), batch_size), desc="Processing query batches"):
+            results = coordinator.search(query_tf[start:start + batch_size], query_idf, k)
+            for qid, hits in enumerate(results, start=start):
+                for rank, (doc_id, sim_score) in enumerate(hits):
+                    output_lines.append(f'{query_ids[qid]} {doc_id} {rank + 1} {sim_score}\n')
+    finally:
+        coordinator.close()
+        for process in processes:
+            process.join()
+
+    save_ranking(output_lines, "ranking_output_sharded.txt")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,374 @@
+import hashlib
+import heapq
+import math
+import os
+import shutil
+import sys
+import time
+from array import array
+from collections import Counter
+import numpy as np
+
+from data_loader import DATA_DIR
+from index_store import MANIFEST_NAME, get_cache_key, open_string_table, save_manifest
+from instrumentation import get_rss_mb, tracer
+from query_vectorizer import get_index_cache_dir, iter_documents, word_tokenizer
+
+DEFAULT_MEMORY_BUDGET_MB = 256
+# Rough cost of a block in memory: per posting its term id, doc index and count, and per distinct term
+# the str plus its dict slot and int id
+POSTING_BYTES = 16
+TERM_BYTES = 120
+# A merge batch is written out at this many postings or this many (term, run) pieces, whichever comes first
+MERGE_BATCH_POSTINGS = 1 << 20
+MERGE_BATCH_PIECES = 1 << 15
+COPY_CHUNK = 1 << 22
+
+
+# Wall time, items and the highest RSS seen during one phase. RSS is sampled as the phase goes since
+# ru_maxrss only ever grows over the life of the process and can't tell phases apart.
+class PhaseStats:
+    def __init__(self, name: str, unit: str):
+        self.name = name
+        self.unit = unit
+        self.items = 0
+        self.peak_rss_mb = None
+        self.wall_s = None
+        self.start = time.perf_counter()
+        self.sample()
+
+    def sample(self):
+        rss = get_rss_mb()
+        if rss is not None and (self.peak_rss_mb is None or rss > self.peak_rss_mb):
+            self.peak_rss_mb = rss
+
+    def finish(self):
+        self.sample()
+        self.wall_s = time.perf_counter() - self.start
+
+    @property
+    def items_per_s(self) -> float | None:
+        return self.items / self.wall_s if self.wall_s else None
+
+    def __str__(self):
+        rate = f'{self.items_per_s:,.0f} {self.unit}/s' if self.items_per_s else 'n/a'
+        peak = f'{self.peak_rss_mb:.1f} MB' if self.peak_rss_mb is not None else 'n/a'
+        return f'{self.name}: {self.items:,} {self.unit} in {self.wall_s:.2f}s ({rate}), peak RSS {peak}'
+
+
+# Builds a .npy file of unknown length by appending chunks to a raw file, then copying them in
+# behind an .npy header, so the whole array is never in memory at once
+class NpyAppender:
+    def __init__(self, path, dtype):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.raw_path = path + '.raw'
+        self.file = open(self.raw_path, 'wb')
+        self.length = 0
+
+    def append(self, values):
+        values = np.asarray(values, dtype=self.dtype)
+        values.tofile(self.file)
+        self.length += len(values)
+
+    def close(self):
+        self.file.close()
+        out = np.lib.format.open_memmap(self.path, mode='w+', dtype=self.dtype, shape=(self.length,))
+        if self.length:
+            raw = np.memmap(self.raw_path, dtype=self.dtype, mode='r', shape=(self.length,))
+            for start in range(0, self.length, COPY_CHUNK):
+                out[start:start + COPY_CHUNK] = raw[start:start + COPY_CHUNK]
+            del raw
+        out.flush()
+        del out
+        os.remove(self.raw_path)
+
+
+# Streams strings into index_store's string table layout (UTF-8 blob plus offsets)
+class StringTableWriter:
+    def __init__(self, directory, name, buffer_size=1 << 16):
+        self.blob = NpyAppender(os.path.join(directory, f'{name}_blob.npy'), np.uint8)
+        self.offsets = NpyAppender(os.path.join(directory, f'{name}_offsets.npy'), np.int64)
+        self.offsets.append([0])
+        self.end = 0
+        self.buffer: list[bytes] = []
+        self.buffer_size = buffer_size
+
+    def append_bytes(self, value: bytes):
+        self.buffer.append(value)
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.blob.append(np.frombuffer(b''.join(self.buffer), dtype=np.uint8))
+            self.offsets.append(self.end + np.cumsum([len(value) for value in self.buffer]))
+            self.end += sum(len(value) for value in self.buffer)
+            self.buffer = []
+
+    def close(self):
+        self.flush()
+        self.blob.close()
+        self.offsets.close()
+
+
+# One SPIMI block: postings in arrival order with a dictionary local to the block, so terms get ids as
+# they first turn up and there is no global vocabulary until the merge. Documents arrive in order,
+# so each term's postings are already sorted by document.
+class PostingsBlock:
+    def __init__(self):
+        self.vocabulary: dict[str, int] = {}
+        self.term_ids = array('I')
+        self.doc_indices = array('q')
+        self.counts = array('I')
+        self.term_bytes = 0
+
+    def __len__(self):
+        return len(self.term_ids)
+
+    def add_document(self, doc_idx: int, tokens: list[str]):
+        for term, count in Counter(tokens).items():
+            term_id = self.vocabulary.get(term)
+            if term_id is None:
+                term_id = self.vocabulary[term] = len(self.vocabulary)
+                self.term_bytes += TERM_BYTES + len(term)
+            self.term_ids.append(term_id)
+            self.doc_indices.append(doc_idx)
+            self.counts.append(count)
+
+    def get_nbytes(self) -> int:
+        return POSTING_BYTES * len(self.term_ids) + self.term_bytes
+
+    # Sorted run: terms in UTF-8 byte order (the order save_index uses) with their postings
+    def write_run(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        terms = [term.encode('utf-8') for term in self.vocabulary]
+        order = sorted(range(len(terms)), key=terms.__getitem__)
+        rank = np.empty(len(terms), dtype=np.int64)
+        rank[order] = np.arange(len(terms))
+
+        posting_ranks = rank[np.frombuffer(self.term_ids, dtype=np.uint32)]
+        postings_order = np.argsort(posting_ranks, kind='stable')
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(posting_ranks, minlength=len(terms)))
+
+        writer = StringTableWriter(directory, 'terms')
+        for i in order:
+            writer.append_bytes(terms[i])
+        writer.close()
+        np.save(os.path.join(directory, 'offsets.npy'), offsets)
+        np.save(os.path.join(directory, 'doc_indices.npy'), np.frombuffer(self.doc_indices, dtype=np.int64)[postings_order])
+        np.save(os.path.join(directory, 'counts.npy'), np.frombuffer(self.counts, dtype=np.uint32)[postings_order])
+
+
+# A sorted run, memory-mapped. Plain ndarray views of the maps, since every np.memmap slice carries
+# a few hundred bytes of its own and the merge holds one per term and run until a batch is written.
+class Run:
+    def __init__(self, directory):
+        def load(name):
+            return np.load(os.path.join(directory, f'{name}.npy'), mmap_mode='r').view(np.ndarray)
+
+        self.terms = open_string_table(directory, 'terms')
+        self.offsets = load('offsets')
+        self.doc_indices = load('doc_indices')
+        self.counts = load('counts')
+
+    def postings(self, term_idx: int) -> tuple[np.ndarray, np.ndarray]:
+        start, end = self.offsets[term_idx], self.offsets[term_idx + 1]
+        return self.doc_indices[start:end], self.counts[start:end]
+
+
+# Phase 1: tokenizes the documents of every file in turn, filling a block until its estimated size
+# reaches memory_budget bytes, then writes it out as a sorted run. Document ids and lengths are
+# appended to work_dir as they go. Returns the run directories and the number of documents.
+def invert_documents(file_names: list[str], work_dir, memory_budget: int, stats: PhaseStats) -> tuple[list[str], int]:
+    run_dirs = []
+    doc_ids = StringTableWriter(work_dir, 'doc_ids')
+    doc_lengths = NpyAppender(os.path.join(work_dir, 'doc_lengths.npy'), np.int64)
+    block = PostingsBlock()
+    block_lengths = array('q')
+
+    def spill():
+        run_dir = os.path.join(work_dir, f'run-{len(run_dirs):05d}')
+        block.write_run(run_dir)
+        run_dirs.append(run_dir)
+        doc_lengths.append(np.frombuffer(block_lengths, dtype=np.int64))
+        stats.sample()
+
+    num_docs = 0
+    for file_name in file_names:
+        for doc_id, words in iter_documents(file_name):
+            tokens = word_tokenizer.tokenize(words)
+            block.add_document(num_docs, tokens)
+            block_lengths.append(len(tokens))
+            doc_ids.append_bytes(doc_id.encode('utf-8'))
+            num_docs += 1
+            if block.get_nbytes() >= memory_budget:
+                spill()
+                block = PostingsBlock()
+                block_lengths = array('q')
+    if len(block) or len(block_lengths):
+        spill()
+
+    doc_ids.close()
+    doc_lengths.close()
+    stats.items = num_docs
+    return run_dirs, num_docs
+
+
+# Phase 2: k-way merge of the sorted runs into the index_store layout in output_dir, a term at a time in
+# byte order. Runs cover increasing document ranges, so a term's postings are its runs' postings in
+# run order. TF-IDF weights come out exactly as build_corpus_index computes them. Norms can differ in the
+# last bit: a document's squared weights are summed here in term byte order, while build_corpus_index's
+# bincount sums them in first-seen term order, and getting that order would mean holding every posting.
+def merge_runs(run_dirs: list[str], work_dir, output_dir, num_docs: int, stats: PhaseStats) -> int:
+    runs = [Run(run_dir) for run_dir in run_dirs]
+    doc_lengths = np.load(os.path.join(work_dir, 'doc_lengths.npy'), mmap_mode='r')
+    num_postings = sum(len(run.doc_indices) for run in runs)
+
+    out_docs = np.lib.format.open_memmap(os.path.join(output_dir, 'doc_indices.npy'), mode='w+', dtype=np.int64,
+                                         shape=(num_postings,))
+    out_weights = np.lib.format.open_memmap(os.path.join(output_dir, 'weights.npy'), mode='w+', dtype=np.float64,
+                                            shape=(num_postings,))
+    terms = StringTableWriter(output_dir, 'terms')
+    offsets = NpyAppender(os.path.join(output_dir, 'offsets.npy'), np.int64)
+    df_out = NpyAppender(os.path.join(output_dir, 'df.npy'), np.int64)
+    idf_out = NpyAppender(os.path.join(output_dir, 'idf.npy'), np.float64)
+    offsets.append([0])
+    norm_sq = np.zeros(num_docs, dtype=np.float64)
+
+    batch_docs, batch_counts, batch_df, batch_idf = [], [], array('q'), array('d')
+    written = 0
+
+    def flush():
+        nonlocal written, batch_docs, batch_counts, batch_df, batch_idf
+        if not batch_df:
+            return
+        docs = np.concatenate(batch_docs)
+        df = np.frombuffer(batch_df, dtype=np.int64)
+        weights = np.concatenate(batch_counts) / doc_lengths[docs] * np.repeat(np.frombuffer(batch_idf), df)
+        out_docs[written:written + len(docs)] = docs
+        out_weights[written:written + len(docs)] = weights
+        np.add.at(norm_sq, docs, weights * weights)
+        offsets.append(written + np.cumsum(df))
+        df_out.append(df)
+        idf_out.append(np.frombuffer(batch_idf))
+        written += len(docs)
+        stats.items = written
+        stats.sample()
+        batch_docs, batch_counts, batch_df, batch_idf = [], [], array('q'), array('d')
+
+    heap = [(run.terms.get_bytes(0), run_num, 0) for run_num, run in enumerate(runs) if len(run.terms)]
+    heapq.heapify(heap)
+    pending = 0
+    num_terms = 0
+    while heap:
+        term = heap[0][0]
+        term_df = 0
+        while heap and heap[0][0] == term:
+            _, run_num, term_idx = heapq.heappop(heap)
+            docs, counts = runs[run_num].postings(term_idx)
+            batch_docs.append(docs)
+            batch_counts.append(counts)
+            term_df += len(docs)
+            if term_idx + 1 < len(runs[run_num].terms):
+                heapq.heappush(heap, (runs[run_num].terms.get_bytes(term_idx + 1), run_num, term_idx + 1))
+        terms.append_bytes(term)
+        batch_df.append(term_df)
+        # math.log like IdfTable, so the values match bit for bit
+        batch_idf.append(math.log(num_docs / term_df))
+        num_terms += 1
+        pending += term_df
+        if pending >= MERGE_BATCH_POSTINGS or len(batch_docs) >= MERGE_BATCH_PIECES:
+            flush()
+            pending = 0
+    flush()
+
+    out_docs.flush()
+    out_weights.flush()
+    del out_docs, out_weights
+    terms.close()
+    offsets.close()
+    df_out.close()
+    idf_out.close()
+    np.save(os.path.join(output_dir, 'norms.npy'), np.sqrt(norm_sq))
+    return num_terms
+
+
+# Cache key for an index over several files; a single file gets load_index's key so the result is found there
+def get_files_cache_key(file_names: list[str]) -> str:
+    if len(file_names) == 1:
+        return get_cache_key(file_names[0], word_tokenizer)
+    digest = hashlib.sha256()
+    for file_name in file_names:
+        digest.update(get_cache_key(file_name, word_tokenizer).encode('utf-8'))
+    return digest.hexdigest()
+
+
+# Builds the same saved index as load_index (index_store layout, opened with open_index; norms equal up to
+# rounding, see merge_runs) without ever holding the corpus in memory: blocks of postings up to
+# memory_budget_mb are spilled to sorted runs in output_dir/runs and k-way merged. Beyond the block, memory
+# grows only with per-document arrays (lengths and squared norms, 16 bytes a document) and the merge's one
+# entry per run.
+def build_index_external(file_names: list[str], output_dir, memory_budget_mb=DEFAULT_MEMORY_BUDGET_MB,
+                         cache_key=None) -> list[PhaseStats]:
+    cache_key = cache_key or get_files_cache_key(file_names)
+    os.makedirs(output_dir, exist_ok=True)
+    # Drop the manifest first so a half-written index can never be opened under the old key
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+    work_dir = os.path.join(output_dir, 'runs')
+    shutil.rmtree(work_dir, ignore_errors=True)
+    os.makedirs(work_dir)
+
+    invert = PhaseStats('invert', 'docs')
+    with tracer.stage('spimi_invert', memory_budget_mb=memory_budget_mb) as stage:
+        run_dirs, num_docs = invert_documents(file_names, work_dir, memory_budget_mb * 1024 * 1024, invert)
+        invert.finish()
+        stage.add(num_docs)
+        stage.fields.update(runs=len(run_dirs), phase_peak_rss_mb=invert.peak_rss_mb)
+
+    # The merge writes into a staging directory whose files are then renamed over the old ones, so
+    # processes that have the old index mapped keep reading it intact
+    staging_dir = os.path.join(work_dir, 'index')
+    os.makedirs(staging_dir)
+    merge = PhaseStats('merge', 'postings')
+    with tracer.stage('spimi_merge', runs=len(run_dirs)) as stage:
+        num_terms = merge_runs(run_dirs, work_dir, staging_dir, num_docs, merge)
+        os.replace(os.path.join(work_dir, 'doc_ids_blob.npy'), os.path.join(staging_dir, 'doc_ids_blob.npy'))
+        os.replace(os.path.join(work_dir, 'doc_ids_offsets.npy'), os.path.join(staging_dir, 'doc_ids_offsets.npy'))
+        for name in os.listdir(staging_dir):
+            os.replace(os.path.join(staging_dir, name), os.path.join(output_dir, name))
+        merge.finish()
+        stage.add(merge.items)
+        stage.fields.update(terms=num_terms, phase_peak_rss_mb=merge.peak_rss_mb)
+
+    shutil.rmtree(work_dir)
+    save_manifest(output_dir, {'cache_key': cache_key, 'num_docs': num_docs, 'num_terms': num_terms})
+
+    print(f'{num_docs} documents, {num_terms} terms, {len(run_dirs)} runs')
+    return [invert, merge]
+
+
+# python spimi_index.py [memory_budget_mb]: indexes every processed/articles-N.txt; articles-1.txt alone
+# goes where load_index looks for it
+def main(memory_budget_mb=DEFAULT_MEMORY_BUDGET_MB):
+    stem_cache_path = os.path.join(DATA_DIR, "cache/stems.json")
+    word_tokenizer.load(stem_cache_path)
+
+    file_names = [os.path.join(DATA_DIR, f"processed/articles-{i}.txt") for i in range(1, 10)]
+    file_names = [file_name for file_name in file_names if os.path.exists(file_name)]
+    if len(file_names) == 1:
+        output_dir = get_index_cache_dir(file_names[0])
+    else:
+        output_dir = os.path.join(DATA_DIR, "cache/index/all_articles")
+
+    for phase in build_index_external(file_names, output_dir, memory_budget_mb):
+        print(phase)
+    word_tokenizer.save(stem_cache_path)
+    tracer.flush()
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_MEMORY_BUDGET_MB)
@@ -0,0 +1,121 @@
+import os
+from xml.sax.saxutils import escape
+import numpy as np
+
+from multistream import MW_NS
+
+SYLLABLES = ['ka', 'lo', 'mi', 'ra', 'tu', 'ne', 'so', 'vi', 'da', 'pe', 'gor', 'lin', 'mus', 'ic', 'tra', 'ben',
+             'shi', 'wal', 'or', 'en', 'qua', 'ze', 'fol', 'dri']
+# Real stop words and punctuation mixed into the text so the tokenizer has something to drop
+FILLER = ['the', 'of', 'a', 'and', 'in', 'is', 'was', 'by', 'with', 'his', 'their', '(band)', 'U.S.', '1999',
+          'rock-and-roll', '"quoted"', 'album,', 'songs.']
+
+
+# Distinct made-up words; word i is drawn with probability proportional to 1 / (i + 1) ** exponent
+class ZipfVocabulary:
+    def __init__(self, size: int, exponent: float, rng: np.random.Generator):
+        words = set()
+        while len(words) < size:
+            parts = rng.choice(SYLLABLES, size=rng.integers(1, 5))
+            words.add(''.join(parts))
+        self.words = np.array(sorted(words) + FILLER, dtype=object)
+        rng.shuffle(self.words)
+        weights = 1 / np.arange(1, len(self.words) + 1) ** exponent
+        self.probabilities = weights / weights.sum()
+        # rng.choice with p= rebuilds this on every call, which dominates for large vocabularies
+        self.cumulative = np.cumsum(self.probabilities)
+        self.rng = rng
+
+    def sample(self, n: int) -> list[str]:
+        picks = np.searchsorted(self.cumulative, self.rng.random(n) * self.cumulative[-1], side='right')
+        return self.words[np.minimum(picks, len(self.words) - 1)].tolist()
+
+    def sentence(self, low: int, high: int) -> str:
+        return ' '.join(self.sample(int(self.rng.integers(low, high + 1))))
+
+
+def write_articles(path, vocabulary: ZipfVocabulary, num_docs: int, first_id=1, words_per_line=(5, 25),
+                   lines_per_doc=(1, 8)) -> list[str]:
+    rng = vocabulary.rng
+    titles = []
+    with open(path, 'w', encoding='utf-8') as file:
+        for doc_id in range(first_id, first_id + num_docs):
+            title = f'{vocabulary.sentence(1, 3).title()} {doc_id}'
+            titles.append(title)
+            file.write(f'.I {doc_id}\n.T\n{title}\n.W\n')
+            for _ in range(rng.integers(lines_per_doc[0], lines_per_doc[1] + 1)):
+                file.write(vocabulary.sentence(*words_per_line) + '\n')
+    return titles
+
+
+def write_queries(path, vocabulary: ZipfVocabulary, num_queries: int, words_per_query=(1, 6)):
+    with open(path, 'w', encoding='utf-8') as file:
+        for query_num in range(1, num_queries + 1):
+            file.write(f'.I {query_num:03d}\n.W\n{vocabulary.sentence(*words_per_query)}\n')
+
+
+# Wikitext with the constructs strip_page deals with: templates, refs, links with labels, nested
+# [[File:...]] sections, comments, bold/italic, and a trailing section that gets cut off
+def get_wikitext(vocabulary: ZipfVocabulary, lines: int) -> str:
+    rng = vocabulary.rng
+    out = [f"'''{vocabulary.sentence(1, 3)}''' is a [[{vocabulary.sentence(1, 2)}|{vocabulary.sentence(1, 2)}]] "
+           f"{{{{Infobox {vocabulary.sentence(1, 1)}|name={vocabulary.sentence(1, 2)}}}}}"]
+    for _ in range(lines):
+        kind = rng.integers(0, 5)
+        text = vocabulary.sentence(5, 25)
+        if kind == 0:
+            text += f'<ref>{{{{cite web|url=http://example.org|title={vocabulary.sentence(1, 3)}}}}}</ref>.'
+        elif kind == 1:
+            text = f'[[File:{vocabulary.sentence(1, 1)}.jpg|thumb|a [[{vocabulary.sentence(1, 1)}]] caption]] ' + text
+        elif kind == 2:
+            text += f" ''{vocabulary.sentence(1, 3)}'' <!-- {vocabulary.sentence(1, 3)} --> [[{vocabulary.sentence(1, 1)}]]."
+        out.append(text)
+    out.append(f'== {vocabulary.sentence(1, 2)} ==')
+    out.append(vocabulary.sentence(5, 25))
+    return '\n'.join(out)
+
+
+def write_mediawiki_xml(path, vocabulary: ZipfVocabulary, titles: list[str], extra_pages: int = 0,
+                        redirect_every: int = 20, lines_per_page=(2, 12)):
+    rng = vocabulary.rng
+    all_titles = titles + [f'Unrelated {vocabulary.sentence(1, 2)} {i}' for i in range(extra_pages)]
+    order = rng.permutation(len(all_titles))
+    with open(path, 'w', encoding='utf-8') as file:
+        file.write(f'<mediawiki xmlns="{MW_NS}" version="0.11" xml:lang="en">\n'
+                   '  <siteinfo><sitename>Wikipedia</sitename></siteinfo>\n')
+        for page_id, i in enumerate(order.tolist(), start=1):
+            if page_id % redirect_every == 0:
+                text = f'#REDIRECT [[{all_titles[i]}]]'
+            else:
+                text = get_wikitext(vocabulary, int(rng.integers(lines_per_page[0], lines_per_page[1] + 1)))
+            file.write(f'  <page>\n    <title>{escape(all_titles[i])}</title>\n    <ns>0</ns>\n    <id>{page_id}</id>\n'
+                       f'    <revision><id>{page_id}</id><text xml:space="preserve">{escape(text)}</text></revision>\n'
+                       '  </page>\n')
+        file.write('</mediawiki>\n')
+
+
+SCALES = {
+    'tiny': {'num_docs': 200, 'num_queries': 20, 'vocabulary_size': 1_000, 'extra_pages': 50},
+    'small': {'num_docs': 2_000, 'num_queries': 150, 'vocabulary_size': 5_000, 'extra_pages': 500},
+    'medium': {'num_docs': 20_000, 'num_queries': 500, 'vocabulary_size': 30_000, 'extra_pages': 5_000},
+    'large': {'num_docs': 200_000, 'num_queries': 2_000, 'vocabulary_size': 100_000, 'extra_pages': 50_000},
+}
+
+
+# Writes processed/articles-1.txt, processed/keysearch.qry and raw-wiki/synthetic.xml under directory,
+# laid out like DATA_DIR. The same seed and sizes always produce the same files.
+def generate_corpus(directory, num_docs=2_000, num_queries=150, vocabulary_size=5_000, extra_pages=500,
+                    exponent=1.1, seed=0) -> dict[str, str]:
+    vocabulary = ZipfVocabulary(vocabulary_size, exponent, np.random.default_rng(seed))
+    paths = {
+        'articles': os.path.join(directory, 'processed/articles-1.txt'),
+        'queries': os.path.join(directory, 'processed/keysearch.qry'),
+        'xml': os.path.join(directory, 'raw-wiki/synthetic.xml'),
+    }
+    for path in paths.values():
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    titles = write_articles(paths['articles'], vocabulary, num_docs)
+    write_queries(paths['queries'], vocabulary, num_queries)
+    write_mediawiki_xml(paths['xml'], vocabulary, titles, extra_pages)
+    return paths
@@ -0,0 +1,90 @@
+import hashlib
+import json
+import os
+from collections import OrderedDict
+
+import nltk
+from nltk.stem import PorterStemmer
+
+
+# Table-driven version of the original filter_words loop. Each distinct surface form is tokenized
+# once and its stems kept in a bounded LRU cache, which can be saved and reloaded across runs.
+class Tokenizer:
+    def __init__(self, stop_words: list[str], punctuation: list[str], cache_size=500_000):
+        self.stop_words = frozenset(stop_words)
+        self.punctuation = frozenset(punctuation)
+        self.strip_table = str.maketrans('', '', ''.join(punctuation))
+        self.stemmer = PorterStemmer()
+        self.cache_size = cache_size
+        self.cache: OrderedDict[str, tuple[str, ...]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.settings_hash = self.get_settings_hash(stop_words, punctuation)
+
+    def get_settings_hash(self, stop_words: list[str], punctuation: list[str]) -> str:
+        settings = {
+            'stop_words': sorted(set(stop_words)),
+            'punctuation': list(punctuation),
+            'stemmer': f'{type(self.stemmer).__name__}:{self.stemmer.mode}:nltk-{nltk.__version__}',
+        }
+        return hashlib.sha256(json.dumps(settings).encode('utf-8')).hexdigest()
+
+    def stem_word(self, word: str) -> tuple[str, ...]:
+        if word in self.punctuation:
+            return ()
+        # Skip anything with a digit (any str.isdigit character, not just ASCII); this runs once per
+        # distinct word, the cache absorbs repeats
+        if any(c.isdigit() for c in word):
+            return ()
+        # Remove punctuation from larger word
+        word = word.translate(self.strip_table)
+
+        if word == '' or word in self.stop_words:
+            return ()
+
+        word = word.replace('--', '-')
+
+        if '-' in word:
+            return tuple(self.stemmer.stem(part.lower()) for part in word.split('-') if part.strip() != '')
+        return (self.stemmer.stem(word.lower()),)
+
+    def tokenize_word(self, word: str) -> tuple[str, ...]:
+        tokens = self.cache.get(word)
+        if tokens is not None:
+            self.hits += 1
+            self.cache.move_to_end(word)
+            return tokens
+
+        self.misses += 1
+        tokens = self.stem_word(word)
+        self.cache[word] = tokens
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+            self.evictions += 1
+        return tokens
+
+    def tokenize(self, words: list[str]) -> list[str]:
+        tokens = []
+        for word in words:
+            tokens.extend(self.tokenize_word(word))
+        return tokens
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump({'settings_hash': self.settings_hash, 'stems': self.cache}, file, ensure_ascii=False)
+
+    # Tables written under different stop words, punctuation or stemmer are ignored
+    def load(self, path) -> bool:
+        if not os.path.exists(path):
+            return False
+        with open(path, encoding='utf-8') as file:
+            table = json.load(file)
+        if table.get('settings_hash') != self.settings_hash:
+            return False
+        for word, tokens in table['stems'].items():
+            self.cache[word] = tuple(tokens)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return True
@@ -0,0 +1,166 @@
+import heapq
+import os
+from bisect import bisect_left
+import numpy as np
+from tqdm import tqdm
+
+from data_loader import DATA_DIR
+from inverted_index import InvertedIndex, fill_ranking, get_query_weights
+from query_vectorizer import get_query_idf, get_tf_scores, load_index, load_queries, save_ranking
+
+# Slack on pruning decisions so rounding in the summed bounds can never drop a document that ties
+EPSILON = 1e-12
+
+
+class TopKResult:
+    def __init__(self, hits: list[tuple[int, float]], postings_total: int, postings_scored: int):
+        self.hits = hits
+        self.postings_total = postings_total
+        self.postings_scored = postings_scored
+
+    @property
+    def postings_skipped(self) -> int:
+        return self.postings_total - self.postings_scored
+
+
+# Highest cosine contribution any document can get from each term: max over its postings of weight / doc norm
+def get_term_upper_bounds(index: InvertedIndex) -> np.ndarray:
+    norms = np.where(index.norms == 0, 1, index.norms)
+    upper_bounds = np.zeros(len(index.offsets) - 1, dtype=np.float64)
+    lengths = np.diff(index.offsets)
+    non_empty = np.flatnonzero(lengths)
+    if len(non_empty):
+        normalized = index.weights / norms[index.doc_indices]
+        upper_bounds[non_empty] = np.maximum.reduceat(normalized, index.offsets[non_empty])
+    return upper_bounds
+
+
+# Document-at-a-time MaxScore over full-vector cosine. Terms are ordered by their score upper bound; once
+# the k-th best score exceeds the summed bounds of the weakest terms, those become non-essential: their
+# documents are never candidates on their own, and their cursors only seek (by binary search over the
+# postings, in place) to candidates from the essential terms that can still beat the threshold. A posting's
+# contribution is only computed when a cursor lands on it, so skipped postings cost nothing.
+class TopKEngine:
+    def __init__(self, index: InvertedIndex):
+        self.index = index
+        self.norms = np.where(index.norms == 0, 1, index.norms)
+        self.term_upper_bounds = get_term_upper_bounds(index)
+
+    def search(self, query_weights: dict[int, float], k: int = 10) -> TopKResult:
+        index = self.index
+        # memoryviews hand back plain ints and floats per element, far cheaper than numpy scalars
+        norms = memoryview(self.norms)
+        terms = []
+        for position, (term_id, query_weight) in enumerate(sorted(query_weights.items())):
+            start, end = int(index.offsets[term_id]), int(index.offsets[term_id + 1])
+            terms.append((query_weight * self.term_upper_bounds[term_id], position, query_weight,
+                          memoryview(index.doc_indices[start:end]), memoryview(index.weights[start:end])))
+        terms.sort(key=lambda t: t[0])
+
+        num_terms = len(terms)
+        prefix_bounds = np.cumsum([t[0] for t in terms]).tolist()
+        lengths = [len(t[3]) for t in terms]
+        pointers = [0] * num_terms
+        # Document under each cursor, or num_docs once the list is used up
+        current = [t[3][0] if lengths[i] else index.num_docs for i, t in enumerate(terms)]
+        postings_total = sum(lengths)
+        postings_scored = 0
+
+        heap: list[tuple[float, int]] = []
+        threshold = 0.0
+        first_essential = 0
+
+        while True:
+            doc = min(current[first_essential:], default=index.num_docs)
+            if doc == index.num_docs:
+                break
+
+            parts = [0.0] * num_terms
+            partial = 0.0
+            for i in range(first_essential, num_terms):
+                if current[i] == doc:
+                    _, position, query_weight, docs, weights = terms[i]
+                    # Same operation order as exhaustive_top_k, so the scores come out bit-identical
+                    parts[position] = query_weight * weights[pointers[i]] / norms[doc]
+                    partial += parts[position]
+                    postings_scored += 1
+                    pointers[i] += 1
+                    current[i] = docs[pointers[i]] if pointers[i] < lengths[i] else index.num_docs
+
+            pruned = False
+            for i in range(first_essential - 1, -1, -1):
+                if partial + prefix_bounds[i] < threshold - EPSILON:
+                    pruned = True
+                    break
+                _, position, query_weight, docs, weights = terms[i]
+                if current[i] < doc:
+                    pointers[i] = bisect_left(docs, doc, pointers[i])
+                    current[i] = docs[pointers[i]] if pointers[i] < lengths[i] else index.num_docs
+                if current[i] == doc:
+                    parts[position] = query_weight * weights[pointers[i]] / norms[doc]
+                    partial += parts[position]
+                    postings_scored += 1
+            if pruned:
+                continue
+
+            # Summed in term id order so scores are bit-identical to exhaustive_top_k
+            score = 0.0
+            for part in parts:
+                score += part
+
+            if len(heap) < k:
+                heapq.heappush(heap, (score, -doc))
+            elif (score, -doc) > heap[0]:
+                heapq.heapreplace(heap, (score, -doc))
+
+            if len(heap) == k:
+                threshold = heap[0][0]
+                while first_essential < num_terms and prefix_bounds[first_essential] < threshold - EPSILON:
+                    first_essential += 1
+
+        hits = sorted(((-neg_doc, score) for score, neg_doc in heap if score > 0), key=lambda h: (-h[1], h[0]))
+        hit_scores = dict(hits)
+        ranking = fill_ranking([doc for doc, _ in hits], index.num_docs, k)
+        return TopKResult([(doc, hit_scores.get(doc, 0.0)) for doc in ranking], postings_total, postings_scored)
+
+
+# Scores every posting of every query term; the reference the pruned engine has to agree with
+def exhaustive_top_k(index: InvertedIndex, query_weights: dict[int, float], k: int = 10) -> list[tuple[int, float]]:
+    norms = np.where(index.norms == 0, 1, index.norms)
+    scores = np.zeros(index.num_docs, dtype=np.float64)
+    for term_id, query_weight in sorted(query_weights.items()):
+        start, end = index.offsets[term_id], index.offsets[term_id + 1]
+        docs = index.doc_indices[start:end]
+        scores[docs] += query_weight * index.weights[start:end] / norms[docs]
+
+    order = np.argsort(-scores, kind='stable')[:k]
+    return [(int(doc), float(scores[doc])) for doc in order]
+
+
+def main(k=10, query_idf_mode='corpus'):
+    queries, query_ids = load_queries(os.path.join(DATA_DIR, "processed/keysearch.qry"))
+    query_tf = get_tf_scores(queries)
+
+    index, doc_idf = load_index(os.path.join(DATA_DIR, "processed/articles-1.txt"))
+    query_idf = get_query_idf(queries, doc_idf, query_idf_mode)
+    engine = TopKEngine(index)
+
+    output_lines = []
+    skipped_lines = []
+    postings_total = 0
+    postings_skipped = 0
+    for qid, tf in enumerate(tqdm(query_tf, desc="Processing queries")):
+        result = engine.search(get_query_weights(index, tf, query_idf), k)
+        postings_total += result.postings_total
+        postings_skipped += result.postings_skipped
+        skipped_lines.append(f'{query_ids[qid]} total={result.postings_total} skipped={result.postings_skipped}\n')
+        for rank, (doc_idx, sim_score) in enumerate(result.hits):
+            output_lines.append(f'{query_ids[qid]} {index.doc_ids[doc_idx]} {rank + 1} {sim_score}\n')
+
+    save_ranking(output_lines, "ranking_output_maxscore.txt")
+    save_ranking(skipped_lines, "maxscore_skipped_postings.txt")
+    print(f'Skipped {postings_skipped} of {postings_total} postings')
+
+
+if __name__ == '__main__':
+    main()
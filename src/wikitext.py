@@ -0,0 +1,148 @@
+import re
+
+# Regex passes that reproduce mwparserfromhell's Wikicode.strip_code() (normalize and collapse on,
+# template parameters dropped) for the constructs most article text is made of: comments, <ref> tags,
+# templates, wikilinks, headings and bold/italic. Anything else, or any of these in a shape that
+# mwparserfromhell might parse differently, makes strip_code_fast return None so the caller falls back to it.
+
+COMMENT = re.compile(r'<!--.*?-->', re.DOTALL)
+REF = re.compile(r'<ref(?:\s[^<>]*)?/>|<ref(?:\s[^<>]*)?>(.*?)</ref>', re.DOTALL)
+# Innermost templates and links first, repeated until none are left, so nesting unwinds from the inside
+TEMPLATE = re.compile(r'\{\{([^{}]*)\}\}')
+LINK = re.compile(r'\[\[([^\[\]]*)\]\]')
+STYLE = re.compile(r"'{2,}")
+ENTITY = re.compile(r'&(?:#[0-9]+|#[xX][0-9a-fA-F]+|[a-zA-Z][a-zA-Z0-9]*);')
+# Tags in a template name, or links, templates and tags in a link title; the inner ones would be gone
+# before the outer one is checked
+NESTED_IN_NAME = re.compile(r'\{\{[^{}|]*<|\[\[[^\]|]*(?:\[\[|\{\{|<)')
+URL_TITLE = re.compile(r'\s*(?:[a-zA-Z][a-zA-Z0-9+.-]*:)?//')
+# A whole line "== Title ==" with matching runs of up to six '=', which strips to " Title "
+HEADING = re.compile(r'(={1,6})([^=]+)\1([ \t]*)')
+# Left over after the passes above, these mean markup the fast path doesn't handle
+UNHANDLED = re.compile(r'[<>{}\[\]]')
+# Lists, definitions, other headings and horizontal rules are parsed as tags or headings
+UNHANDLED_LINE_START = ('*', '#', ':', ';', '=', '----')
+# Put where markup was removed until the end, so quotes on either side of it don't join into one run
+BOUNDARY = '\x00'
+
+
+class FallbackNeeded(Exception):
+    pass
+
+
+# <ref> contents are visible text, stripped on their own like any tag's contents. They start mid-line, so
+# anything that only means something at the start of a line is left to the parser.
+def strip_ref(match: re.Match) -> str:
+    contents = match.group(1)
+    if not contents:
+        return BOUNDARY
+    if contents.lstrip(BOUNDARY).startswith(UNHANDLED_LINE_START) or '\n=' in contents:
+        raise FallbackNeeded
+    stripped = collapse(strip_markup(contents))
+    # Quotes left in the contents must not be read as bold or italic a second time
+    if "''" in stripped:
+        raise FallbackNeeded
+    return BOUNDARY + stripped + BOUNDARY
+
+
+def strip_template(match: re.Match) -> str:
+    parts = match.group(1).split('|')
+    name = parts[0].strip()
+    if not name or '\n' in name or BOUNDARY in name or UNHANDLED.search(name):
+        raise FallbackNeeded
+    # mwparserfromhell gives up on templates whose parameters leave bold or italic open, or whose parameter
+    # names are templates back to back
+    for part in parts:
+        if '=' in part and BOUNDARY * 2 in part.split('=', 1)[0]:
+            raise FallbackNeeded
+        for line in part.split('\n'):
+            strip_styles(line)
+    return BOUNDARY
+
+
+def strip_link(match: re.Match) -> str:
+    body = match.group(1)
+    title, pipe, text = body.partition('|')
+    if ('\n' in body or not title.strip() or BOUNDARY in title or UNHANDLED.search(title)
+            or URL_TITLE.match(title)):
+        raise FallbackNeeded
+    # Quotes in a link pair up with quotes outside it in ways that don't follow strip_styles, e.g.
+    # "''[[ ''* ]]" keeps both runs as text
+    if "''" in body:
+        raise FallbackNeeded
+    return BOUNDARY + (text if pipe else title) + BOUNDARY
+
+
+# ''italic'' and '''bold''' are removed when every run of quotes on the line is two or three long and
+# they pair up properly nested; mwparserfromhell's handling of anything else is too irregular to copy
+def strip_styles(line: str) -> str:
+    if "''" not in line:
+        return line
+    stack = []
+    for run in STYLE.finditer(line):
+        length = len(run.group())
+        if length not in (2, 3):
+            raise FallbackNeeded
+        if stack and stack[-1] == length:
+            stack.pop()
+        elif length in stack:
+            raise FallbackNeeded
+        else:
+            stack.append(length)
+    if stack:
+        raise FallbackNeeded
+    return STYLE.sub('', line)
+
+
+def strip_heading(line: str) -> str:
+    if not line.startswith('='):
+        return line
+    match = HEADING.fullmatch(line)
+    if match is None:
+        raise FallbackNeeded
+    return match.group(2) + match.group(3)
+
+
+def strip_line(line: str) -> str:
+    if line.lstrip(BOUNDARY).startswith(UNHANDLED_LINE_START):
+        raise FallbackNeeded
+    return strip_styles(line)
+
+
+def substitute_all(pattern: re.Pattern, replace, text: str) -> str:
+    while True:
+        text, count = pattern.subn(replace, text)
+        if count == 0:
+            return text
+
+
+def strip_markup(text: str) -> str:
+    text = REF.sub(strip_ref, text)
+    text = substitute_all(TEMPLATE, strip_template, text)
+    text = substitute_all(LINK, strip_link, text)
+    if UNHANDLED.search(text):
+        raise FallbackNeeded
+    return '\n'.join(strip_line(line) for line in text.split('\n'))
+
+
+# What strip_code(collapse=True) does to the joined text
+def collapse(text: str) -> str:
+    text = text.replace(BOUNDARY, '').strip('\n')
+    while '\n\n\n' in text:
+        text = text.replace('\n\n\n', '\n\n')
+    return text
+
+
+def strip_code_fast(text: str) -> str | None:
+    if '{{{' in text or BOUNDARY in text or ENTITY.search(text) or NESTED_IN_NAME.search(text):
+        return None
+    # A line inside a comment that starts with '=' is not a heading
+    if any('\n=' in comment for comment in COMMENT.findall(text)):
+        return None
+    try:
+        # Headings are only headings where they start a line of the original text
+        text = '\n'.join(strip_heading(line) for line in text.split('\n'))
+        text = COMMENT.sub(BOUNDARY, text)
+        return collapse(strip_markup(text))
+    except FallbackNeeded:
+        return None
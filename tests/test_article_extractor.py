@@ -0,0 +1,172 @@
+import bz2
+import json
+import threading
+
+import article_extractor
+from article_extractor import (extract_pages_checkpointed, iter_pages_streaming, iter_pages_tree, parse_pages,
+                               parse_pages_parallel, read_saved_titles)
+
+PAGES = [
+    ('Alpha', "'''Alpha''' is the first [[letter]]."),
+    ('Beta', '#REDIRECT [[Alpha]]'),
+    ('Gamma', 'Gamma is a {{lang|el|letter}} too.'),
+    ('Delta', 'Delta is not wanted.'),
+    ('Epsilon', 'Epsilon comes fifth.'),
+]
+
+
+def write_dump(path, pages):
+    with open(path, 'w', encoding='utf-8') as file:
+        file.write('<mediawiki>\n')
+        for title, text in pages:
+            file.write(f'<page><title>{title}</title><revision><text>{text}</text></revision></page>\n')
+        file.write('</mediawiki>\n')
+
+
+def write_export_dump(path, pages):
+    with open(path, 'w', encoding='utf-8') as file:
+        file.write('<mediawiki xmlns="http://www.mediawiki.org/xml/export-0.11/">\n')
+        file.write('<siteinfo><sitename>Test</sitename></siteinfo>\n')
+        for title, text in pages:
+            file.write(f'<page><title>{title}</title><ns>0</ns><revision><text>{text}</text></revision></page>\n')
+        file.write('</mediawiki>\n')
+
+
+def read_ids(path):
+    with open(path, encoding='utf-8') as file:
+        return [line.split()[1] for line in file if line.startswith('.I ')]
+
+
+def test_fresh_run(tmp_path):
+    dump = tmp_path / 'dump.xml'
+    write_dump(dump, PAGES)
+    out = tmp_path / 'articles-1.txt'
+
+    manifest = extract_pages_checkpointed([str(dump)], {'Alpha', 'Beta', 'Gamma', 'Epsilon', 'Zeta'}, str(out))
+
+    assert read_saved_titles(out) == ['Alpha', 'Gamma', 'Epsilon']
+    assert read_ids(out) == ['1', '2', '3']
+    assert manifest['redirects'] == ['Beta']
+    assert manifest['missing'] == ['Zeta']
+    assert json.loads((tmp_path / 'articles-1.manifest.json').read_text()) == manifest
+
+
+def test_stale_output_without_checkpoint_is_replaced(tmp_path):
+    dump = tmp_path / 'dump.xml'
+    write_dump(dump, PAGES)
+    out = tmp_path / 'articles-1.txt'
+    out.write_text('.I 1\n.T\nOld\n.W\nold text\n.I 2\n.T\nOlder\n.W\nolder text\n', encoding='utf-8')
+
+    extract_pages_checkpointed([str(dump)], {'Alpha', 'Gamma'}, str(out))
+
+    assert read_saved_titles(out) == ['Alpha', 'Gamma']
+    assert read_ids(out) == ['1', '2']
+
+
+def test_checkpoint_for_other_titles_is_not_resumed(tmp_path):
+    dump = tmp_path / 'dump.xml'
+    write_dump(dump, PAGES)
+    out = tmp_path / 'articles-1.txt'
+    extract_pages_checkpointed([str(dump)], {'Alpha', 'Gamma'}, str(out))
+
+    extract_pages_checkpointed([str(dump)], {'Epsilon'}, str(out))
+
+    assert read_saved_titles(out) == ['Epsilon']
+    assert read_ids(out) == ['1']
+
+
+def test_resume_after_interruption(tmp_path, monkeypatch):
+    dump = tmp_path / 'dump.xml'
+    write_dump(dump, PAGES)
+    titles = {'Alpha', 'Gamma', 'Epsilon'}
+    expected = tmp_path / 'expected.txt'
+    extract_pages_checkpointed([str(dump)], titles, str(expected))
+
+    out = tmp_path / 'articles-1.txt'
+    strip_page_item = article_extractor.strip_page_item
+
+    def fail_on_epsilon(item):
+        if item[0] == 'Epsilon':
+            raise KeyboardInterrupt
+        return strip_page_item(item)
+
+    monkeypatch.setattr(article_extractor, 'strip_page_item', fail_on_epsilon)
+    try:
+        extract_pages_checkpointed([str(dump)], titles, str(out), checkpoint_every=2)
+    except KeyboardInterrupt:
+        pass
+    # A half-written page after the last checkpoint is cut off on resume
+    with open(out, 'ab') as file:
+        file.write(b'.I 3\n.T\nEps')
+    monkeypatch.setattr(article_extractor, 'strip_page_item', strip_page_item)
+
+    extract_pages_checkpointed([str(dump)], titles, str(out), checkpoint_every=2)
+
+    assert out.read_bytes() == expected.read_bytes()
+
+
+def test_streaming_matches_tree_and_reads_bz2(tmp_path):
+    dump = tmp_path / 'dump.xml'
+    write_export_dump(dump, PAGES)
+    with open(dump, 'rb') as file, bz2.open(tmp_path / 'dump.xml.bz2', 'wb') as compressed:
+        compressed.write(file.read())
+    wanted = {'Alpha', 'Beta', 'Gamma', 'Epsilon'}
+
+    tree_pages = list(iter_pages_tree(str(dump), 1))
+    assert tree_pages == PAGES
+    assert list(iter_pages_streaming(str(dump), 1)) == tree_pages
+    assert list(iter_pages_streaming(str(tmp_path / 'dump.xml.bz2'), 1)) == tree_pages
+
+    pages = parse_pages(str(dump), wanted, 1, streaming=False)
+    assert list(pages) == ['Alpha', 'Gamma', 'Epsilon']
+    assert parse_pages(str(dump), wanted, 1) == pages
+    assert parse_pages(str(tmp_path / 'dump.xml.bz2'), wanted, 1) == pages
+
+
+def run_with_timeout(function, timeout=60):
+    outcome = {}
+
+    def target():
+        try:
+            outcome['result'] = function()
+        except BaseException as error:
+            outcome['error'] = error
+
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), 'call did not return'
+    return outcome
+
+
+# Fails in the workers, so the error comes out of imap before the consumer hands any read-ahead slot back
+def fail_on_first_page(monkeypatch):
+    def fail(text, engine='auto'):
+        raise RuntimeError('strip failed')
+
+    monkeypatch.setattr(article_extractor, 'strip_page_with_engine', fail)
+
+
+MANY_PAGES = [(f'Page {i}', f'Page {i} is about [[topic {i}]].') for i in range(200)]
+
+
+def test_parallel_error_returns(tmp_path, monkeypatch):
+    dump = tmp_path / 'dump.xml'
+    write_dump(dump, MANY_PAGES)
+    fail_on_first_page(monkeypatch)
+
+    outcome = run_with_timeout(lambda: parse_pages_parallel(
+        [str(dump)], {title for title, _ in MANY_PAGES}, workers=2, chunksize=1))
+
+    assert isinstance(outcome.get('error'), RuntimeError)
+
+
+def test_checkpointed_error_with_workers_returns(tmp_path, monkeypatch):
+    dump = tmp_path / 'dump.xml'
+    write_dump(dump, MANY_PAGES)
+    fail_on_first_page(monkeypatch)
+
+    outcome = run_with_timeout(lambda: extract_pages_checkpointed(
+        [str(dump)], {title for title, _ in MANY_PAGES}, str(tmp_path / 'articles-1.txt'), workers=2, chunksize=1))
+
+    assert isinstance(outcome.get('error'), RuntimeError)
@@ -0,0 +1,46 @@
+import numpy as np
+
+from batch_scorer import build_document_matrix, build_query_matrix, score_batched, select_top_k
+from idf_table import build_idf_table
+from inverted_index import build_inverted_index, get_query_weights
+from query_vectorizer import filter_words, get_tf_scores
+from topk import exhaustive_top_k
+
+DOCUMENTS = [
+    'volcano lava rock', 'ocean wave rock', 'lava lamp', 'ocean ocean whale', 'rock music band',
+    'volcano ash cloud', 'whale song', 'lava field', 'band tour ocean liner', 'rock rock rock',
+]
+QUERIES = [['lava', 'rock'], ['ocean', 'whale'], ['band', 'music'], ['nothing'], ['rock']]
+
+
+def build_index():
+    documents = filter_words([text.split() for text in DOCUMENTS])
+    table = build_idf_table(documents)
+    return build_inverted_index(get_tf_scores(documents), table, [str(i) for i in range(len(documents))]), table
+
+
+def test_select_top_k_breaks_ties_by_document():
+    scores = np.array([0.5, 0.9, 0.5, 0.0, 0.9, 0.5])
+
+    assert select_top_k(scores, 4).tolist() == [1, 4, 0, 2]
+    assert select_top_k(scores, 10).tolist() == [1, 4, 0, 2, 5, 3]
+    assert select_top_k(scores, 0).tolist() == []
+
+
+def test_batched_scores_match_per_query_scan():
+    index, table = build_index()
+    query_tf = get_tf_scores(filter_words(QUERIES))
+    doc_matrix = build_document_matrix(index)
+    query_matrix = build_query_matrix(index, query_tf, table)
+
+    # A budget small enough to score one query per chunk gives the same answers as one big block
+    one_block = list(score_batched(doc_matrix, query_matrix, 3))
+    chunked = list(score_batched(doc_matrix, query_matrix, 3, memory_budget=1))
+    for (top, scores), (chunk_top, chunk_scores) in zip(one_block, chunked):
+        assert top.tolist() == chunk_top.tolist()
+        assert np.array_equal(scores, chunk_scores)
+
+    for tf, (top, scores) in zip(query_tf, one_block):
+        expected = exhaustive_top_k(index, get_query_weights(index, tf, table), 3)
+        assert top.tolist() == [doc for doc, _ in expected]
+        assert np.allclose(scores, [score for _, score in expected])
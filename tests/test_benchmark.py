@@ -0,0 +1,28 @@
+import json
+import os
+import subprocess
+import sys
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+
+# Runs the whole suite at the tiny scale the way it is run by hand, from inside src/, with the
+# benchmark's corpus and results redirected to tmp_path
+RUN = '''
+import sys
+import benchmark
+benchmark.DATA_DIR = sys.argv[1]
+benchmark.BENCHMARK_DIR = sys.argv[1] + '/results/benchmarks'
+benchmark.main(['tiny'])
+'''
+
+
+def test_benchmark_runs_from_src(tmp_path):
+    subprocess.run([sys.executable, '-c', RUN, str(tmp_path)], cwd=SRC_DIR, check=True)
+
+    [result_file] = os.listdir(tmp_path / 'results/benchmarks')
+    with open(tmp_path / 'results/benchmarks' / result_file, encoding='utf-8') as file:
+        results = json.load(file)
+    assert results['scale'] == 'tiny'
+    stages = {stage['stage']: stage for stage in results['stages']}
+    assert {'build_index', 'score_batch', 'parse_xml', 'evaluate_run'} <= stages.keys()
+    assert stages['build_index']['items'] == 200
@@ -0,0 +1,47 @@
+import numpy as np
+
+from compact_corpus import build_compact_corpus, build_corpus_idf_table, build_corpus_index
+from idf_table import build_idf_table
+from inverted_index import build_inverted_index
+from query_vectorizer import get_tf_scores
+
+DOCUMENTS = [
+    ['volcano', 'lava', 'rock', 'lava'],
+    ['ocean', 'wave', 'rock'],
+    [],
+    ['lava', 'lamp', 'lamp', 'lamp'],
+    ['ocean', 'ocean', 'whale'],
+    ['rock', 'rock', 'rock'],
+    ['zürich', 'lava'],
+]
+DOC_IDS = ['10', '11', '12', '13', '14', '15', '16']
+
+
+def test_corpus_round_trips_documents():
+    # A generator, as load_corpus streams it
+    corpus = build_compact_corpus((doc_id, doc) for doc_id, doc in zip(DOC_IDS, DOCUMENTS))
+
+    terms = corpus.get_terms()
+    assert [[terms[term_id] for term_id in corpus.document(i)] for i in range(corpus.num_docs)] == DOCUMENTS
+    assert corpus.doc_ids == DOC_IDS
+    assert corpus.num_terms == len({term for doc in DOCUMENTS for term in doc})
+    assert corpus.doc_lengths.tolist() == [len(doc) for doc in DOCUMENTS]
+
+
+def test_corpus_index_matches_string_index():
+    corpus = build_compact_corpus(zip(DOC_IDS, DOCUMENTS))
+
+    table = build_corpus_idf_table(corpus)
+    expected_table = build_idf_table(DOCUMENTS)
+    assert table.num_docs == expected_table.num_docs
+    for term in expected_table.vocabulary:
+        assert table.df[table.term_id(term)] == expected_table.df[expected_table.term_id(term)]
+        assert table.get_idf(term) == expected_table.get_idf(term)
+
+    index = build_corpus_index(corpus, table)
+    expected = build_inverted_index(get_tf_scores(DOCUMENTS), table, DOC_IDS)
+    assert np.array_equal(index.offsets, expected.offsets)
+    assert np.array_equal(index.doc_indices, expected.doc_indices)
+    assert np.array_equal(index.weights, expected.weights)
+    assert np.array_equal(index.norms, expected.norms)
+    assert index.doc_ids == expected.doc_ids
@@ -0,0 +1,62 @@
+import json
+import os
+
+import pytest
+
+import data_loader
+from data_loader import iter_json_array, load_relevant_entities
+
+RECORDS = [
+    {'queryID': 'MH1', 'keywordQuery': 'volcanoes', 'relevantEntities': [
+        {'label': 'Mount Etna', 'iri': 'Q16711'}, {'label': 'Stromboli', 'iri': 'Q172195'}]},
+    {'queryID': 'MH2', 'keywordQuery': 'nothing', 'relevantEntities': []},
+    {'queryID': 'MH3', 'keywordQuery': 'cities', 'relevantEntities': [
+        {'label': 'Zürich', 'iri': 'Q72'}, {'label': '東京', 'iri': 'Q1490'}, {'label': 'Q12345'},
+        {'label': 'Brackets ] and, commas "quoted"'}]},
+]
+
+
+@pytest.fixture
+def raw_json(tmp_path, monkeypatch):
+    monkeypatch.setattr(data_loader, 'RAW_DIR', str(tmp_path / 'raw'))
+    monkeypatch.setattr(data_loader, 'CACHE_DIR', str(tmp_path / 'cache'))
+    os.makedirs(tmp_path / 'raw')
+    path = tmp_path / 'raw/KeySearchWiki-JSON.json'
+    path.write_text(json.dumps(RECORDS, ensure_ascii=False, indent=2), encoding='utf-8')
+    return path
+
+
+def expected_entities(records):
+    return {record['queryID']: [entity['label'] for entity in record['relevantEntities']] for record in records}
+
+
+def test_streamed_array_matches_json_load(raw_json):
+    # Chunks far smaller than a record, so decoding has to resume across reads
+    for chunk_size in (1, 7, 64, 1 << 20):
+        assert list(iter_json_array(str(raw_json), chunk_size)) == RECORDS
+
+    empty = raw_json.with_name('empty.json')
+    empty.write_text(' [ ] ')
+    assert list(iter_json_array(str(empty), 1)) == []
+
+
+def test_cache_is_reused_until_the_source_changes(raw_json, tmp_path, monkeypatch):
+    reads = []
+    iter_records = data_loader.iter_json_array
+
+    def counting_iter_json_array(path, *args):
+        reads.append(path)
+        return iter_records(path, *args)
+
+    monkeypatch.setattr(data_loader, 'iter_json_array', counting_iter_json_array)
+
+    cold = load_relevant_entities()
+    assert cold == expected_entities(RECORDS)
+    assert os.path.exists(tmp_path / 'cache/keysearch_entities.npz')
+    assert load_relevant_entities() == cold
+    assert len(reads) == 1
+
+    changed = RECORDS[:1] + [{'queryID': 'MH4', 'relevantEntities': [{'label': 'Ätna'}]}]
+    raw_json.write_text(json.dumps(changed, ensure_ascii=False), encoding='utf-8')
+    assert load_relevant_entities() == expected_entities(changed)
+    assert len(reads) == 2
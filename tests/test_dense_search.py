@@ -0,0 +1,73 @@
+import os
+
+import numpy as np
+import scipy.sparse as sp
+
+import dense_search
+import query_vectorizer
+from dense_search import build_ivf_index, normalize_rows, randomized_svd
+
+TOPICS = [
+    'volcano lava eruption magma crater ash',
+    'ocean whale shark reef coral tide',
+    'guitar band concert album drummer song',
+    'forest tree oak pine leaf moss',
+]
+
+
+def test_randomized_svd_matches_exact_svd():
+    rng = np.random.default_rng(1)
+    matrix = sp.csr_matrix(rng.random((60, 6)) @ rng.random((6, 40)))
+
+    singular_values, components = randomized_svd(matrix, 4)
+
+    _, expected_values, expected_components = np.linalg.svd(matrix.toarray(), full_matrices=False)
+    assert np.allclose(singular_values, expected_values[:4])
+    # Rows may come out with either sign
+    assert np.allclose(np.abs(components @ expected_components[:4].T), np.eye(4), atol=1e-6)
+
+
+def test_ivf_probing_every_list_is_exhaustive():
+    rng = np.random.default_rng(2)
+    vectors = normalize_rows(rng.standard_normal((500, 8))).astype(np.float32)
+    ivf = build_ivf_index(vectors, 12)
+
+    for query_vec in vectors[:20]:
+        docs, scores = ivf.search(query_vec, 10, nprobe=ivf.num_lists)
+        expected_docs, expected_scores = ivf.exhaustive_search(query_vec, 10)
+        assert docs.tolist() == expected_docs.tolist()
+        assert np.allclose(scores, expected_scores)
+
+
+def test_main_keys_the_corpus_once(tmp_path, monkeypatch):
+    os.makedirs(tmp_path / 'processed')
+    with open(tmp_path / 'processed/articles-1.txt', 'w', encoding='utf-8') as file:
+        for doc_id in range(40):
+            words = TOPICS[doc_id % len(TOPICS)].split()
+            file.write(f'.I {doc_id}\n.T\nTitle {doc_id}\n.W\n{" ".join(words[doc_id % 3:] + words[:2])}\n')
+    with open(tmp_path / 'processed/keysearch.qry', 'w', encoding='utf-8') as file:
+        for query_id, query in enumerate(['lava crater', 'whale reef', 'drummer album', 'oak moss'], 1):
+            file.write(f'.I {query_id:03}\n.W\n{query}\n')
+    monkeypatch.setattr(dense_search, 'DATA_DIR', str(tmp_path))
+    monkeypatch.setattr(query_vectorizer, 'DATA_DIR', str(tmp_path))
+
+    calls = []
+    get_cache_key = dense_search.get_cache_key
+
+    def counting_get_cache_key(*args, **kwargs):
+        calls.append(args)
+        return get_cache_key(*args, **kwargs)
+
+    monkeypatch.setattr(dense_search, 'get_cache_key', counting_get_cache_key)
+    monkeypatch.setattr(query_vectorizer, 'get_cache_key', counting_get_cache_key)
+
+    dense_search.main(rank=4, num_lists=2, nprobe=2)
+
+    assert len(calls) == 1
+    with open(tmp_path / 'results/ranking_output_lsa.txt') as file:
+        lines = file.read().splitlines()
+    assert len(lines) == 40
+    # Each query's best document is one of its own topic's
+    firsts = {line.split()[0]: int(line.split()[1]) for line in lines if line.split()[2] == '1'}
+    assert {query_id: doc_id % len(TOPICS) for query_id, doc_id in firsts.items()} == {
+        '001': 0, '002': 1, '003': 2, '004': 3}
@@ -0,0 +1,73 @@
+import os
+
+from doc_store import load_doc_store
+
+ARTICLES = [
+    (3, 'Mount Etna', 'mount etna is a volcano .\nit erupts often .'),
+    (7, 'Zürich', 'zürich is a city .'),
+    (8, '東京', 'tokyo .'),
+    (12, 'Mount Etna', 'a later article with the same title .'),
+    (40, 'Empty body', ''),
+    (41, 'Last', 'no trailing newline'),
+]
+
+
+def write_corpus(path, articles):
+    records = [f'.I {doc_id}\n.T\n{title}\n.W\n{body}' for doc_id, title, body in articles]
+    path.write_text('\n'.join(records), encoding='utf-8')
+
+
+# The dicts result_rewriter and evaluator built from the whole file before the store
+def parse_corpus(path):
+    titles, bodies = {}, {}
+    for record in path.read_text(encoding='utf-8').split('.I ')[1:]:
+        header, rest = record.split('\n.T\n', 1)
+        title, body = rest.split('\n.W\n', 1)
+        titles[int(header)] = title
+        bodies[int(header)] = body[:-1] if body.endswith('\n') else body
+    return titles, bodies
+
+
+def test_lookups_match_parsed_corpus(tmp_path):
+    corpus = tmp_path / 'all_articles.txt'
+    write_corpus(corpus, ARTICLES)
+    titles, bodies = parse_corpus(corpus)
+    ids_by_title = {title: doc_id for doc_id, title in titles.items()}
+
+    store = load_doc_store(str(corpus), str(tmp_path / 'docstore'))
+
+    assert len(store) == len(ARTICLES)
+    for doc_id in titles:
+        assert doc_id in store
+        assert store.get_title(doc_id) == titles[doc_id]
+        assert store.get_body(doc_id) == bodies[doc_id]
+    for title, doc_id in ids_by_title.items():
+        assert store.get_id(title) == doc_id
+    assert store.get_id('Mount Etna') == 12
+    for doc_id in (0, 4, 39, 42, -1):
+        assert doc_id not in store and store.get_title(doc_id) is None and store.get_body(doc_id) is None
+    assert store.get_id('Mount') is None and store.get_id('') is None
+    store.close()
+
+
+def test_store_is_rebuilt_when_the_corpus_changes(tmp_path):
+    corpus, directory = tmp_path / 'all_articles.txt', str(tmp_path / 'docstore')
+    write_corpus(corpus, ARTICLES)
+    load_doc_store(str(corpus), directory).close()
+    built = os.path.getmtime(os.path.join(directory, 'spans.npy'))
+
+    reopened = load_doc_store(str(corpus), directory)
+    assert os.path.getmtime(os.path.join(directory, 'spans.npy')) == built
+    reopened.close()
+
+    write_corpus(corpus, ARTICLES[:2] + [(5, 'Stromboli', 'another volcano .')])
+    store = load_doc_store(str(corpus), directory)
+    assert len(store) == 3
+    assert store.get_id('Stromboli') == 5 and store.get_body(5) == 'another volcano .'
+    assert store.get_id('東京') is None
+    store.close()
+
+    corpus.write_text('')
+    empty = load_doc_store(str(corpus), directory)
+    assert len(empty) == 0 and empty.get_id('Zürich') is None and empty.get_title(3) is None
+    empty.close()
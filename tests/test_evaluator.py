@@ -0,0 +1,78 @@
+import math
+
+import numpy as np
+import pytest
+
+from evaluator import Qrels, evaluate_run, evaluate_runs, get_summary
+
+K = 10
+
+
+# Straightforward per-query metrics, one query at a time
+def naive_metrics(ranked: list[int], relevant: set[int], k: int) -> dict[str, float]:
+    hits = sum(doc in relevant for doc in ranked[:k])
+    precision = hits / k
+    recall = hits / len(relevant) if relevant else 0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0
+
+    found, ap, rr = 0, 0.0, 0.0
+    for rank, doc in enumerate(ranked, 1):
+        if doc in relevant:
+            found += 1
+            ap += found / rank
+            rr = rr or 1 / rank
+    ap = ap / len(relevant) if relevant else 0
+
+    dcg = sum(1 / math.log2(rank + 1) for rank, doc in enumerate(ranked[:k], 1) if doc in relevant)
+    idcg = sum(1 / math.log2(rank + 1) for rank in range(1, min(len(relevant), k) + 1))
+    ndcg = dcg / idcg if idcg else 0
+    return {'precision': precision, 'recall': recall, 'f1': f1, 'ap': ap, 'rr': rr, 'ndcg': ndcg}
+
+
+def write_run(path, runs: dict[int, list[int]]):
+    # Queries interleaved, as in a run merged from several sources; each query's own order is kept
+    lines = sorted(((position, query_num, doc) for query_num, ranked in runs.items()
+                    for position, doc in enumerate(ranked)), key=lambda line: line[0])
+    with open(path, 'w') as file:
+        for position, query_num, doc in lines:
+            file.write(f'{query_num:03d} {doc} {position + 1} 0.5\n')
+        file.write('\n')
+
+
+@pytest.fixture
+def run(tmp_path):
+    rng = np.random.default_rng(3)
+    expected = {query_num: np.unique(rng.integers(0, 60, rng.integers(0, 8))) for query_num in range(1, 30)}
+    runs = {query_num: rng.permutation(80)[:rng.integers(1, 15)].tolist() for query_num in range(1, 33, 2)}
+    # Ranked documents past every judged id and a query with no judgments at all
+    runs[3].append(500)
+    runs[41] = [1, 2, 3]
+    path = tmp_path / 'ranking_output.txt'
+    write_run(path, runs)
+    return str(path), expected, runs
+
+
+def test_vectorized_metrics_match_naive(run):
+    path, expected, runs = run
+
+    results = evaluate_run(path, Qrels(expected), K)
+
+    assert results['query'].tolist() == sorted(runs)
+    for i, query_num in enumerate(results['query']):
+        naive = naive_metrics(runs[query_num], set(expected.get(query_num, np.empty(0)).tolist()), K)
+        for metric, value in naive.items():
+            assert results[metric][i] == pytest.approx(value), (query_num, metric)
+
+
+def test_evaluate_runs_matches_single_runs(run, tmp_path):
+    path, expected, _ = run
+    qrels = Qrels(expected)
+    empty = tmp_path / 'empty.txt'
+    empty.write_text('')
+
+    all_results = evaluate_runs([path, str(empty)], qrels, K, workers=2)
+
+    single = evaluate_run(path, qrels, K)
+    assert all(np.array_equal(all_results[0][name], values) for name, values in single.items())
+    assert len(all_results[1]['query']) == 0
+    assert get_summary(all_results[1]) == {metric: 0.0 for metric in get_summary(single)}
@@ -0,0 +1,36 @@
+import math
+
+from idf_table import build_idf_table, get_query_vector
+
+DOCUMENTS = [
+    ['volcano', 'lava', 'rock', 'lava'],
+    ['ocean', 'wave', 'rock'],
+    ['lava', 'lamp'],
+    ['ocean', 'ocean', 'whale'],
+    ['rock', 'rock', 'rock'],
+]
+
+
+# The per-term rescan build_idf_table replaced
+def legacy_idf(documents, term):
+    return math.log(len(documents) / sum(term in doc for doc in documents))
+
+
+def test_one_pass_matches_rescan():
+    # A generator: the table must not need a second pass over the documents
+    table = build_idf_table(doc for doc in DOCUMENTS)
+
+    assert table.num_docs == len(DOCUMENTS)
+    assert len(table) == len({term for doc in DOCUMENTS for term in doc})
+    for term in table.vocabulary:
+        assert table.df[table.term_id(term)] == sum(term in doc for doc in DOCUMENTS)
+        assert table.get_idf(term) == legacy_idf(DOCUMENTS, term)
+
+
+def test_unknown_terms_weigh_nothing():
+    table = build_idf_table(DOCUMENTS)
+
+    assert table.term_id('magma') is None
+    assert table.get_idf('magma') == 0.0
+    assert get_query_vector(['lava', 'magma'], {'lava': 0.5, 'magma': 0.5}, table) == [
+        0.5 * legacy_idf(DOCUMENTS, 'lava'), 0.0]
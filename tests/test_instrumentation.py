@@ -0,0 +1,45 @@
+import json
+import threading
+
+from instrumentation import Tracer
+
+
+def read_records(path):
+    with open(path) as file:
+        return [json.loads(line) for line in file]
+
+
+def test_count_from_threads_loses_nothing(tmp_path):
+    tracer = Tracer(str(tmp_path / 'trace.jsonl'))
+
+    def work():
+        for _ in range(10000):
+            tracer.count('hits')
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    tracer.flush()
+
+    records = read_records(tmp_path / 'trace.jsonl')
+    assert records[-1]['counters'] == {'hits': 80000}
+
+
+def test_stage_reports_its_own_peak_rss(tmp_path):
+    tracer = Tracer(str(tmp_path / 'trace.jsonl'))
+    with tracer.stage('big'):
+        block = bytearray(64 * 1024 * 1024)
+        for i in range(0, len(block), 4096):
+            block[i] = 1
+        del block
+    with tracer.stage('small'):
+        pass
+    tracer.flush()
+
+    big, small = [r for r in read_records(tmp_path / 'trace.jsonl') if r['type'] == 'stage']
+    assert big['peak_rss_delta_mb'] >= 32
+    # A process-wide peak would carry the first stage's allocation into this one
+    assert small['peak_rss_delta_mb'] < 32
+    assert small['peak_rss_mb'] < big['peak_rss_mb']
@@ -0,0 +1,39 @@
+from article_extractor import iter_pages_streaming, parse_pages, parse_pages_multistream
+from multistream import MultistreamStats, iter_pages_multistream, write_multistream_fixture
+
+PAGES = [(f'Page {i}', f"'''Page {i}''' links to [[Page {i + 1}]] & <b>{i}</b>.") for i in range(250)] + [
+    ('Category:Colons: in titles', 'Listed under a title with colons.'),
+    ('Redirected', '#REDIRECT [[Page 3]]'),
+    ('Quotes "and" <angles>', "Text with ''italics'' and {{a template}}."),
+]
+
+WANTED = {'Page 7', 'Page 120', 'Page 121', 'Category:Colons: in titles', 'Redirected', 'Quotes "and" <angles>',
+          'Not in the dump'}
+
+
+def write_fixture(tmp_path):
+    dump, index = tmp_path / 'dump-multistream.xml.bz2', tmp_path / 'dump-multistream-index.txt.bz2'
+    write_multistream_fixture(PAGES, str(dump), str(index), pages_per_stream=20)
+    return str(dump), str(index)
+
+
+def test_seek_finds_same_pages_as_full_pass(tmp_path):
+    dump, index = write_fixture(tmp_path)
+    stats = MultistreamStats(0)
+
+    seeked = list(iter_pages_multistream(dump, index, WANTED, stats))
+
+    full_pass = [(title, text) for title, text in iter_pages_streaming(dump, 1) if title in WANTED]
+    assert seeked == full_pass
+    assert len(seeked) == 6
+    # Page 7, pages 120 and 121 share a stream, and the last stream holds the other three
+    assert stats.streams_read == 3
+
+
+def test_multistream_extraction_matches_parse_pages(tmp_path):
+    dump, index = write_fixture(tmp_path)
+
+    pages = parse_pages_multistream(dump, index, WANTED)
+
+    assert pages == parse_pages(dump, WANTED, 1)
+    assert 'Redirected' not in pages and len(pages) == 5
@@ -0,0 +1,60 @@
+import os
+import time
+
+import pytest
+
+import parallel_scorer
+import query_vectorizer
+from idf_table import build_idf_table, get_query_vector
+from index_store import get_cache_key
+from parallel_scorer import score_parallel
+from query_vectorizer import filter_words, get_tf_scores, word_tokenizer
+
+
+@pytest.fixture
+def corpus(tmp_path, monkeypatch):
+    monkeypatch.setattr(query_vectorizer, 'DATA_DIR', str(tmp_path))
+    file_name = str(tmp_path / 'articles-1.txt')
+    with open(file_name, 'w', encoding='utf-8') as file:
+        for doc_id, text in enumerate(['volcano lava rock', 'ocean wave', 'lava lamp', 'rock music', 'ocean rock'], 1):
+            file.write(f'.I {doc_id}\n.T\ntitle\n.W\n{text}\n')
+    queries = filter_words([['lava'], ['ocean', 'rock'], ['music'], ['volcano', 'ocean']])
+    query_tf = get_tf_scores(queries)
+    query_idf = build_idf_table(queries)
+    query_vecs = [get_query_vector(query, query_tf[qid], query_idf) for qid, query in enumerate(queries)]
+    return file_name, queries, query_vecs, ['001', '002', '003', '004']
+
+
+def test_ranking_in_query_order(tmp_path, corpus):
+    file_name, queries, query_vecs, query_ids = corpus
+    output_path = str(tmp_path / 'results/ranking.txt')
+    worker_rss = score_parallel(file_name, queries, query_vecs, query_ids, output_path, k=2, workers=2, chunk_size=1,
+                                cache_key=get_cache_key(file_name, word_tokenizer))
+
+    assert len(worker_rss) == 2
+    with open(output_path) as file:
+        lines = file.read().splitlines()
+    assert [line.split()[0] for line in lines] == ['001', '001', '002', '002', '003', '003', '004', '004']
+    assert lines[0].split()[1] in ('1', '3')
+
+
+def test_worker_that_dies_fails_the_run(tmp_path, corpus, monkeypatch):
+    file_name, queries, query_vecs, query_ids = corpus
+    # Workers are forked, so they pick this up: the first chunk kills its worker outright
+    monkeypatch.setattr(parallel_scorer, 'top_documents', lambda *args: os._exit(3))
+
+    start = time.perf_counter()
+    with pytest.raises(RuntimeError, match='exited with code 3'):
+        score_parallel(file_name, queries, query_vecs, query_ids, str(tmp_path / 'results/ranking.txt'), workers=2,
+                       chunk_size=1, poll_interval=0.1)
+    assert time.perf_counter() - start < 30
+
+
+def test_worker_that_cannot_open_the_index_fails_the_run(tmp_path, corpus, monkeypatch):
+    file_name, queries, query_vecs, query_ids = corpus
+    # As if the index were rebuilt under another key between load_index and the workers starting
+    monkeypatch.setattr(parallel_scorer, 'open_index', lambda *args: None)
+
+    with pytest.raises(RuntimeError, match='No index for cache key'):
+        score_parallel(file_name, queries, query_vecs, query_ids, str(tmp_path / 'results/ranking.txt'), workers=1,
+                       poll_interval=0.1)
@@ -0,0 +1,39 @@
+import numpy as np
+
+import postings_codec
+import query_vectorizer
+from postings_codec import check_round_trip, load_compressed_index
+from query_vectorizer import load_index
+
+
+def test_round_trip():
+    assert check_round_trip(random_cases=5) == []
+
+
+def test_compressed_index_matches_raw_index(tmp_path, monkeypatch):
+    monkeypatch.setattr(query_vectorizer, 'DATA_DIR', str(tmp_path))
+    monkeypatch.setattr(postings_codec, 'DATA_DIR', str(tmp_path))
+    file_name = str(tmp_path / 'articles-1.txt')
+    rng = np.random.default_rng(0)
+    words = [f'word{i}' for i in range(300)]
+    with open(file_name, 'w', encoding='utf-8') as file:
+        for doc_id in range(500):
+            text = ' '.join(rng.choice(words, int(rng.integers(1, 60)), p=np.arange(300, 0, -1) / 45150))
+            file.write(f'.I {doc_id}\n.T\ntitle\n.W\n{text}\n')
+
+    index, doc_idf = load_index(file_name)
+    compressed = load_compressed_index(file_name, block_size=16)
+
+    decoded = compressed.to_inverted_index()
+    assert np.array_equal(decoded.offsets, index.offsets)
+    assert np.array_equal(decoded.doc_indices, index.doc_indices)
+    # Bit for bit, not approximately
+    assert np.array_equal(decoded.weights, index.weights)
+    assert np.array_equal(compressed.norms, index.norms)
+    assert np.array_equal(compressed.idf_table.idf, doc_idf.idf)
+    for term in ('word0', 'word7', 'word299', 'missing'):
+        for got, expected in zip(compressed.postings(term), index.postings(term)):
+            assert np.array_equal(got, expected)
+
+    # Opened from the cache the second time
+    assert load_compressed_index(file_name, block_size=16).compressed.num_postings == len(index.doc_indices)
@@ -0,0 +1,131 @@
+import math
+import os
+
+import numpy as np
+import pytest
+
+import query_vectorizer
+from index_store import get_cache_key
+from query_vectorizer import filter_words, parse_documents
+
+ARTICLES = [
+    ('11', 'Volcanoes erupt lava, ash and rock.'),
+    ('12', 'Lava flows from the volcano into the sea.'),
+    ('13', 'The sea is home to whales and sharks.'),
+    ('14', 'Whales sing; whales migrate; whales feed.'),
+    ('15', 'Rock music from the 1970s.'),
+    ('16', 'A well-known rock-and-roll band toured the world.'),
+    ('17', 'Sharks, rays and other fish.'),
+    ('18', 'Ash trees grow in temperate forests.'),
+    ('19', 'Forests cover a third of the land.'),
+    ('20', 'Nothing here matches anything.'),
+    ('21', 'Volcano volcano volcano.'),
+    ('22', 'The band played music by the sea.'),
+    ('23', 'Temperate climates have four seasons.'),
+    ('24', 'Lava lamps were popular in the 1970s.'),
+]
+
+QUERIES = [
+    ('001', 'volcano lava'),
+    ('002', 'whales and sharks in the sea'),
+    ('003', 'rock music band'),
+    ('004', 'temperate forests'),
+    ('005', 'quantum chromodynamics'),
+    ('006', 'lava lava rock'),
+]
+
+
+def write_collection(path, entries, title=True):
+    with open(path, 'w', encoding='utf-8') as file:
+        for entry_id, text in entries:
+            file.write(f'.I {entry_id}\n')
+            if title:
+                file.write(f'.T\nTitle {entry_id}\n')
+            file.write(f'.W\n{text}\n')
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    os.makedirs(tmp_path / 'processed')
+    write_collection(tmp_path / 'processed/articles-1.txt', ARTICLES)
+    write_collection(tmp_path / 'processed/keysearch.qry', QUERIES, title=False)
+    monkeypatch.setattr(query_vectorizer, 'DATA_DIR', str(tmp_path))
+    return tmp_path
+
+
+def get_idf_dicts(documents):
+    sets = [set(doc) for doc in documents]
+    return [{t: math.log(len(documents) / sum(t in s for s in sets)) for t in doc} for doc in documents]
+
+
+def get_tf_dicts(documents):
+    return [{word: doc.count(word) / len(doc) for word in doc} for doc in documents]
+
+
+# The full scan query_vectorizer.main ran before the inverted index: every query against every document
+def legacy_ranking(data_dir) -> str:
+    queries, query_ids = parse_documents(os.path.join(data_dir, 'processed/keysearch.qry'))
+    queries = filter_words(queries)
+    documents, doc_ids = parse_documents(os.path.join(data_dir, 'processed/articles-1.txt'))
+    documents = filter_words(documents)
+    query_idf, query_tf = get_idf_dicts(queries), get_tf_dicts(queries)
+    doc_idf, doc_tf = get_idf_dicts(documents), get_tf_dicts(documents)
+
+    lines = []
+    for qid, query in enumerate(queries):
+        sims = []
+        for doc_idx, document in enumerate(documents):
+            b = np.array([doc_tf[doc_idx][w] * doc_idf[doc_idx][w] if w in document else 0 for w in query])
+            a = np.array([query_tf[qid][w] * query_idf[qid][w] for w in query])
+            norm_a, norm_b = np.linalg.norm(a), np.linalg.norm(b)
+            cos_similarity = 0
+            if norm_a != 0 and norm_b != 0:
+                cos_similarity = np.dot(a, b) / (norm_a * norm_b)
+            if math.isnan(cos_similarity):
+                cos_similarity = 0
+            sims.append((doc_ids[doc_idx], float(cos_similarity)))
+        sims.sort(key=lambda x: x[1], reverse=True)
+        for rank, (doc_id, sim_score) in enumerate(sims[:10]):
+            lines.append(f'{query_ids[qid]} {doc_id} {rank + 1} {sim_score}\n')
+    return ''.join(lines)
+
+
+def read_ranking(data_dir) -> str:
+    with open(os.path.join(data_dir, 'results/ranking_output.txt')) as file:
+        return file.read()
+
+
+def test_ranking_matches_full_scan(data_dir):
+    query_vectorizer.main()
+
+    assert read_ranking(data_dir) == legacy_ranking(data_dir)
+
+
+def test_cold_and_warm_index_agree(data_dir):
+    file_name = os.path.join(data_dir, 'processed/articles-1.txt')
+    cold, _ = query_vectorizer.load_index(file_name)
+    warm, _ = query_vectorizer.load_index(file_name)
+
+    assert dict(cold.vocabulary.items()) == dict(warm.vocabulary.items())
+    assert list(cold.doc_ids) == list(warm.doc_ids)
+    assert np.array_equal(cold.weights, warm.weights)
+
+    query_vectorizer.main()
+    first = read_ranking(data_dir)
+    query_vectorizer.main()
+    assert read_ranking(data_dir) == first
+
+
+def test_cache_key_follows_corpus(data_dir):
+    file_name = os.path.join(data_dir, 'processed/articles-1.txt')
+    tokenizer = query_vectorizer.word_tokenizer
+    key, hashed = get_cache_key(file_name, tokenizer), get_cache_key(file_name, tokenizer, full_hash=True)
+
+    os.utime(file_name, ns=(0, 0))
+    # Same bytes: only the full hash still recognises the corpus
+    assert get_cache_key(file_name, tokenizer) != key
+    assert get_cache_key(file_name, tokenizer, full_hash=True) == hashed
+
+    with open(file_name, 'a', encoding='utf-8') as file:
+        file.write('.I 99\n.T\nTitle 99\n.W\nOne more article.\n')
+    assert get_cache_key(file_name, tokenizer, full_hash=True) != hashed
@@ -0,0 +1,77 @@
+import asyncio
+import json
+import os
+import socket
+
+import query_vectorizer
+import search_service
+
+
+def write_corpus(path, docs):
+    with open(path, 'w', encoding='utf-8') as file:
+        for doc_id, text in docs.items():
+            file.write(f'.I {doc_id}\n.T\ntitle {doc_id}\n.W\n{text}\n')
+
+
+def get_free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+async def request(port, payload):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(json.dumps(payload).encode('utf-8') + b'\n')
+    await writer.drain()
+    response = json.loads(await reader.readline())
+    writer.close()
+    return response
+
+
+async def wait_for(predicate, timeout=20.0):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not await predicate():
+        assert loop.time() < deadline
+        await asyncio.sleep(0.1)
+
+
+def test_rebuilt_index_is_served(tmp_path, monkeypatch):
+    monkeypatch.setattr(query_vectorizer, 'DATA_DIR', str(tmp_path))
+    file_name = str(tmp_path / 'articles-1.txt')
+    write_corpus(file_name, {'1': 'volcano eruption lava', '2': 'ocean tide', '3': 'desert sand'})
+    port = get_free_port()
+
+    async def run():
+        server = asyncio.create_task(search_service.serve(file_name, port=port, workers=1, watch_interval=0.1))
+        try:
+            async def serving():
+                try:
+                    return 'results' in await request(port, {'query': 'volcano', 'k': 3})
+                except OSError:
+                    return False
+            await wait_for(serving)
+            assert [doc_id for doc_id, _ in (await request(port, {'query': 'volcano', 'k': 3}))['results']] == ['1']
+
+            old_files = {name: os.stat(tmp_path / 'cache/index/articles-1' / name).st_ino
+                         for name in os.listdir(tmp_path / 'cache/index/articles-1')}
+            write_corpus(file_name, {'7': 'ocean volcano island', '8': 'mountain snow', '9': 'forest rain',
+                                     '10': 'river delta'})
+
+            async def reloaded():
+                results = (await request(port, {'query': 'volcano', 'k': 3}))['results']
+                return [doc_id for doc_id, _ in results] == ['7']
+            await wait_for(reloaded)
+
+            # Every file was replaced by a new one rather than rewritten in place
+            for name, inode in old_files.items():
+                assert os.stat(tmp_path / 'cache/index/articles-1' / name).st_ino != inode
+
+            cache = (await request(port, {'stats': True}))['stats']['cache']
+            assert cache['invalidations'] == 1
+            assert 'bytes' not in cache
+        finally:
+            server.cancel()
+            await asyncio.gather(server, return_exceptions=True)
+
+    asyncio.run(run())
@@ -0,0 +1,101 @@
+import pytest
+
+import segments
+from segments import SegmentedIndex
+
+
+def write_shard(path, docs):
+    with open(path, 'w', encoding='utf-8') as file:
+        for doc_id, text in docs.items():
+            file.write(f'.I {doc_id}\n.T\ntitle {doc_id}\n.W\n{text}\n')
+
+
+SHARD_1 = {'101': 'red apple pie', '102': 'green apple tart', '103': 'blue sky'}
+SHARD_2 = {'201': 'zanzibar spice island', '202': 'apple orchard harvest', '203': 'green valley'}
+
+
+def test_reingested_shard_drops_removed_documents(tmp_path):
+    write_shard(tmp_path / 'articles-1.txt', SHARD_1)
+    write_shard(tmp_path / 'articles-2.txt', SHARD_2)
+    index = SegmentedIndex(str(tmp_path / 'segments'))
+    index.add_shard(str(tmp_path / 'articles-1.txt'))
+    index.add_shard(str(tmp_path / 'articles-2.txt'))
+    assert index.search(['zanzibar'], 3)[0][0] == '201'
+
+    changed = {'202': 'apple orchard', '204': 'new document about a valley'}
+    write_shard(tmp_path / 'articles-2.txt', changed)
+    index.add_shard(str(tmp_path / 'articles-2.txt'))
+
+    assert '201' not in index.doc_locations
+    assert '203' not in index.doc_locations
+    assert index.search(['zanzibar'], 3) == []
+
+    # Same statistics and scores as an index built straight from the current shards
+    write_shard(tmp_path / 'fresh-2.txt', changed)
+    fresh = SegmentedIndex(str(tmp_path / 'fresh'))
+    fresh.add_shard(str(tmp_path / 'articles-1.txt'))
+    fresh.add_shard(str(tmp_path / 'fresh-2.txt'))
+    assert index.num_docs == fresh.num_docs == 5
+    assert +index.global_df == +fresh.global_df
+    # Queries are token lists as the tokenizer leaves them, i.e. stemmed
+    for query in (['appl'], ['green', 'valley'], ['orchard', 'appl', 'appl']):
+        assert index.search(query, 5) == fresh.search(query, 5) != []
+
+    reopened = SegmentedIndex(str(tmp_path / 'segments'))
+    assert sorted(reopened.doc_locations) == ['101', '102', '103', '202', '204']
+    assert reopened.num_docs == 5
+    assert +reopened.global_df == +fresh.global_df
+
+
+def test_document_moved_to_another_shard_survives_its_old_shard(tmp_path):
+    write_shard(tmp_path / 'articles-1.txt', SHARD_1)
+    write_shard(tmp_path / 'articles-2.txt', SHARD_2)
+    index = SegmentedIndex(str(tmp_path / 'segments'))
+    index.add_shard(str(tmp_path / 'articles-1.txt'))
+    index.add_shard(str(tmp_path / 'articles-2.txt'))
+
+    write_shard(tmp_path / 'articles-3.txt', {'101': 'red apple crumble'})
+    index.add_shard(str(tmp_path / 'articles-3.txt'))
+    write_shard(tmp_path / 'articles-1.txt', {'102': 'green apple tart', '103': 'blue sky'})
+    index.add_shard(str(tmp_path / 'articles-1.txt'))
+
+    assert index.search(['crumbl'], 3)[0][0] == '101'
+    assert index.num_docs == 6
+
+    while index.maybe_merge():
+        pass
+    assert sorted(index.doc_locations) == ['101', '102', '103', '201', '202', '203']
+    assert index.num_docs == 6
+
+
+def test_crash_before_manifest_keeps_old_documents(tmp_path, monkeypatch):
+    write_shard(tmp_path / 'articles-1.txt', SHARD_1)
+    write_shard(tmp_path / 'articles-2.txt', SHARD_2)
+    index = SegmentedIndex(str(tmp_path / 'segments'))
+    index.add_shard(str(tmp_path / 'articles-1.txt'))
+    index.add_shard(str(tmp_path / 'articles-2.txt'))
+    index.delete('103')
+
+    write_shard(tmp_path / 'articles-2.txt', {'202': 'apple orchard'})
+
+    dump = segments.json.dump
+
+    # Dies writing segments.json, after everything else the re-ingest writes
+    def crash(data, file, *args, **kwargs):
+        if 'segments' in data:
+            raise OSError('disk full')
+        return dump(data, file, *args, **kwargs)
+
+    monkeypatch.setattr(segments.json, 'dump', crash)
+    with pytest.raises(OSError):
+        index.add_shard(str(tmp_path / 'articles-2.txt'))
+    monkeypatch.undo()
+
+    # Everything the last saved manifest had is still live, tombstones included
+    reopened = SegmentedIndex(str(tmp_path / 'segments'))
+    assert sorted(reopened.doc_locations) == ['101', '102', '201', '202', '203']
+    assert reopened.num_docs == 5
+    assert reopened.search(['zanzibar'], 3)[0][0] == '201'
+
+    reopened.add_shard(str(tmp_path / 'articles-2.txt'))
+    assert sorted(SegmentedIndex(str(tmp_path / 'segments')).doc_locations) == ['101', '102', '202']
@@ -0,0 +1,90 @@
+import os
+
+import pytest
+
+import query_vectorizer
+import shard_search
+from inverted_index import get_query_weights
+from query_vectorizer import filter_words, get_tf_scores, load_index
+from shard_search import ShardCoordinator, start_local_shards
+from topk import exhaustive_top_k
+
+SHARDS = [
+    ['volcano lava rock', 'ocean wave rock', 'lava lamp', 'ocean ocean whale'],
+    ['rock music band', 'volcano ash cloud', 'whale song'],
+    ['lava field', 'band tour ocean liner', 'rock rock rock'],
+]
+QUERIES = [['lava', 'rock'], ['ocean', 'whale'], ['band', 'music'], ['nothing']]
+
+
+@pytest.fixture
+def shard_files(tmp_path, monkeypatch):
+    monkeypatch.setattr(shard_search, 'DATA_DIR', str(tmp_path))
+    monkeypatch.setattr(query_vectorizer, 'DATA_DIR', str(tmp_path))
+    file_names = []
+    doc_id = 1
+    with open(tmp_path / 'all.txt', 'w', encoding='utf-8') as all_file:
+        for shard, texts in enumerate(SHARDS, 1):
+            file_name = str(tmp_path / f'articles-{shard}.txt')
+            with open(file_name, 'w', encoding='utf-8') as file:
+                for text in texts:
+                    record = f'.I {doc_id}\n.T\ntitle\n.W\n{text}\n'
+                    file.write(record)
+                    all_file.write(record)
+                    doc_id += 1
+            file_names.append(file_name)
+    return file_names, str(tmp_path / 'all.txt')
+
+
+@pytest.fixture
+def coordinator(shard_files):
+    connections, processes = start_local_shards(shard_files[0])
+    coordinator = ShardCoordinator(connections)
+    yield coordinator, processes
+    coordinator.close()
+    for process in processes:
+        process.join()
+
+
+def expected_ranking(all_file, query_tf, k):
+    index, doc_idf = load_index(all_file)
+    return [[(index.doc_ids[doc], score)
+             for doc, score in exhaustive_top_k(index, get_query_weights(index, tf, doc_idf), k) if score > 0]
+            for tf in query_tf]
+
+
+def assert_same_ranking(actual, expected):
+    assert [[doc_id for doc_id, _ in hits] for hits in actual] == [[doc_id for doc_id, _ in hits] for hits in expected]
+    for hits, expected_hits in zip(actual, expected):
+        assert [score for _, score in hits] == pytest.approx([score for _, score in expected_hits])
+
+
+def test_merged_ranking_matches_concatenated_corpus(shard_files, coordinator):
+    coordinator, _ = coordinator
+    query_tf = get_tf_scores(filter_words(QUERIES))
+
+    global_idf = coordinator.exchange_statistics()
+
+    assert global_idf.num_docs == sum(len(texts) for texts in SHARDS)
+    assert_same_ranking(coordinator.search(query_tf, global_idf, 3), expected_ranking(shard_files[1], query_tf, 3))
+
+
+def test_failed_shard_keeps_replies_in_step(shard_files, coordinator):
+    coordinator, _ = coordinator
+    query_tf = get_tf_scores(filter_words(QUERIES))
+
+    with pytest.raises(RuntimeError, match='Shard 0 failed'):
+        coordinator.broadcast([('bogus',), ('stats',), ('stats',)])
+
+    global_idf = coordinator.exchange_statistics()
+    assert_same_ranking(coordinator.search(query_tf, global_idf, 3), expected_ranking(shard_files[1], query_tf, 3))
+
+
+def test_dead_shard_fails_the_request_and_close(coordinator):
+    coordinator, processes = coordinator
+    processes[1].kill()
+    processes[1].join()
+
+    with pytest.raises(RuntimeError, match='Shard 1 failed'):
+        coordinator.exchange_statistics()
+    coordinator.close()
@@ -0,0 +1,52 @@
+import random
+
+import numpy as np
+
+import query_vectorizer
+import spimi_index
+from index_store import open_index
+from query_vectorizer import load_index
+from spimi_index import build_index_external, get_files_cache_key
+
+WORDS = ['volcano', 'lava', 'ocean', 'whale', 'rock', 'band', 'forest', 'river', 'mountain', 'city', 'music',
+         'history', 'science', 'planet', 'star', 'garden', 'winter', 'summer', 'bridge', 'castle']
+
+
+def write_corpus(path, num_docs, seed):
+    rng = random.Random(seed)
+    with open(path, 'w', encoding='utf-8') as file:
+        for doc_id in range(num_docs):
+            words = [rng.choice(WORDS) + rng.choice(['', 's', rng.choice(WORDS), str(rng.randint(0, 60))])
+                     for _ in range(rng.randint(3, 40))]
+            file.write(f'.I {doc_id}\n.T\nTitle {doc_id}\n.W\n{" ".join(words)}\n')
+
+
+def test_external_build_matches_load_index(tmp_path, monkeypatch):
+    monkeypatch.setattr(query_vectorizer, 'DATA_DIR', str(tmp_path))
+    file_name = str(tmp_path / 'articles-1.txt')
+    write_corpus(file_name, 700, seed=3)
+
+    run_counts = []
+    merge_runs = spimi_index.merge_runs
+
+    def counting_merge_runs(run_dirs, *args):
+        run_counts.append(len(run_dirs))
+        return merge_runs(run_dirs, *args)
+
+    monkeypatch.setattr(spimi_index, 'merge_runs', counting_merge_runs)
+    output_dir = str(tmp_path / 'spimi')
+    cache_key = get_files_cache_key([file_name])
+    build_index_external([file_name], output_dir, memory_budget_mb=0.02, cache_key=cache_key)
+    assert run_counts[0] > 1
+
+    spimi, spimi_idf = open_index(output_dir, cache_key)
+    index, idf = load_index(file_name, cache_key)
+
+    assert list(spimi.vocabulary.items()) == list(index.vocabulary.items())
+    assert list(spimi.doc_ids) == list(index.doc_ids)
+    for name in ['offsets', 'doc_indices', 'weights']:
+        assert np.array_equal(getattr(spimi, name), getattr(index, name)), name
+    assert np.array_equal(spimi_idf.df, idf.df) and np.array_equal(spimi_idf.idf, idf.idf)
+    assert spimi_idf.num_docs == idf.num_docs
+    # Summed in a different term order, see merge_runs
+    np.testing.assert_array_max_ulp(spimi.norms, index.norms, maxulp=4)
@@ -0,0 +1,62 @@
+from nltk.stem import PorterStemmer
+
+from query_vectorizer import punctuation, stop_list
+from tokenizer import Tokenizer
+
+WORDS = [
+    'The', 'Volcanoes', 'erupted,', '(lava)', 'and/or', 'and', 'I', 'well-known', 'rock--and--roll', '-', '--',
+    "don't", '"quoted"', 'e.g.', '...', '1970s', 'A4', '²nd', 'x٣', '１２', 'Ⅻ', 'naïve', 'Café', 'CAFÉ-au-lait',
+    'Straße', 'Ελληνικά', 'Москва', '東京', 'über-cool', 'fish;', 'why?', '&', 'AT&T', '=', '', ' ', '\n',
+    "'''bold'''", 'running', 'Runs', 'ponies', 'caresses', '-leading', 'trailing-', 'mid-1990s', 'R2-D2',
+]
+
+
+# filter_words as it was before the Tokenizer
+def legacy_filter_words(document_set: list[list[str]]):
+    filtered_docs = []
+    ps = PorterStemmer()
+    for doc in document_set:
+        filtered_doc = []
+        for word in doc:
+            if word in punctuation:
+                continue
+            if any(c.isdigit() for c in word):
+                continue
+            for punc in punctuation:
+                word = word.replace(punc, '')
+            if word == '':
+                continue
+            if word in stop_list:
+                continue
+            word = word.replace('--', '-')
+            if '-' in word:
+                for part in word.split('-'):
+                    if part.strip() != '':
+                        filtered_doc.append(ps.stem(part.lower()))
+            else:
+                filtered_doc.append(ps.stem(word.lower()))
+        filtered_docs.append(filtered_doc)
+    return filtered_docs
+
+
+def test_tokens_match_legacy_filter_words():
+    tokenizer = Tokenizer(stop_list, punctuation)
+    documents = [WORDS, WORDS[::-1], [word.upper() for word in WORDS],
+                 [word.strip() for word in ' '.join(WORDS).split(' ')]]
+
+    assert [tokenizer.tokenize(doc) for doc in documents] == legacy_filter_words(documents)
+    # Second pass comes from the cache
+    assert tokenizer.hits > 0
+    assert [tokenizer.tokenize(doc) for doc in documents] == legacy_filter_words(documents)
+
+
+def test_saved_cache_round_trips(tmp_path):
+    tokenizer = Tokenizer(stop_list, punctuation)
+    expected = tokenizer.tokenize(WORDS)
+    tokenizer.save(str(tmp_path / 'stems.json'))
+
+    reloaded = Tokenizer(stop_list, punctuation)
+    assert reloaded.load(str(tmp_path / 'stems.json'))
+    assert reloaded.tokenize(WORDS) == expected
+    assert reloaded.misses == 0
+    assert not Tokenizer(stop_list + ['volcano'], punctuation).load(str(tmp_path / 'stems.json'))
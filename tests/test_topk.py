@@ -0,0 +1,31 @@
+import random
+
+from idf_table import build_idf_table
+from inverted_index import build_inverted_index
+from topk import TopKEngine, exhaustive_top_k
+
+
+def make_index(num_docs=400, vocabulary_size=60, seed=7):
+    rng = random.Random(seed)
+    # Zipf-ish: low word ids show up in most documents, high ones in few
+    documents = [[f'w{min(int(rng.paretovariate(0.8)) - 1, vocabulary_size - 1)}' for _ in range(rng.randint(1, 25))]
+                 for _ in range(num_docs)]
+    doc_tf = [{word: float(words.count(word)) for word in words} for words in documents]
+    return build_inverted_index(doc_tf, build_idf_table(documents), [str(i) for i in range(num_docs)])
+
+
+def test_matches_exhaustive_and_skips_postings():
+    index = make_index()
+    engine = TopKEngine(index)
+    rng = random.Random(1)
+    scored = total = 0
+    for _ in range(50):
+        query = {rng.randrange(len(index.vocabulary)): rng.uniform(0.1, 3.0) for _ in range(rng.randint(1, 6))}
+        result = engine.search(query, k=10)
+        expected = [(doc, score) for doc, score in exhaustive_top_k(index, query, k=10) if score > 0]
+        assert result.hits[:len(expected)] == expected
+        assert result.postings_scored <= result.postings_total
+        scored += result.postings_scored
+        total += result.postings_total
+    assert scored < total
+
@@ -0,0 +1,40 @@
+import random
+
+import mwparserfromhell
+import pytest
+
+from article_extractor import compare_strip_engines
+from wikitext import strip_code_fast
+
+# Pieces of markup glued together at random, weighted towards the shapes the fast path has to get right
+# or give up on: quotes around and inside links, templates, refs, comments and line starts
+FRAGMENTS = [
+    "''", "'''", "[[", "]]", "[[ ", " ]]", "''[[", "'' ]]", "|", "{{", "}}", "[[A]]", "[[A|b]]", "[[A|''b'']]",
+    "[[Category:C]]", "{{t|x=1}}", "''i''", "'''b'''", "<ref>", "</ref>", "<ref name=a/>", "<!--", "-->",
+    "Category:C", "http://e.com", "&amp;", "Title", "word", "a", "x", " ", "\n", "\n\n", "* ", "# ", ":", "==",
+    "= ", "-", ".", ",",
+]
+
+
+def generate_pages(count: int, seed=0) -> list[tuple[str, str]]:
+    rng = random.Random(seed)
+    return [(f'Page {i}', ''.join(rng.choice(FRAGMENTS) for _ in range(rng.randint(1, 14)))) for i in range(count)]
+
+
+def test_fast_path_matches_mwparserfromhell():
+    result = compare_strip_engines(generate_pages(20000))
+
+    assert result['mismatches'] == 0
+    assert result['fast_pages'] > 1000
+
+
+@pytest.mark.parametrize('text', [
+    "[[Category:C]] ''[[ ''* ]]\n",
+    "''[[.'' ]]= ''word''",
+    "[[A|''b'']]",
+    "<!--{{t|x=1}}]]\n= '''b'''-->= ",
+])
+def test_found_by_fuzzing(text):
+    fast = strip_code_fast(text)
+
+    assert fast is None or fast == mwparserfromhell.parse(text).strip_code()